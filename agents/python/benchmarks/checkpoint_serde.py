@@ -0,0 +1,181 @@
+"""
+Checkpoint serialization benchmark.
+
+Replays the checkpoints of a synthetic 30-turn research thread (search,
+download, report rewrite and chart resources on every turn) through the
+default LangGraph serializer and the delta serializer, and reports bytes
+stored per checkpoint and serialize/deserialize time.
+
+Run from agents/python:
+
+    python -m benchmarks.checkpoint_serde [--turns 30]
+"""
+
+import argparse
+import random
+import statistics
+import time
+import uuid
+from typing import Any, Dict, List
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from src.lib.serde import DeltaSerializer, MemoryBlobStore
+
+_WORDS = (
+    "market growth revenue inflation rate policy energy demand supply data analysis trend "
+    "forecast share index quarter annual region capacity investment consumer price output"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _checkpoint(state: Dict[str, Any], step: int) -> Dict[str, Any]:
+    """A checkpoint shaped like the ones AsyncSqliteSaver serializes whole."""
+    return {
+        "v": 4,
+        "id": str(uuid.uuid4()),
+        "ts": "2024-01-01T00:00:00+00:00",
+        "channel_values": {key: value for key, value in state.items()},
+        "channel_versions": {key: f"{step:032}.0" for key in state},
+        "versions_seen": {"chat_node": {key: f"{step:032}.0" for key in state}},
+    }
+
+
+def simulate_thread(turns: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Checkpoints of one thread: input, search, download and chat steps per turn."""
+    rng = random.Random(seed)
+    state: Dict[str, Any] = {
+        "messages": [],
+        "model": "openai",
+        "research_question": "",
+        "report": "",
+        "resources": [],
+        "logs": [],
+    }
+    checkpoints = []
+    step = 0
+
+    def snapshot() -> None:
+        nonlocal step
+        step += 1
+        # Channel values are replaced, never mutated in place, between steps
+        checkpoints.append(_checkpoint({k: (list(v) if isinstance(v, list) else v) for k, v in state.items()}, step))
+
+    for turn in range(turns):
+        state["messages"] = state["messages"] + [HumanMessage(content=_text(rng, 30), id=str(uuid.uuid4()))]
+        state["research_question"] = _text(rng, 12)
+        snapshot()
+
+        call_id = str(uuid.uuid4())
+        state["messages"] = state["messages"] + [
+            AIMessage(
+                content="",
+                id=str(uuid.uuid4()),
+                tool_calls=[{"id": call_id, "name": "Search", "args": {"queries": [_text(rng, 6) for _ in range(3)]}}],
+            )
+        ]
+        state["logs"] = [{"message": f"Web search: {_text(rng, 5)}", "done": True} for _ in range(4)]
+        snapshot()
+
+        state["resources"] = state["resources"] + [
+            {
+                "url": f"https://example.com/{turn}/{i}",
+                "title": _text(rng, 6),
+                "description": _text(rng, 60),
+                "resource_type": "web",
+            }
+            for i in range(3)
+        ] + [
+            {
+                "url": f"https://tako.com/card/{turn}",
+                "title": _text(rng, 6),
+                "description": _text(rng, 40),
+                "resource_type": "tako_chart",
+                "card_id": uuid.uuid4().hex,
+                "chart_id": uuid.uuid4().hex[:16],
+                "embed_url": f"https://tako.com/embed/{turn}",
+            }
+        ]
+        state["messages"] = state["messages"] + [
+            ToolMessage(content="Added 4 resources", tool_call_id=call_id, id=str(uuid.uuid4()))
+        ]
+        state["logs"] = []
+        snapshot()
+
+        report_id = str(uuid.uuid4())
+        state["report"] = state["report"] + f"\n\n## Section {turn}\n\n{_text(rng, 250)}"
+        state["messages"] = state["messages"] + [
+            AIMessage(
+                content="",
+                id=str(uuid.uuid4()),
+                tool_calls=[{"id": report_id, "name": "WriteReport", "args": {"report": state["report"]}}],
+            ),
+            ToolMessage(content="Report written.", tool_call_id=report_id, id=str(uuid.uuid4())),
+            AIMessage(content=_text(rng, 80), id=str(uuid.uuid4())),
+        ]
+        snapshot()
+
+    return checkpoints
+
+
+def run(serde, checkpoints: List[Dict[str, Any]], label: str) -> Dict[str, Any]:
+    store = getattr(serde, "store", None)
+    payloads, dump_times, load_times = [], [], []
+    blob_bytes = 0
+    for checkpoint in checkpoints:
+        stored_before = _stored_bytes(store)
+        started = time.perf_counter()
+        payloads.append(serde.dumps_typed(checkpoint))
+        dump_times.append(time.perf_counter() - started)
+        blob_bytes += _stored_bytes(store) - stored_before
+
+    for payload in payloads:
+        started = time.perf_counter()
+        serde.loads_typed(payload)
+        load_times.append(time.perf_counter() - started)
+
+    checkpoint_bytes = sum(len(payload) for _, payload in payloads)
+    total = checkpoint_bytes + blob_bytes
+    return {
+        "label": label,
+        "checkpoints": len(checkpoints),
+        "total_kb": total / 1024,
+        "per_checkpoint_kb": total / len(checkpoints) / 1024,
+        "last_checkpoint_kb": len(payloads[-1][1]) / 1024,
+        "dump_ms": statistics.mean(dump_times) * 1000,
+        "load_ms": statistics.mean(load_times) * 1000,
+    }
+
+
+def _stored_bytes(store) -> int:
+    if store is None:
+        return 0
+    return sum(len(data) for data in store._blobs.values())  # pylint: disable=protected-access
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--turns", type=int, default=30)
+    args = parser.parse_args()
+
+    checkpoints = simulate_thread(args.turns)
+    results = [
+        run(JsonPlusSerializer(), checkpoints, "default (msgpack)"),
+        run(DeltaSerializer(MemoryBlobStore()), checkpoints, f"delta ({DeltaSerializer().codec.name})"),
+    ]
+
+    print(f"{args.turns}-turn thread, {len(checkpoints)} checkpoints")
+    print(f"{'serializer':<20}{'total KB':>12}{'KB/ckpt':>10}{'last KB':>10}{'dump ms':>10}{'load ms':>10}")
+    for r in results:
+        print(
+            f"{r['label']:<20}{r['total_kb']:>12.1f}{r['per_checkpoint_kb']:>10.2f}"
+            f"{r['last_checkpoint_kb']:>10.2f}{r['dump_ms']:>10.3f}{r['load_ms']:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
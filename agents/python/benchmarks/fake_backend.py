@@ -0,0 +1,491 @@
+"""
+Stand-in backend for offline benchmarks.
+
+One aiohttp server playing every external service the agent talks to, with
+configurable latency:
+
+- an OpenAI-compatible ``/v1/chat/completions`` (plain and streamed) running a
+  scripted research turn: WriteResearchQuestion, GenerateDataQuestions,
+  Search, WriteReport, then a short follow-up; ExtractResources picks results
+  the backend itself served, and tool-less calls (history summaries, chart
+  marker placement) get a text answer
+- an MCP server over SSE (``/sse`` + ``/messages/``) with knowledge_search,
+  explore_knowledge_graph and open_chart_ui
+- Tavily ``/search``
+- HTML pages (``/page/{id}``, ``/card/{id}``) for the download node
+
+Point the agent at it with OPENAI_BASE_URL=http://HOST:PORT/v1,
+TAKO_MCP_URL=http://HOST:PORT and TAVILY_API_BASE_URL=http://HOST:PORT
+(benchmarks/graph_turns.py does this itself). ``/stats`` returns request
+counts per route. With --throttle-rate, that fraction of LLM, MCP tool and
+Tavily requests is answered with 429 and a Retry-After of --retry-after
+seconds, as a provider enforcing its quota would.
+
+Run from agents/python:
+
+    python -m benchmarks.fake_backend [--port 8765] [--llm-latency 0.3] ...
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+_WORDS = (
+    "market growth revenue inflation rate policy energy demand supply data analysis trend "
+    "forecast share index quarter annual region capacity investment consumer price output "
+    "employment wages housing credit exports imports productivity margin yield spending"
+).split()
+
+_URL_RE = re.compile(r"https?://[^\s'\"\\,}\]]+")
+_CHART_TITLE_RE = re.compile(r"^\s*- \*\*(.+?)\*\*", re.MULTILINE)
+
+
+@dataclass
+class BackendConfig:
+    """Latencies (seconds) and payload sizes of the stand-in services."""
+
+    llm_latency: float = 0.3
+    # Streamed responses: delay between chunks
+    llm_chunk_latency: float = 0.005
+    mcp_latency: float = 0.4
+    # Deep knowledge searches take this many times longer
+    mcp_deep_factor: float = 3.0
+    chart_latency: float = 0.1
+    tavily_latency: float = 0.5
+    page_latency: float = 0.05
+    jitter: float = 0.1
+    data_questions: int = 4
+    search_queries: int = 3
+    mcp_results: int = 5
+    web_results: int = 5
+    extract_resources: int = 4
+    description_words: int = 60
+    report_paragraphs: int = 8
+    paragraph_words: int = 90
+    page_kb: int = 40
+    # Fraction of LLM, MCP tool and Tavily requests rejected with 429
+    throttle_rate: float = 0.0
+    retry_after: float = 1.0
+    seed: int = 7
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _rng(*parts: Any) -> random.Random:
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+class FakeBackend:
+    def __init__(self, config: BackendConfig):
+        self.config = config
+        # Everything served by search endpoints, so ExtractResources can pick from it
+        self.catalog: Dict[str, Dict[str, str]] = {}
+        self.requests: Dict[str, int] = {}
+        self._sessions: Dict[str, asyncio.Queue] = {}
+        self._pages: Dict[str, str] = {}
+        self._throttle_rng = random.Random(config.seed)
+        self.base_url = ""
+
+    async def _delay(self, seconds: float) -> None:
+        if seconds > 0:
+            jitter = self.config.jitter
+            await asyncio.sleep(seconds * random.uniform(1 - jitter, 1 + jitter))
+
+    def _count(self, route: str) -> None:
+        self.requests[route] = self.requests.get(route, 0) + 1
+
+    def _throttled(self, service: str) -> Optional[web.Response]:
+        """A 429 response for a throttled request, or None."""
+        if self._throttle_rng.random() >= self.config.throttle_rate:
+            return None
+        self._count(f"429:{service}")
+        return web.json_response(
+            {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}},
+            status=429,
+            headers={"Retry-After": f"{self.config.retry_after:g}"},
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/health", lambda _: web.json_response({"status": "ok"}))
+        app.router.add_get("/stats", lambda _: web.json_response(self.requests))
+        app.router.add_head("/v1", lambda _: web.Response())
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/sse", self.mcp_sse)
+        app.router.add_post("/messages/", self.mcp_message)
+        app.router.add_post("/search", self.tavily_search)
+        app.router.add_get("/page/{page_id}", self.page)
+        app.router.add_get("/card/{page_id}", self.page)
+        return app
+
+    # LLM
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        throttled = self._throttled("llm")
+        if throttled is not None:
+            return throttled
+        body = await request.json()
+        message = self._script(body)
+        self._count(f"llm:{(message.get('tool_calls') or [{'function': {'name': 'text'}}])[0]['function']['name']}")
+        prompt_tokens = sum(len(_message_text(m)) for m in body.get("messages", [])) // 4
+        completion_tokens = (
+            len(message.get("content") or "")
+            + sum(len(c["function"]["arguments"]) for c in message.get("tool_calls") or [])
+        ) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        await self._delay(self.config.llm_latency)
+        if body.get("stream"):
+            return await self._stream_completion(request, body, message, usage)
+        return web.json_response(
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    async def _stream_completion(
+        self, request: web.Request, body: Dict[str, Any], message: Dict[str, Any], usage: Dict[str, int]
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        async def send(delta: Optional[Dict[str, Any]], finish_reason: Optional[str] = None, **extra: Any) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        tool_calls = message.get("tool_calls")
+        if tool_calls:
+            call = tool_calls[0]
+            await send({"role": "assistant", "content": None, "tool_calls": [
+                {"index": 0, "id": call["id"], "type": "function", "function": {"name": call["function"]["name"], "arguments": ""}}
+            ]})
+            pieces = [call["function"]["arguments"][i:i + 64] for i in range(0, len(call["function"]["arguments"]), 64)]
+            for piece in pieces:
+                await asyncio.sleep(self.config.llm_chunk_latency)
+                await send({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+            await send({}, "tool_calls")
+        else:
+            content = message.get("content") or ""
+            await send({"role": "assistant", "content": ""})
+            for i in range(0, len(content), 32):
+                await asyncio.sleep(self.config.llm_chunk_latency)
+                await send({"content": content[i:i + 32]})
+            await send({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send(None, usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def _script(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """The next assistant message of a scripted research turn."""
+        messages = body.get("messages", [])
+        tools = {t["function"]["name"] for t in body.get("tools", []) if t.get("type") == "function"}
+        last = messages[-1] if messages else {"role": "user", "content": ""}
+        rng = _rng(self.config.seed, len(messages), _message_text(last)[:200])
+
+        if "ExtractResources" in tools:
+            return self._tool_call("ExtractResources", {"resources": self._pick_resources(_message_text(last))})
+        if "WriteReport" not in tools:
+            # Report editor (chart markers) echoes the report; history summaries get a summary
+            text = _message_text(last)
+            marker = "Insert chart markers into this report:"
+            if marker in text:
+                return {"role": "assistant", "content": text.split(marker, 1)[1].strip()}
+            return {"role": "assistant", "content": f"Summary of the earlier conversation: {_text(rng, 60)}"}
+
+        if last.get("role") == "user":
+            question = _message_text(last)[:200]
+            return self._tool_call("WriteResearchQuestion", {"research_question": f"What does the data say about {question}?"})
+        if last.get("role") == "tool":
+            answered = self._answered_tool(messages, last.get("tool_call_id"))
+            topic = self._topic(messages)
+            if answered == "WriteResearchQuestion":
+                questions = [
+                    {"question": f"{topic} {_text(rng, 3)}", "search_effort": "fast", "query_type": "basic"}
+                    for _ in range(max(self.config.data_questions - 2, 1))
+                ]
+                # Models often restate a question with a period attached
+                questions.append({**questions[0], "question": f"{questions[0]['question']} since 2000"})
+                questions.append({
+                    "question": f"Prediction market odds for {topic}",
+                    "search_effort": "deep",
+                    "query_type": "prediction_market",
+                })
+                return self._tool_call("GenerateDataQuestions", {"questions": questions})
+            if answered == "GenerateDataQuestions":
+                queries = [f"{topic} {_text(rng, 4)}" for _ in range(self.config.search_queries)]
+                return self._tool_call("Search", {"queries": queries})
+            if answered == "Search":
+                return self._tool_call("WriteReport", {"report": self._report(messages, rng)})
+        return {"role": "assistant", "content": "The report is ready. Would you like any changes or a deeper look at one of the charts?"}
+
+    @staticmethod
+    def _tool_call(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+            ],
+        }
+
+    @staticmethod
+    def _answered_tool(messages: List[Dict[str, Any]], tool_call_id: Optional[str]) -> Optional[str]:
+        for message in reversed(messages):
+            for call in message.get("tool_calls") or []:
+                if call.get("id") == tool_call_id:
+                    return call["function"]["name"]
+        return None
+
+    @staticmethod
+    def _topic(messages: List[Dict[str, Any]]) -> str:
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                return " ".join(_message_text(message).split()[:4])
+        return "economy"
+
+    def _pick_resources(self, text: str) -> List[Dict[str, str]]:
+        picked: List[Dict[str, str]] = []
+        seen = set()
+        for url in _URL_RE.findall(text):
+            entry = self.catalog.get(url)
+            if entry and url not in seen:
+                seen.add(url)
+                picked.append({"url": url, "title": entry["title"], "description": entry["description"][:200]})
+        # Interleave charts and web pages, as the real selector tends to
+        charts = [r for r in picked if "/card/" in r["url"]]
+        pages = [r for r in picked if "/card/" not in r["url"]]
+        mixed = [r for pair in zip(charts, pages) for r in pair] + charts[len(pages):] + pages[len(charts):]
+        return mixed[: self.config.extract_resources]
+
+    def _report(self, messages: List[Dict[str, Any]], rng: random.Random) -> str:
+        system = _message_text(messages[0]) if messages else ""
+        chart_titles = _CHART_TITLE_RE.findall(system)
+        paragraphs = ["# Research Report"]
+        for i in range(self.config.report_paragraphs):
+            if i % 3 == 0:
+                paragraphs.append(f"## {_text(rng, 3).title()}")
+            mention = f" The chart {chart_titles[i % len(chart_titles)]} shows this." if chart_titles else ""
+            paragraphs.append(_text(rng, self.config.paragraph_words).capitalize() + "." + mention)
+        return "\n\n".join(paragraphs)
+
+    # MCP
+
+    async def mcp_sse(self, request: web.Request) -> web.StreamResponse:
+        self._count("mcp:connect")
+        session_id = uuid.uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self._sessions[session_id] = queue
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        try:
+            await response.write(f"event: endpoint\ndata: /messages/?session_id={session_id}\n\n".encode("utf-8"))
+            while True:
+                message = await queue.get()
+                await response.write(f"event: message\ndata: {json.dumps(message)}\n\n".encode("utf-8"))
+        except (asyncio.CancelledError, ConnectionResetError):
+            pass
+        finally:
+            self._sessions.pop(session_id, None)
+        return response
+
+    async def mcp_message(self, request: web.Request) -> web.Response:
+        queue = self._sessions.get(request.query.get("session_id", ""))
+        if queue is None:
+            return web.json_response({"error": "Could not find session"}, status=404)
+        message = await request.json()
+        if message.get("method") == "tools/call":
+            throttled = self._throttled("mcp")
+            if throttled is not None:
+                return throttled
+        asyncio.ensure_future(self._mcp_respond(queue, message))
+        return web.Response(status=202, text="Accepted")
+
+    async def _mcp_respond(self, queue: asyncio.Queue, message: Dict[str, Any]) -> None:
+        method = message.get("method")
+        params = message.get("params") or {}
+        if method == "initialize":
+            result: Dict[str, Any] = {
+                "protocolVersion": params.get("protocolVersion", "2024-11-05"),
+                "capabilities": {"tools": {}},
+                "serverInfo": {"name": "fake-tako", "version": "1.0.0"},
+            }
+        elif method == "tools/call":
+            name = params.get("name")
+            self._count(f"mcp:{name}")
+            result = await self._mcp_tool(name, params.get("arguments") or {})
+        else:
+            result = {}
+        await queue.put({"jsonrpc": "2.0", "id": message.get("id"), "result": result})
+
+    async def _mcp_tool(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        config = self.config
+        if name == "knowledge_search":
+            deep = args.get("search_effort") == "deep"
+            await self._delay(config.mcp_latency * (config.mcp_deep_factor if deep else 1))
+            query = args.get("query", "")
+            # Related questions share a topic, so the same charts come back from several searches
+            topic = " ".join(query.split()[:3])
+            prefix = "w" if args.get("source_indexes") == ["web"] else "c"
+            results = []
+            for i in range(min(args.get("count", 5), config.mcp_results)):
+                rng = _rng(prefix, topic if i < 2 else query, i)
+                card_id = f"{prefix}{rng.getrandbits(48):012x}"
+                title = f"{topic.title()} {_text(rng, 3)}"
+                description = _text(rng, config.description_words)
+                url = f"{self.base_url}/card/{card_id}"
+                self.catalog[url] = {"title": title, "description": description}
+                results.append({"card_id": card_id, "title": title, "description": description, "url": url})
+            return {"content": [{"type": "text", "text": json.dumps({"results": results})}]}
+        if name == "explore_knowledge_graph":
+            await self._delay(config.mcp_latency)
+            rng = _rng(args.get("query", ""))
+            return {"content": [{"type": "text", "text": json.dumps({
+                "entities": [{"name": _text(rng, 2).title()} for _ in range(5)],
+                "metrics": [{"name": _text(rng, 2)} for _ in range(5)],
+                "cohorts": [{"name": _text(rng, 2)} for _ in range(3)],
+                "time_periods": ["2020", "2021", "2022", "2023", "2024"],
+                "total_matches": 18,
+            })}]}
+        if name == "open_chart_ui":
+            await self._delay(config.chart_latency)
+            pub_id = args.get("pub_id")
+            html = (
+                f'<iframe width="100%" height="{args.get("height", 600)}" '
+                f'src="{self.base_url}/embed/{pub_id}/?theme=dark" frameborder="0"></iframe>'
+                '<script type="text/javascript">window.addEventListener("message", function(e) {});</script>'
+            )
+            return {"content": [{"type": "resource", "resource": {"uri": f"ui://chart/{pub_id}", "htmlString": html}}]}
+        return {"content": [], "isError": True}
+
+    # Tavily
+
+    async def tavily_search(self, request: web.Request) -> web.Response:
+        throttled = self._throttled("tavily")
+        if throttled is not None:
+            return throttled
+        body = await request.json()
+        self._count(f"tavily:{body.get('search_depth', 'basic')}")
+        await self._delay(self.config.tavily_latency)
+        query = body.get("query", "")
+        rng = _rng("tavily", query, body.get("search_depth"))
+        results = []
+        for i in range(min(body.get("max_results", 5), self.config.web_results)):
+            page_id = f"{rng.getrandbits(48):012x}"
+            url = f"{self.base_url}/page/{page_id}"
+            title = f"{_text(rng, 5).title()}"
+            content = _text(rng, self.config.description_words)
+            self.catalog[url] = {"title": title, "description": content}
+            results.append({"title": title, "url": url, "content": content, "score": round(0.9 - i * 0.05, 2), "raw_content": None})
+        return web.json_response({
+            "query": query,
+            "answer": _text(rng, 40),
+            "images": [],
+            "results": results,
+            "response_time": self.config.tavily_latency,
+        })
+
+    # Pages
+
+    async def page(self, request: web.Request) -> web.Response:
+        self._count(request.path.split("/")[1])
+        await self._delay(self.config.page_latency)
+        page_id = request.match_info["page_id"]
+        html = self._pages.get(page_id)
+        if html is None:
+            html = self._pages[page_id] = self._html(page_id)
+        return web.Response(text=html, content_type="text/html")
+
+    def _html(self, page_id: str) -> str:
+        rng = _rng("page", page_id)
+        parts = [f"<html><head><title>{_text(rng, 5)}</title></head><body><nav><ul>"]
+        parts.extend(f'<li><a href="/section/{i}">{_text(rng, 2)}</a></li>' for i in range(12))
+        parts.append("</ul></nav><article>")
+        size = 0
+        while size < self.config.page_kb * 1024:
+            block = (
+                f"<h2>{_text(rng, 4)}</h2>"
+                f"<p>{_text(rng, 80)} <a href=\"https://example.com/{rng.getrandbits(32):x}\">{_text(rng, 2)}</a> {_text(rng, 40)}</p>"
+                f"<ul>{''.join(f'<li><strong>{_text(rng, 2)}</strong> {_text(rng, 10)}</li>' for _ in range(4))}</ul>"
+                f"<table><tr><th>{_text(rng, 1)}</th><th>{_text(rng, 1)}</th></tr>"
+                f"{''.join(f'<tr><td>{rng.randint(1, 999)}</td><td>{rng.random():.3f}</td></tr>' for _ in range(5))}</table>"
+            )
+            parts.append(block)
+            size += len(block)
+        parts.append("</article></body></html>")
+        return "".join(parts)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add one ``--option`` per BackendConfig field."""
+    for field in fields(BackendConfig):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=field.type, default=field.default)
+
+
+def config_from_args(args: argparse.Namespace) -> BackendConfig:
+    return BackendConfig(**{field.name: getattr(args, field.name) for field in fields(BackendConfig)})
+
+
+def config_to_argv(config: BackendConfig) -> List[str]:
+    argv: List[str] = []
+    for field in fields(BackendConfig):
+        argv.extend([f"--{field.name.replace('_', '-')}", str(getattr(config, field.name))])
+    return argv
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    backend = FakeBackend(config_from_args(args))
+    backend.base_url = f"http://{args.host}:{args.port}"
+    web.run_app(backend.app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Offline end-to-end graph benchmark.
+
+Runs full research turns through the compiled graph from src/agent.py against
+benchmarks/fake_backend.py (scripted LLM, MCP, Tavily and web pages with
+configurable latency, started in a subprocess so its work does not count),
+and reports per graph node: runs, wall time, CPU time and memory allocated
+(tracemalloc), plus turn latency, event-loop lag and the requests each
+service received.
+
+CPU time and allocations are process-wide, so they are only attributed to a
+single node exactly with --concurrency 1. Tracemalloc slows Python code down
+noticeably; use --no-allocations for representative wall and CPU times.
+
+Run from agents/python:
+
+    python -m benchmarks.graph_turns [--threads 3] [--turns 4] [--concurrency 1]
+        [--llm-latency 0.3] [--mcp-latency 0.4] [--page-kb 40] [--json results.json]
+
+Every fake_backend option (latencies, result counts, report size) is
+accepted. Environment variables already set (e.g. STREAM_REPORT=true,
+CHART_PLACEMENT=llm, CHECKPOINTER=sqlite) are kept; with CASSETTE_MODE=replay
+the turns are served from a recorded cassette instead of the fake backend.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+import uuid
+import zlib
+from typing import Any, Dict, List
+
+from benchmarks.fake_backend import add_arguments, config_from_args, config_to_argv
+
+
+class NodeProfiler:
+    """Per-node wall time, CPU time and tracemalloc allocation totals."""
+
+    def __init__(self):
+        self.nodes: Dict[str, Dict[str, List[float]]] = {}
+
+    def wrap(self, instrument_node):
+        """Wrap metrics.instrument_node so every node it instruments is also profiled."""
+        profiler = self
+
+        def instrument(name, node):
+            inner = instrument_node(name, node)
+
+            async def wrapper(state, config):
+                tracing = tracemalloc.is_tracing()
+                if tracing:
+                    tracemalloc.reset_peak()
+                    memory_before = tracemalloc.get_traced_memory()[0]
+                wall_started, cpu_started = time.perf_counter(), time.process_time()
+                try:
+                    return await inner(state, config)
+                finally:
+                    sample = profiler.nodes.setdefault(name, {"wall": [], "cpu": [], "retained": [], "peak": []})
+                    sample["wall"].append(time.perf_counter() - wall_started)
+                    sample["cpu"].append(time.process_time() - cpu_started)
+                    if tracing:
+                        current, peak = tracemalloc.get_traced_memory()
+                        sample["retained"].append(current - memory_before)
+                        sample["peak"].append(peak - memory_before)
+
+            wrapper.__name__ = getattr(node, "__name__", name)
+            return wrapper
+
+        return instrument
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for name, sample in self.nodes.items():
+            runs = len(sample["wall"])
+            result[name] = {
+                "runs": runs,
+                "wall_s": sum(sample["wall"]),
+                "wall_ms_mean": statistics.mean(sample["wall"]) * 1000,
+                "cpu_s": sum(sample["cpu"]),
+                "cpu_ms_mean": statistics.mean(sample["cpu"]) * 1000,
+                "retained_kb_mean": statistics.mean(sample["retained"]) / 1024 if sample["retained"] else None,
+                "peak_kb_max": max(sample["peak"]) / 1024 if sample["peak"] else None,
+            }
+        return result
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get_json(url: str) -> Any:
+    with urllib.request.urlopen(url, timeout=2) as response:
+        return json.loads(response.read())
+
+
+def start_backend(args: argparse.Namespace) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_backend", "--port", str(args.port), *config_to_argv(config_from_args(args))]
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            _get_json(f"http://127.0.0.1:{args.port}/health")
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("fake backend exited during startup")
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake backend did not start")
+
+
+def configure_environment(port: int, warm_caches: bool) -> None:
+    base_url = f"http://127.0.0.1:{port}"
+    defaults = {
+        "MODEL": "openai",
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "TAVILY_API_KEY": "benchmark",
+        "TAVILY_API_BASE_URL": base_url,
+        "TAKO_MCP_URL": base_url,
+        "TAKO_URL": base_url,
+        "TAKO_API_TOKEN": "benchmark",
+        # Compile the graph with a checkpointer so threads keep their history
+        "LANGGRAPH_FASTAPI": "true",
+    }
+    if not warm_caches:
+        defaults["TAVILY_CACHE_TTL_SECONDS"] = "0"
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+_TOPICS = (
+    "global energy prices",
+    "housing affordability in cities",
+    "semiconductor supply chains",
+    "youth unemployment in europe",
+    "electric vehicle adoption",
+    "central bank interest rates",
+    "agricultural commodity exports",
+    "healthcare spending per capita",
+)
+
+
+async def run_thread(graph, thread_id: str, turns: int, turn_times: List[float]) -> None:
+    from src.lib.rate_limit import turn_budget
+
+    config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 50}
+    for turn in range(turns):
+        # A new topic every turn, so searches and downloads are not all cache hits
+        topic = _TOPICS[(zlib.crc32(thread_id.encode("utf-8")) + turn) % len(_TOPICS)]
+        question = f"{topic} ({thread_id}, turn {turn + 1})"
+        state: Dict[str, Any] = {"messages": [{"role": "user", "content": question}]}
+        if turn == 0:
+            state.update(model="openai", research_question="", report="", resources=[], logs=[])
+        started = time.perf_counter()
+        with turn_budget():
+            await graph.ainvoke(state, config)
+        turn_times.append(time.perf_counter() - started)
+
+
+async def run(args: argparse.Namespace, profiler: NodeProfiler) -> Dict[str, Any]:
+    from src.agent import graph
+    from src.lib.cassette import get_cassette_stats
+    from src.lib.checkpoint import close_checkpointer
+    from src.lib.loop_monitor import get_loop_monitor_stats, start_loop_monitor, stop_loop_monitor
+    from src.lib.mcp_integration import close_mcp_client
+    from src.lib.question_planner import get_question_planner_stats
+    from src.lib.rate_limit import get_rate_limit_stats
+
+    # Unmeasured turn: SDK imports, connection setup and the MCP session
+    for _ in range(args.warmup_turns):
+        await run_thread(graph, f"warmup-{uuid.uuid4().hex[:8]}", 1, [])
+    profiler.nodes.clear()
+    requests_before = _get_json(f"http://127.0.0.1:{args.port}/stats")
+
+    if args.allocations:
+        tracemalloc.start()
+    turn_times: List[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(thread_id: str) -> None:
+        async with semaphore:
+            await run_thread(graph, thread_id, args.turns, turn_times)
+
+    start_loop_monitor()
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded(f"bench-{i}") for i in range(args.threads)))
+    elapsed = time.perf_counter() - started
+    stop_loop_monitor()
+    if args.allocations:
+        tracemalloc.stop()
+
+    await close_mcp_client()
+    await close_checkpointer()
+    requests_after = _get_json(f"http://127.0.0.1:{args.port}/stats")
+    ordered = sorted(turn_times)
+    return {
+        "elapsed_s": elapsed,
+        "turns": len(turn_times),
+        "turn_s_p50": ordered[len(ordered) // 2],
+        "turn_s_p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "nodes": profiler.summary(),
+        "backend_requests": {k: v - requests_before.get(k, 0) for k, v in requests_after.items()},
+        "cassette": get_cassette_stats(),
+        "event_loop": get_loop_monitor_stats(),
+        "rate_limit": get_rate_limit_stats(),
+        "question_planner": get_question_planner_stats(),
+    }
+
+
+def print_report(result: Dict[str, Any], args: argparse.Namespace) -> None:
+    print(
+        f"{args.threads} threads x {args.turns} turns (concurrency {args.concurrency}): "
+        f"{result['elapsed_s']:.2f}s, turn p50 {result['turn_s_p50']:.2f}s, p95 {result['turn_s_p95']:.2f}s"
+    )
+    print(f"{'node':<22}{'runs':>6}{'wall s':>10}{'wall ms':>10}{'cpu s':>9}{'cpu ms':>9}{'alloc KB':>11}{'peak KB':>10}")
+    for name, node in sorted(result["nodes"].items(), key=lambda item: -item[1]["wall_s"]):
+        retained = f"{node['retained_kb_mean']:.0f}" if node["retained_kb_mean"] is not None else "-"
+        peak = f"{node['peak_kb_max']:.0f}" if node["peak_kb_max"] is not None else "-"
+        print(
+            f"{name:<22}{node['runs']:>6}{node['wall_s']:>10.2f}{node['wall_ms_mean']:>10.1f}"
+            f"{node['cpu_s']:>9.2f}{node['cpu_ms_mean']:>9.1f}{retained:>11}{peak:>10}"
+        )
+    loop_stats = result["event_loop"]
+    print(
+        f"\nEvent loop: max lag {loop_stats['max_lag_ms']:.0f} ms, {loop_stats['stalls']} stalls, "
+        f"{loop_stats['cpu']['offloaded']} calls offloaded ({loop_stats['cpu']['offloaded_seconds']:.2f}s)"
+    )
+    print("Backend requests: " + ", ".join(f"{k}={v}" for k, v in sorted(result["backend_requests"].items())))
+    print("Rate limits: " + "; ".join(
+        f"{upstream} {stats['rate_limited']} x 429, {stats['retries']} retries, {stats['gave_up']} gave up"
+        for upstream, stats in sorted(result["rate_limit"].items())
+    ))
+    planner = result["question_planner"]
+    print(
+        f"Question planner: {planner['questions']} data questions, {planner['searches']} searches, "
+        f"{planner['saved']} saved"
+    )
+    if result["cassette"]["mode"] != "off":
+        print("Cassette: " + ", ".join(f"{k}={v}" for k, v in result["cassette"].items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=4, help="research turns per thread")
+    parser.add_argument("--concurrency", type=int, default=1, help="threads run at the same time")
+    parser.add_argument("--warmup-turns", type=int, default=1)
+    parser.add_argument("--no-allocations", dest="allocations", action="store_false")
+    parser.add_argument("--warm-caches", action="store_true", help="keep the Tavily result cache enabled")
+    # Fixed by default: backend URLs end up in prompts, and cassette replay matches on prompts
+    parser.add_argument("--port", type=int, default=8765, help="fake backend port (0: any free port)")
+    parser.add_argument("--json", help="also write the results to this file")
+    add_arguments(parser)
+    args = parser.parse_args()
+    args.port = args.port or _free_port()
+
+    backend = start_backend(args)
+    try:
+        configure_environment(args.port, args.warm_caches)
+        from src.lib import metrics
+
+        # Must be patched before src.agent builds the graph
+        profiler = NodeProfiler()
+        metrics.instrument_node = profiler.wrap(metrics.instrument_node)
+        result = asyncio.run(run(args, profiler))
+    finally:
+        backend.terminate()
+        backend.wait()
+
+    print_report(result, args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), **result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Startup import profile.
+
+Imports a target in a fresh interpreter with ``-X importtime`` and reports the
+import cost of each top-level package (the self time of all its modules), plus
+the cold import time of each model provider SDK on its own (what the first LLM
+call of a deployment pays now that providers are imported lazily).
+
+Run from agents/python:
+
+    python -m benchmarks.import_profile [--target main:app] [--top 25]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, Tuple
+
+PROVIDER_MODULES = ("langchain_openai", "langchain_anthropic", "langchain_google_genai", "tavily")
+
+_LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def profile_imports(code: str) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """
+    Run ``code`` under ``-X importtime``.
+
+    Returns:
+        (wall seconds, {package: (modules imported, self us summed over them)})
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=False,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "import failed")
+
+    packages: Dict[str, Tuple[int, int]] = {}
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            package = match.group(4).split(".")[0]
+            count, self_us = packages.get(package, (0, 0))
+            packages[package] = (count + 1, self_us + int(match.group(1)))
+    return wall, packages
+
+
+def _target_code(target: str) -> str:
+    module, _, attr = target.partition(":")
+    return f"import {module}" + (f"; {module}.{attr}" if attr else "")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--target", default="main:app", help="module[:attribute] to import")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    wall, packages = profile_imports(_target_code(args.target))
+    total_us = sum(self_us for _, self_us in packages.values())
+    print(f"{args.target}: {wall:.2f}s wall, {total_us / 1e6:.2f}s in imports")
+    print(f"{'package':<40}{'modules':>10}{'import ms':>12}")
+    for name, (count, self_us) in sorted(packages.items(), key=lambda p: -p[1][1])[: args.top]:
+        print(f"{name:<40}{count:>10}{self_us / 1000:>12.1f}")
+
+    print("\nProvider SDKs (cold, in isolation):")
+    costs: Dict[str, str] = {}
+    for provider in PROVIDER_MODULES:
+        try:
+            _, provider_packages = profile_imports(f"import {provider}")
+            costs[provider] = f"{sum(p[1] for p in provider_packages.values()) / 1000:.1f} ms"
+        except RuntimeError as e:
+            costs[provider] = f"unavailable ({e})"
+    for provider, cost in costs.items():
+        status = "loaded at startup" if provider in packages else "lazy"
+        print(f"  {provider:<28}{cost:>14}   {status}")
+
+
+if __name__ == "__main__":
+    main()
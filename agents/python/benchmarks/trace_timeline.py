@@ -0,0 +1,99 @@
+"""
+Trace timeline.
+
+Renders one trace from a TRACE_EXPORTER=jsonl file as an indented timeline:
+each span's offset from the start of the trace, its duration, and a bar
+showing where it ran, so sequential steps (e.g. chart fetches) and idle gaps
+stand out. Also sums time by span name across the trace.
+
+Run from agents/python:
+
+    python -m benchmarks.trace_timeline [--file traces.jsonl] [--thread ID | --trace ID] [--width 60]
+
+Without --thread or --trace, the slowest trace in the file is shown.
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from typing import Any, Dict, List
+
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _trace_duration(spans: List[Dict[str, Any]]) -> int:
+    return max(s["end_ns"] for s in spans) - min(s["start_ns"] for s in spans)
+
+
+def select_trace(spans: List[Dict[str, Any]], trace_id: str = "", thread_id: str = "") -> List[Dict[str, Any]]:
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for s in spans:
+        traces[s["trace_id"]].append(s)
+    if trace_id:
+        return traces.get(trace_id, [])
+    if thread_id:
+        # Latest trace of the thread
+        candidates = [t for t in traces.values() if any(s.get("thread_id") == thread_id for s in t)]
+        return max(candidates, key=lambda t: min(s["start_ns"] for s in t), default=[])
+    return max(traces.values(), key=_trace_duration, default=[])
+
+
+def render(spans: List[Dict[str, Any]], width: int) -> List[str]:
+    start = min(s["start_ns"] for s in spans)
+    total = max(_trace_duration(spans), 1)
+    ids = {s["span_id"] for s in spans}
+    children: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+    for s in spans:
+        children[s["parent_id"] if s["parent_id"] in ids else None].append(s)
+
+    lines: List[str] = []
+
+    def walk(parent: Any, depth: int) -> None:
+        for s in sorted(children[parent], key=lambda s: s["start_ns"]):
+            offset = s["start_ns"] - start
+            duration = s["end_ns"] - s["start_ns"]
+            left = int(offset / total * width)
+            bar = " " * left + "#" * max(1, int(duration / total * width))
+            label = ("  " * depth + s["name"])[:44]
+            error = "  ! " + s["error"] if s.get("error") else ""
+            lines.append(f"{offset / 1e6:>9.1f} {duration / 1e6:>9.1f}  {label:<44} |{bar:<{width}}|{error}")
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--file", default="traces.jsonl")
+    parser.add_argument("--thread", default="", help="show the latest trace of this thread id")
+    parser.add_argument("--trace", default="", help="show this trace id")
+    parser.add_argument("--width", type=int, default=60)
+    args = parser.parse_args()
+
+    trace = select_trace(load_spans(args.file), args.trace, args.thread)
+    if not trace:
+        print("No matching trace")
+        return
+
+    thread_ids = {s["thread_id"] for s in trace if s.get("thread_id")}
+    print(f"trace {trace[0]['trace_id']}  thread {', '.join(thread_ids) or '-'}  "
+          f"{len(trace)} spans  {_trace_duration(trace) / 1e6:.1f} ms")
+    print(f"{'start ms':>9} {'dur ms':>9}  {'span':<44}")
+    for line in render(trace, args.width):
+        print(line)
+
+    totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+    for s in trace:
+        totals[s["name"]][0] += 1
+        totals[s["name"]][1] += (s["end_ns"] - s["start_ns"]) / 1e6
+    print(f"\n{'span':<44}{'count':>8}{'total ms':>12}")
+    for name, (count, total_ms) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        print(f"{name:<44}{count:>8}{total_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
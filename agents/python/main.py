@@ -2,42 +2,195 @@
 Research Agent Server
 
 FastAPI server that exposes a LangGraph research agent via CopilotKit.
+
+Set SERVER_MODE=production to run several worker processes without the
+reloader. Production mode also moves per-process state (checkpoints and
+caches) to shared on-disk backends, so any worker can serve any thread.
 """
 
+import asyncio
+import importlib.util
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 
 import uvicorn
-from ag_ui_langgraph import add_langgraph_fastapi_endpoint
-from copilotkit import LangGraphAGUIAgent
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 
 load_dotenv()
 os.environ["LANGGRAPH_FASTAPI"] = "true"
-from src.agent import graph  # noqa: E402
-
-app = FastAPI()
-
-add_langgraph_fastapi_endpoint(
-    app=app,
-    agent=LangGraphAGUIAgent(
-        name="research_agent",
-        description="AI research assistant for gathering and analyzing information.",
-        graph=graph
-    ),
-    path="/copilotkit/agents/research_agent",
+
+SERVER_MODE = os.getenv("SERVER_MODE", "development").lower()
+if SERVER_MODE == "production":
+    # Shared backends for state that would otherwise live in one worker;
+    # explicit settings in the environment take precedence
+    os.environ.setdefault("CHECKPOINTER", "sqlite")
+    os.environ.setdefault("CHECKPOINT_DB_PATH", ".data/checkpoints.db")
+    # Workers share the database write lock; don't hold it across a batching window
+    os.environ.setdefault("CHECKPOINT_COMMIT_INTERVAL_MS", "0")
+    os.environ.setdefault("TAVILY_CACHE_DIR", ".cache/tavily")
+    os.environ.setdefault("RESOURCE_CACHE_DIR", ".cache/resources")
+    os.environ.setdefault("CHART_STORE_DIR", ".cache/charts")
+
+# Worker count when WEB_CONCURRENCY is unset, at most
+MAX_DEFAULT_WORKERS = int(os.getenv("MAX_DEFAULT_WORKERS", "4"))
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+logger = logging.getLogger(__name__)
+
+# Served with chart HTML from MCP: scripts run sandboxed in an opaque origin
+# and may only load the embedded chart itself
+_CHART_CSP = (
+    "sandbox allow-scripts; default-src 'none'; script-src 'unsafe-inline' https:; "
+    "style-src 'unsafe-inline' https:; img-src https: data:; font-src https: data:; "
+    "frame-src https:; connect-src https:; frame-ancestors 'self'"
 )
 
 
-@app.get("/health")
-def health():
-    """Health check endpoint."""
-    return {"status": "ok"}
+def create_app() -> FastAPI:
+    """
+    Build the FastAPI app.
+
+    The graph and agent SDKs are imported here rather than at module load, so
+    the launcher process (``python main.py``), which only spawns the server
+    and its workers, never pays for them.
+    """
+    started = time.perf_counter()
+    from ag_ui_langgraph import add_langgraph_fastapi_endpoint
+    from copilotkit import LangGraphAGUIAgent
+
+    from src.agent import graph
+    from src.lib.chart_store import get_chart
+    from src.lib.checkpoint import close_checkpointer
+    from src.lib.loop_monitor import start_loop_monitor, stop_loop_monitor
+    from src.lib.mcp_integration import close_mcp_client
+    from src.lib.metrics import render_metrics
+    from src.lib.profiling import ProfilingMiddleware
+    from src.lib.rate_limit import TurnBudgetMiddleware
+    from src.lib.tracing import TracingMiddleware
+    from src.lib.warmup import get_warmup_status, is_ready, warm_up
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI):
+        """Warm up in the background on startup; close shared clients on shutdown."""
+        start_loop_monitor()
+        warmup_task = asyncio.create_task(warm_up())
+        yield
+        warmup_task.cancel()
+        stop_loop_monitor()
+        await close_mcp_client()
+        await close_checkpointer()
+
+    application = FastAPI(lifespan=lifespan)
+    application.add_middleware(TurnBudgetMiddleware, prefixes=("/copilotkit/agents/research_agent",))
+    application.add_middleware(ProfilingMiddleware, prefixes=("/copilotkit/agents/research_agent",))
+    application.add_middleware(TracingMiddleware, prefixes=("/copilotkit",))
+
+    add_langgraph_fastapi_endpoint(
+        app=application,
+        agent=LangGraphAGUIAgent(
+            name="research_agent",
+            description="AI research assistant for gathering and analyzing information.",
+            graph=graph
+        ),
+        path="/copilotkit/agents/research_agent",
+    )
+
+    @application.get("/health")
+    def health():
+        """Health check endpoint."""
+        return {"status": "ok"}
+
+    @application.get("/ready")
+    def ready():
+        """Readiness endpoint: 503 until the worker has finished warming up."""
+        status = get_warmup_status()
+        return JSONResponse(status, status_code=200 if is_ready() else 503)
+
+    @application.get("/metrics")
+    def metrics():
+        """Prometheus text exposition of node, dependency and cache metrics."""
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+    @application.get("/charts/{chart_id}")
+    def chart(chart_id: str):
+        """Serve chart HTML from the content-addressed chart store."""
+        html = get_chart(chart_id)
+        if html is None:
+            raise HTTPException(status_code=404, detail="Chart not found")
+        # Content-addressed, so the response never changes for a given id.
+        # Chart markup comes from MCP: run its scripts in an opaque origin
+        # (sandbox without allow-same-origin), never with the app's.
+        return HTMLResponse(html, headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "Content-Security-Policy": _CHART_CSP,
+            "X-Content-Type-Options": "nosniff",
+        })
+
+    logger.info(f"App created in {time.perf_counter() - started:.2f}s")
+    return application
+
+
+_app: Optional[FastAPI] = None
+
+
+def __getattr__(name: str):
+    """Create ``app`` on first access (uvicorn resolves "main:app" this way)."""
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _default_workers() -> int:
+    """
+    CPUs this process may run on, capped at MAX_DEFAULT_WORKERS.
+
+    os.cpu_count() reports the host's cores inside containers; every worker
+    has its own caches, MCP client and SQLite writer, so keep the default small.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, MAX_DEFAULT_WORKERS))
+
+
+def _run_production(port: int):
+    """Run multiple workers with uvloop/httptools (when installed) and graceful drain."""
+    workers = int(os.getenv("WEB_CONCURRENCY") or _default_workers())
+    if workers > 1 and os.getenv("CHECKPOINTER") == "memory":
+        logger.warning("CHECKPOINTER=memory with several workers: threads are not shared between them")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        reload=False,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        # Let in-flight agent runs finish on shutdown / redeploy
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30")),
+        timeout_keep_alive=int(os.getenv("KEEPALIVE_TIMEOUT_SECONDS", "75")),
+        proxy_headers=True,
+        # Proxies trusted to set X-Forwarded-For/-Proto (comma-separated IPs or "*")
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        access_log=os.getenv("ACCESS_LOG", "false").lower() == "true",
+    )
 
 
 def main():
     """Run the uvicorn server."""
     port = int(os.getenv("PORT", "2024"))
+    if SERVER_MODE == "production":
+        _run_production(port)
+        return
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
@@ -12,16 +12,17 @@ from langgraph.graph import StateGraph
 from src.lib.chat import chat_node
 from src.lib.delete import delete_node, perform_delete_node
 from src.lib.download import download_node
+from src.lib.metrics import instrument_node
 from src.lib.search import search_node
 from src.lib.state import AgentState
 
 # Define a new graph
 workflow = StateGraph(AgentState)
-workflow.add_node("download", download_node)
-workflow.add_node("chat_node", chat_node)
-workflow.add_node("search_node", search_node)
-workflow.add_node("delete_node", delete_node)
-workflow.add_node("perform_delete_node", perform_delete_node)
+workflow.add_node("download", instrument_node("download", download_node))
+workflow.add_node("chat_node", instrument_node("chat_node", chat_node))
+workflow.add_node("search_node", instrument_node("search_node", search_node))
+workflow.add_node("delete_node", instrument_node("delete_node", delete_node))
+workflow.add_node("perform_delete_node", instrument_node("perform_delete_node", perform_delete_node))
 
 
 workflow.set_entry_point("download")
@@ -40,9 +41,9 @@ if os.environ.get("LANGGRAPH_FASTAPI", "false").lower() == "false":
     # When running in LangGraph API, don't use a custom checkpointer
     graph = workflow.compile(**compile_kwargs)
 else:
-    # For CopilotKit and other contexts, use MemorySaver
-    from langgraph.checkpoint.memory import MemorySaver
+    # For CopilotKit and other contexts, use the configured checkpointer
+    # (bounded in-memory by default, durable SQLite with CHECKPOINTER=sqlite)
+    from src.lib.checkpoint import get_checkpointer
 
-    memory = MemorySaver()
-    compile_kwargs["checkpointer"] = memory
+    compile_kwargs["checkpointer"] = get_checkpointer()
     graph = workflow.compile(**compile_kwargs)
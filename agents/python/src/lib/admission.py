@@ -0,0 +1,213 @@
+"""
+Admission Control
+
+Per-process limits on in-flight calls to each external dependency (LLM, MCP,
+Tavily), so a traffic spike queues inside the worker instead of turning into
+a burst of 429s and timeouts at the provider.
+
+Calls are admitted by priority class, taken from the caller's context (set
+with ``with priority(...)`` around a phase; tasks it starts inherit it):
+
+- INTERACTIVE: the user-facing chat and selection calls (the default)
+- SEARCH: first-pass web and Tako searches
+- FALLBACK: second-pass searches run when the first pass found nothing
+- PREFETCH: speculative chart iframe fetches while a report streams
+
+A free slot goes to the highest-priority waiter, oldest first. Each class
+waits at most its own deadline (ADMISSION_MAX_WAIT_<CLASS>); when the queue
+is full, an arriving call displaces the newest waiter of a lower class, or is
+turned away itself. Rejected calls raise AdmissionRejected, which callers
+handle like any failure of that dependency (a search without results, a
+chart without an iframe), so load is shed from the least valuable work first.
+
+Queue depth and in-flight calls are exported as ``agent_admission_*`` gauges,
+queue wait as ``agent_admission_wait_seconds``.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from src.lib.metrics import counter, histogram, register_stats
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    SEARCH = 1
+    FALLBACK = 2
+    PREFETCH = 3
+
+
+# In-flight calls per dependency (0 = unlimited), and waiters per dependency
+ADMISSION_LIMITS = {
+    "llm": int(os.getenv("ADMISSION_LIMIT_LLM", "16")),
+    "mcp": int(os.getenv("ADMISSION_LIMIT_MCP", "8")),
+    "tavily": int(os.getenv("ADMISSION_LIMIT_TAVILY", "8")),
+}
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Longest a call of each class waits for a slot before it is shed
+ADMISSION_MAX_WAIT = {
+    Priority.INTERACTIVE: float(os.getenv("ADMISSION_MAX_WAIT_INTERACTIVE", "60")),
+    Priority.SEARCH: float(os.getenv("ADMISSION_MAX_WAIT_SEARCH", "20")),
+    Priority.FALLBACK: float(os.getenv("ADMISSION_MAX_WAIT_FALLBACK", "5")),
+    Priority.PREFETCH: float(os.getenv("ADMISSION_MAX_WAIT_PREFETCH", "2")),
+}
+
+ADMISSION_WAIT = histogram(
+    "agent_admission_wait_seconds",
+    "Time calls waited for an admission slot.",
+    ("dependency", "priority"),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+ADMISSION_REJECTED = counter(
+    "agent_admission_rejected_total",
+    "Calls shed by admission control (queue_full, displaced or deadline).",
+    ("dependency", "priority", "reason"),
+)
+
+_current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "admission_priority", default=Priority.INTERACTIVE
+)
+
+
+class AdmissionRejected(RuntimeError):
+    """A call was shed instead of being sent to its dependency."""
+
+    def __init__(self, dependency: str, priority: Priority, reason: str):
+        super().__init__(f"{dependency} call ({priority.name.lower()}) shed: {reason}")
+        self.dependency = dependency
+        self.priority = priority
+        self.reason = reason
+
+
+@contextmanager
+def priority(value: Priority) -> Iterator[None]:
+    """Run the enclosed calls, and tasks started from them, under a priority class."""
+    token = _current_priority.set(value)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future")
+
+    def __init__(self, priority_: Priority, seq: int):
+        self.priority = priority_
+        self.seq = seq
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class Limiter:
+    """Concurrency limit with a priority-ordered, bounded wait queue for one dependency."""
+
+    def __init__(self, dependency: str, limit: int, max_queue: int):
+        self.dependency = dependency
+        self.limit = limit
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    async def acquire(self, priority_: Priority) -> None:
+        if self.in_flight < self.limit and not self._queue:
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            ADMISSION_WAIT.observe(0.0, dependency=self.dependency, priority=priority_.name.lower())
+            return
+
+        if len(self._queue) >= self.max_queue:
+            worst = max(self._queue, key=lambda w: (w.priority, w.seq))
+            if worst.priority <= priority_:
+                self._reject(priority_, "queue_full")
+            self._queue.remove(worst)
+            worst.future.set_exception(self._rejection(worst.priority, "displaced"))
+
+        waiter = _Waiter(priority_, next(self._seq))
+        self._queue.append(waiter)
+        self._stats["queued"] += 1
+        started = time.monotonic()
+        try:
+            # shield: a timeout must not cancel a slot that was just handed over
+            await asyncio.wait_for(asyncio.shield(waiter.future), ADMISSION_MAX_WAIT[priority_])
+        except BaseException as e:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # Granted at the moment we gave up; pass the slot on
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(priority_, "deadline")
+            raise
+        self._stats["admitted"] += 1
+        ADMISSION_WAIT.observe(time.monotonic() - started, dependency=self.dependency, priority=priority_.name.lower())
+
+    def release(self) -> None:
+        while self._queue:
+            waiter = min(self._queue, key=lambda w: (w.priority, w.seq))
+            self._queue.remove(waiter)
+            if not waiter.future.done():
+                # Hand the slot over; in_flight stays the same
+                waiter.future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _rejection(self, priority_: Priority, reason: str) -> AdmissionRejected:
+        self._stats["rejected"] += 1
+        ADMISSION_REJECTED.inc(dependency=self.dependency, priority=priority_.name.lower(), reason=reason)
+        return AdmissionRejected(self.dependency, priority_, reason)
+
+    def _reject(self, priority_: Priority, reason: str) -> None:
+        raise self._rejection(priority_, reason)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self._stats,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._queue),
+        }
+
+
+_limiters: Dict[str, Limiter] = {
+    dependency: Limiter(dependency, limit, ADMISSION_MAX_QUEUE)
+    for dependency, limit in ADMISSION_LIMITS.items()
+    if limit > 0
+}
+
+
+@asynccontextmanager
+async def admit(dependency: str, priority_: Optional[Priority] = None) -> AsyncIterator[None]:
+    """
+    Hold an admission slot for ``dependency`` while the enclosed call runs.
+
+    Uses the caller's priority class unless ``priority_`` is given; raises
+    AdmissionRejected if the call is shed.
+    """
+    limiter = _limiters.get(dependency)
+    if limiter is None:
+        yield
+        return
+    await limiter.acquire(priority_ if priority_ is not None else _current_priority.get())
+    try:
+        yield
+    finally:
+        limiter.release()
+
+
+def get_admission_stats() -> Dict[str, Dict[str, int]]:
+    """Per dependency: limit, calls in flight, queue depth, and calls admitted, queued and rejected."""
+    return {dependency: limiter.stats() for dependency, limiter in _limiters.items()}
+
+
+register_stats("admission", get_admission_stats, label="dependency")
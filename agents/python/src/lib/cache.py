@@ -0,0 +1,203 @@
+"""
+TTL Cache
+
+Small in-process cache with time-based expiry, an LRU size limit and an
+optional on-disk tier. Used to memoize expensive external lookups (such as
+Tavily web searches) across threads and users served by the same worker.
+
+get() and set() are coroutines: the disk tier is read and written in a thread,
+never on the event loop.
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _copy(value: Any) -> Any:
+    # Strings and numbers are immutable; containers are copied
+    if value is None or isinstance(value, (str, bytes, int, float)):
+        return value
+    return copy.deepcopy(value)
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire after a fixed time-to-live.
+
+    When ``disk_dir`` is set, entries are also written to one JSON file per key
+    so they survive restarts and can be shared by several worker processes.
+    Values must therefore be JSON-serializable.
+
+    Values are copied in and out, so a caller mutating a result it got (or
+    stored) does not change the entry seen by later lookups.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        max_entries: int = 512,
+        disk_dir: Optional[str] = None,
+        max_disk_entries: int = 5000,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    @staticmethod
+    def make_key(*parts: Any, **params: Any) -> str:
+        """
+        Build a stable cache key from positional parts and keyword parameters.
+
+        String parts are normalized (case-folded, whitespace collapsed) so that
+        trivially different spellings of the same query share an entry.
+        """
+        normalized = [
+            " ".join(p.lower().split()) if isinstance(p, str) else p for p in parts
+        ]
+        payload = json.dumps([normalized, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return (a copy of) the cached value for ``key`` or None if missing/expired."""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return _copy(value)
+                del self._entries[key]
+
+        value = await asyncio.to_thread(self._disk_get, key, now) if self.disk_dir else None
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+        # Freshly loaded from JSON: the caller's copy is not the stored one
+        self._memory_set(key, _copy(value), now + self.ttl_seconds)
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        """Store (a copy of) ``value`` under ``key`` for the configured TTL."""
+        if not self.enabled:
+            return
+
+        expires_at = time.time() + self.ttl_seconds
+        self._memory_set(key, _copy(value), expires_at)
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+
+    def clear(self) -> None:
+        """Drop all in-memory entries (the disk tier is left untouched)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters, current size and hit rate."""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    def _memory_set(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key: str, now: float) -> Optional[Any]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"{self.name} cache: unreadable disk entry {key[:8]}: {e}")
+            return None
+
+        if entry.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry.get("value")
+
+    def _disk_set(self, key: str, value: Any, expires_at: float) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"{self.name} cache: failed to write disk entry: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """Remove the oldest disk entries once the tier exceeds its size limit."""
+        try:
+            files = [
+                os.path.join(self.disk_dir, name)
+                for name in os.listdir(self.disk_dir)
+                if name.endswith(".json")
+            ]
+            if len(files) <= self.max_disk_entries:
+                return
+            files.sort(key=os.path.getmtime)
+            for path in files[: len(files) - self.max_disk_entries]:
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"{self.name} cache: disk prune failed: {e}")
@@ -0,0 +1,368 @@
+"""
+Cassettes
+
+Record/replay of the agent's outbound calls, so a real workload can be
+profiled and A/B-tested offline against identical responses. Covered: LLM
+calls (plain and streamed), MCP tool calls, Tavily searches and page
+downloads.
+
+- CASSETTE_MODE=record: calls go out as usual; each exchange is appended,
+  with its latency, to CASSETTE_PATH (gzipped JSON lines)
+- CASSETTE_MODE=replay: no external service is contacted; recorded
+  responses are served after their original latency times
+  CASSETTE_LATENCY_SCALE (0 serves them immediately)
+
+Requests are matched on a hash of their content (API tokens excluded). If a
+code change alters a request, e.g. a different prompt, replay falls back to
+the next unused recording of the same call type (LLM profile, MCP tool,
+Tavily depth) in recorded order, unless CASSETTE_STRICT=true. Cassettes hold
+prompts and fetched content verbatim; treat them like production data.
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    message_chunk_to_message,
+    messages_from_dict,
+    messages_to_dict,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from src.lib.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/session.jsonl.gz")
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1.0"))
+CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "false").lower() == "true"
+
+RECORDING = CASSETTE_MODE == "record"
+REPLAYING = CASSETTE_MODE == "replay"
+
+# Request fields never written to a cassette or used for matching
+_REDACTED_FIELDS = {"api_token", "api_key"}
+# Recorded entries buffered before they are appended to the file
+_FLUSH_EVERY = 32
+
+
+class CassetteMiss(LookupError):
+    """No recorded response for a call made while replaying."""
+
+
+class ReplayedError(RuntimeError):
+    """A recorded call that failed, raised again on replay."""
+
+
+def _key(kind: str, request: Any) -> str:
+    payload = json.dumps([kind, request], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def redact(request: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in request.items() if k not in _REDACTED_FIELDS}
+
+
+class Cassette:
+    """Recorded exchanges of one cassette file, indexed for replay."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._by_key: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+        self._by_op: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+        self._stats = {"recorded": 0, "exact": 0, "sequence": 0, "misses": 0}
+
+    def load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry["_used"] = False
+                self._by_key[(entry["kind"], entry["key"])].append(entry)
+                self._by_op[(entry["kind"], entry["op"])].append(entry)
+        logger.info(f"Loaded cassette {self.path}: {sum(len(e) for e in self._by_op.values())} exchanges")
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._buffer.append(entry)
+            self._stats["recorded"] += 1
+            if len(self._buffer) >= _FLUSH_EVERY:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._buffer:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Each flush appends a gzip member; readers see one continuous stream
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry, default=str) + "\n" for entry in self._buffer))
+        self._buffer.clear()
+
+    def take(self, kind: str, op: str, key: str) -> Dict[str, Any]:
+        """The recorded exchange to replay for a call."""
+        with self._lock:
+            matches = self._by_key.get((kind, key))
+            if matches:
+                entry = next((e for e in matches if not e["_used"]), matches[-1])
+                entry["_used"] = True
+                self._stats["exact"] += 1
+                return entry
+            if not CASSETTE_STRICT:
+                entry = next((e for e in self._by_op.get((kind, op), ()) if not e["_used"]), None)
+                if entry is not None:
+                    entry["_used"] = True
+                    self._stats["sequence"] += 1
+                    return entry
+            self._stats["misses"] += 1
+        raise CassetteMiss(f"No recorded {kind} call for {op!r} in {self.path}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["replayed"] = stats["exact"] + stats["sequence"]
+        return stats
+
+
+_cassette: Optional[Cassette] = None
+
+
+def get_cassette() -> Cassette:
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette(CASSETTE_PATH)
+        if REPLAYING:
+            _cassette.load()
+        elif RECORDING:
+            atexit.register(_cassette.flush)
+    return _cassette
+
+
+def get_cassette_stats() -> Dict[str, Any]:
+    """Exchanges recorded or replayed (exact and by-sequence matches) and misses."""
+    if _cassette is None:
+        return {"mode": CASSETTE_MODE}
+    return {"mode": CASSETTE_MODE, **_cassette.stats()}
+
+
+register_stats("cassette", get_cassette_stats)
+
+
+async def _replay_delay(seconds: float) -> None:
+    if seconds > 0 and CASSETTE_LATENCY_SCALE > 0:
+        await asyncio.sleep(seconds * CASSETTE_LATENCY_SCALE)
+
+
+async def through_cassette(
+    kind: str,
+    op: str,
+    request: Dict[str, Any],
+    call: Callable[[], Awaitable[Any]],
+    stored_request: Optional[Dict[str, Any]] = None,
+) -> Any:
+    """
+    Run an outbound call through the cassette.
+
+    ``request`` identifies the call and ``call`` performs it; its result must
+    be JSON-serializable. The request is written to the cassette for
+    reference, or ``stored_request`` instead (e.g. to leave out a prompt).
+    With no cassette mode this is just ``await call()``.
+    """
+    if not (RECORDING or REPLAYING):
+        return await call()
+
+    request = redact(request)
+    key = _key(kind, request)
+    if REPLAYING:
+        entry = get_cassette().take(kind, op, key)
+        await _replay_delay(entry["latency"])
+        if "error" in entry:
+            raise ReplayedError(entry["error"])
+        return entry["response"]
+
+    entry: Dict[str, Any] = {"kind": kind, "op": op, "key": key, "request": stored_request or request}
+    started = time.perf_counter()
+    try:
+        result = await call()
+        entry["response"] = result
+        return result
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        entry["latency"] = round(time.perf_counter() - started, 4)
+        get_cassette().record(entry)
+
+
+# LLM calls
+
+
+def _tool_names(tools: Optional[List[Dict[str, Any]]]) -> List[str]:
+    return [(t.get("function") or t).get("name", "") for t in tools or []]
+
+
+def _llm_request(messages: List[BaseMessage], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Provider-independent identity of an LLM call (message ids excluded)."""
+    return {
+        "messages": [
+            [
+                m.type,
+                m.content,
+                [[c["name"], c["args"]] for c in getattr(m, "tool_calls", None) or []],
+            ]
+            for m in messages
+        ],
+        "tools": _tool_names(kwargs.get("tools")),
+    }
+
+
+def _chunk_from_message(message: BaseMessage) -> AIMessageChunk:
+    if isinstance(message, AIMessageChunk):
+        return message
+    return AIMessageChunk(
+        content=message.content,
+        additional_kwargs=message.additional_kwargs,
+        response_metadata=message.response_metadata,
+        usage_metadata=getattr(message, "usage_metadata", None),
+        id=message.id,
+        tool_call_chunks=[
+            {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+            for i, c in enumerate(getattr(message, "tool_calls", None) or [])
+        ],
+    )
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Chat model that records the responses of ``inner`` or replays them.
+
+    Instances are built through cassette_chat_model(), which names the class
+    after the provider's model class: call sites that branch on the model
+    class name (Anthropic cache breakpoints, OpenAI parallel_tool_calls) then
+    behave the same when recording, replaying and live.
+    """
+
+    profile: str
+    inner: Optional[Any] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def bind_tools(self, tools, **kwargs):
+        if self.inner is not None:
+            # The provider formats the tools, so recordings carry real requests
+            return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Sync callers get the async path on an event loop of their own (in a
+        # helper thread when this one already runs a loop); the sync run
+        # manager cannot be awaited, so it is not passed on
+        coroutine = self._agenerate(messages, stop=stop, **kwargs)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        async def call():
+            result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return {"messages": messages_to_dict([g.message for g in result.generations])}
+
+        request = _llm_request(messages, kwargs)
+        response = await through_cassette("llm", self.profile, request, call, {"tools": request["tools"]})
+        if "chunks" in response:
+            merged = None
+            for _, chunk in _chunk_pairs(response):
+                merged = chunk if merged is None else merged + chunk
+            recorded = [message_chunk_to_message(merged)] if merged is not None else [AIMessage(content="")]
+        else:
+            recorded = messages_from_dict(response["messages"])
+        return ChatResult(generations=[ChatGeneration(message=m) for m in recorded])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        request = redact(_llm_request(messages, kwargs))
+        key = _key("llm", request)
+
+        if REPLAYING:
+            entry = get_cassette().take("llm", self.profile, key)
+            if "error" in entry:
+                await _replay_delay(entry["latency"])
+                raise ReplayedError(entry["error"])
+            response = entry["response"]
+            if "chunks" not in response:
+                # Recorded without streaming: one chunk after the full latency
+                await _replay_delay(entry["latency"])
+                for message in messages_from_dict(response["messages"]):
+                    yield ChatGenerationChunk(message=_chunk_from_message(message))
+                return
+            elapsed = 0.0
+            for offset, chunk in _chunk_pairs(response):
+                await _replay_delay(offset - elapsed)
+                elapsed = offset
+                yield ChatGenerationChunk(message=chunk)
+            return
+
+        if not RECORDING:
+            async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+
+        entry: Dict[str, Any] = {"kind": "llm", "op": self.profile, "key": key, "request": {"tools": request["tools"]}}
+        chunks: List[Tuple[float, Dict[str, Any]]] = []
+        started = time.perf_counter()
+        try:
+            async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                chunks.append((round(time.perf_counter() - started, 4), messages_to_dict([chunk.message])[0]))
+                yield chunk
+            entry["response"] = {"chunks": chunks}
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            entry["latency"] = round(time.perf_counter() - started, 4)
+            get_cassette().record(entry)
+
+
+def _chunk_pairs(response: Dict[str, Any]) -> List[Tuple[float, AIMessageChunk]]:
+    offsets = [offset for offset, _ in response["chunks"]]
+    chunks = messages_from_dict([chunk for _, chunk in response["chunks"]])
+    return list(zip(offsets, chunks))
+
+
+_model_classes: Dict[str, type] = {}
+
+
+def cassette_chat_model(
+    class_name: str, profile: str, inner: Optional[BaseChatModel], callbacks: Optional[list] = None
+) -> BaseChatModel:
+    """A CassetteChatModel around ``inner`` (None when replaying), named ``class_name``."""
+    cls = _model_classes.get(class_name)
+    if cls is None:
+        cls = _model_classes[class_name] = type(class_name, (CassetteChatModel,), {"__module__": __name__})
+    return cls(profile=profile, inner=inner, callbacks=callbacks)
@@ -0,0 +1,160 @@
+"""
+Chart Placement
+
+Deterministic placement of [CHART:title] markers into a written report.
+Replaces the "report editor" LLM pass: the report is split into paragraphs,
+each paragraph is scored against every chart's title and description, and
+charts are assigned so that each is used at most once, no two charts are
+adjacent, and charts never pile up at the end of the report.
+"""
+
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Minimum relevance for a chart to be placed by score; weaker charts are
+# spread over paragraphs that have no chart yet.
+MIN_PLACEMENT_SCORE = 0.05
+TITLE_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+_STOPWORDS = frozenset(
+    """
+    a an and are as at be by for from has have in into is it its of on or
+    over per than that the their this to was were which with vs versus
+    data chart rate total number share percent
+    """.split()
+)
+
+
+def _tokens(text: str) -> List[str]:
+    words = _WORD_RE.findall(text.lower())
+    return [_stem(w) for w in words if w not in _STOPWORDS and len(w) > 1]
+
+
+def _stem(word: str) -> str:
+    """Very small suffix stripper so 'rates'/'rate' and 'prices'/'price' match."""
+    if word.isdigit():
+        return word
+    for suffix in ("ies", "es", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[: -len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def is_text_paragraph(block: str) -> bool:
+    """Paragraphs that a chart may follow (not headings, markers or embeds)."""
+    stripped = block.strip()
+    if not stripped:
+        return False
+    if stripped.startswith("#") and "\n" not in stripped:
+        return False
+    if stripped.startswith("[CHART:") or stripped.startswith("<"):
+        return False
+    return True
+
+
+def split_paragraphs(report: str) -> List[str]:
+    """Split a markdown report into blank-line separated blocks."""
+    return [b for b in _PARAGRAPH_SPLIT_RE.split(report.strip()) if b.strip()]
+
+
+def score_paragraph(paragraph: str, title: str, description: str = "") -> float:
+    """
+    Relevance of ``paragraph`` to a chart, in [0, 1].
+
+    Weighted fraction of the chart's title and description terms that appear
+    in the paragraph; title terms count double.
+    """
+    paragraph_terms = set(_tokens(paragraph))
+    if not paragraph_terms:
+        return 0.0
+
+    title_terms = set(_tokens(title))
+    description_terms = set(_tokens(description)) - title_terms
+    total = TITLE_WEIGHT * len(title_terms) + DESCRIPTION_WEIGHT * len(description_terms)
+    if not total:
+        return 0.0
+
+    matched = TITLE_WEIGHT * len(title_terms & paragraph_terms) + DESCRIPTION_WEIGHT * len(
+        description_terms & paragraph_terms
+    )
+    return matched / total
+
+
+def assign_charts(
+    paragraphs: List[str], charts: Dict[str, str], taken: Iterable[int] = ()
+) -> Dict[int, str]:
+    """
+    Map paragraph index -> chart title.
+
+    Charts are assigned greedily by descending score, one chart per paragraph,
+    so every chart is separated from the next by at least one paragraph.
+    Charts that match nothing are distributed evenly over the remaining
+    paragraphs; if there are not enough paragraphs, they are left unplaced.
+    Paragraphs listed in ``taken`` already carry a chart and are skipped.
+    """
+    taken = set(taken)
+    candidates = [
+        i for i, p in enumerate(paragraphs) if is_text_paragraph(p) and i not in taken
+    ]
+    if not candidates or not charts:
+        return {}
+
+    scored: List[Tuple[float, int, str]] = []
+    for title, description in charts.items():
+        for i in candidates:
+            score = score_paragraph(paragraphs[i], title, description)
+            if score >= MIN_PLACEMENT_SCORE:
+                scored.append((score, i, title))
+    # Highest score first; ties go to the earlier paragraph
+    scored.sort(key=lambda s: (-s[0], s[1]))
+
+    assignment: Dict[int, str] = {}
+    placed = set()
+    for _, i, title in scored:
+        if title in placed or i in assignment:
+            continue
+        assignment[i] = title
+        placed.add(title)
+
+    unplaced = [title for title in charts if title not in placed]
+    free = [i for i in candidates if i not in assignment]
+    if unplaced and free:
+        step = len(free) / len(unplaced)
+        for n, title in enumerate(unplaced[: len(free)]):
+            assignment[free[int(n * step)]] = title
+            placed.add(title)
+
+    if len(placed) < len(charts):
+        logger.info(
+            f"Left {len(charts) - len(placed)} charts unplaced (not enough paragraphs)"
+        )
+    return assignment
+
+
+def place_chart_markers(report: str, charts: Dict[str, Optional[str]]) -> str:
+    """
+    Insert [CHART:title] markers into ``report``.
+
+    Args:
+        report: Markdown report text
+        charts: Mapping of chart title -> chart description
+
+    Returns:
+        The report with each placed chart's marker on its own line directly
+        after the paragraph it supports
+    """
+    paragraphs = split_paragraphs(report)
+    assignment = assign_charts(paragraphs, {t: d or "" for t, d in charts.items()})
+
+    blocks = []
+    for i, paragraph in enumerate(paragraphs):
+        blocks.append(paragraph)
+        if i in assignment:
+            blocks.append(f"[CHART:{assignment[i]}]")
+    return "\n\n".join(blocks)
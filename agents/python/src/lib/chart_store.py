@@ -0,0 +1,233 @@
+"""
+Chart Store
+
+Content-addressed side store for chart HTML, so the (large) MCP chart markup
+does not travel through agent state, checkpoints, state emissions or prompts.
+State carries only a short chart_id; the HTML is served by the /charts/{id}
+endpoint in main.py, and reports embed a compact iframe stub instead.
+
+Chart HTML is split into segments (script and style blocks vs. the rest),
+each stored once by hash, so boilerplate shared by every chart (such as the
+resize script) is kept only once. Memory use is bounded by
+CHART_STORE_MAX_CHARTS and CHART_STORE_TTL_SECONDS. Set CHART_STORE_DIR to
+keep the store on disk so it is shared between worker processes and survives
+restarts (and eviction from memory).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from src.lib.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+CHART_STORE_DIR = os.getenv("CHART_STORE_DIR") or None
+# Bound on the in-memory tier (charts, and seconds each is kept)
+CHART_STORE_MAX_CHARTS = int(os.getenv("CHART_STORE_MAX_CHARTS", "1000"))
+CHART_STORE_TTL_SECONDS = float(os.getenv("CHART_STORE_TTL_SECONDS", "86400"))
+
+_SEGMENT_RE = re.compile(r"(<script\b.*?</script>|<style\b.*?</style>)", re.IGNORECASE | re.DOTALL)
+_IFRAME_SRC_RE = re.compile(r"<iframe\b[^>]*?\bsrc=[\"']([^\"']+)[\"']", re.IGNORECASE | re.DOTALL)
+
+
+def _hash(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ChartStore:
+    """
+    Deduplicating, content-addressed store of chart HTML documents.
+
+    The in-memory tier holds at most ``max_charts`` charts, least recently used
+    first out, each for at most ``ttl_seconds``; a segment is kept while a
+    chart in memory uses it. Evicted charts are still served from the disk
+    tier when one is configured.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_charts: int = CHART_STORE_MAX_CHARTS,
+        ttl_seconds: float = CHART_STORE_TTL_SECONDS,
+    ):
+        self.directory = directory
+        self.max_charts = max_charts
+        self.ttl_seconds = ttl_seconds
+        # chart_id -> (expires_at, segment ids)
+        self._charts: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._segments: Dict[str, str] = {}
+        # segment id -> number of charts in memory using it
+        self._segment_refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"puts": 0, "raw_bytes": 0, "stored_bytes": 0, "evictions": 0}
+        if self.directory:
+            os.makedirs(os.path.join(self.directory, "segments"), exist_ok=True)
+            os.makedirs(os.path.join(self.directory, "charts"), exist_ok=True)
+
+    def put(self, html: str) -> str:
+        """Store ``html`` and return its chart_id."""
+        chart_id = _hash(html)[:16]
+        with self._lock:
+            self._stats["puts"] += 1
+            self._stats["raw_bytes"] += len(html)
+            if self._lookup(chart_id) is not None:
+                return chart_id
+
+        segments = [s for s in _SEGMENT_RE.split(html) if s]
+        segment_ids = [_hash(segment) for segment in segments]
+        with self._lock:
+            for segment_id, segment in zip(segment_ids, segments):
+                if self._store_segment(segment_id, segment):
+                    self._stats["stored_bytes"] += len(segment)
+            self._write(("charts", chart_id), "\n".join(segment_ids))
+            self._remember(chart_id, segment_ids, dict(zip(segment_ids, segments)))
+        return chart_id
+
+    def get(self, chart_id: str) -> Optional[str]:
+        """Reassemble the HTML for ``chart_id``, or None if unknown."""
+        with self._lock:
+            segment_ids = self._lookup(chart_id)
+            if segment_ids is not None:
+                return "".join(self._segments[segment_id] for segment_id in segment_ids)
+
+        stored = self._read(("charts", chart_id))
+        if stored is None:
+            return None
+        segment_ids = stored.split("\n")
+        parts = []
+        for segment_id in segment_ids:
+            with self._lock:
+                segment = self._segments.get(segment_id)
+            if segment is None:
+                segment = self._read(("segments", segment_id))
+                if segment is None:
+                    logger.warning(f"Chart {chart_id} is missing segment {segment_id[:8]}")
+                    return None
+            parts.append(segment)
+        with self._lock:
+            self._remember(chart_id, segment_ids, dict(zip(segment_ids, parts)))
+        return "".join(parts)
+
+    def stats(self) -> Dict[str, int]:
+        """Charts and segments held, bytes put vs. bytes actually stored, and evictions."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["charts"] = len(self._charts)
+            stats["segments"] = len(self._segments)
+        return stats
+
+    def _lookup(self, chart_id: str) -> Optional[List[str]]:
+        """Segment ids of a chart held in memory (None if absent or expired); caller holds the lock."""
+        entry = self._charts.get(chart_id)
+        if entry is None:
+            return None
+        expires_at, segment_ids = entry
+        if expires_at <= time.time():
+            del self._charts[chart_id]
+            self._release(segment_ids)
+            return None
+        self._charts.move_to_end(chart_id)
+        return segment_ids
+
+    def _remember(self, chart_id: str, segment_ids: List[str], segments: Dict[str, str]) -> None:
+        """Hold a chart and its segments in memory, evicting the least recently used; caller holds the lock."""
+        if chart_id in self._charts:
+            self._charts.move_to_end(chart_id)
+            return
+        for segment_id in set(segment_ids):
+            self._segments.setdefault(segment_id, segments[segment_id])
+            self._segment_refs[segment_id] = self._segment_refs.get(segment_id, 0) + 1
+        self._charts[chart_id] = (time.time() + self.ttl_seconds, segment_ids)
+        while len(self._charts) > self.max_charts:
+            _, (_, evicted) = self._charts.popitem(last=False)
+            self._release(evicted)
+            self._stats["evictions"] += 1
+
+    def _release(self, segment_ids: List[str]) -> None:
+        for segment_id in set(segment_ids):
+            refs = self._segment_refs.get(segment_id, 0) - 1
+            if refs > 0:
+                self._segment_refs[segment_id] = refs
+            else:
+                self._segment_refs.pop(segment_id, None)
+                self._segments.pop(segment_id, None)
+
+    def _store_segment(self, segment_id: str, segment: str) -> bool:
+        """Write a segment unless already stored; returns True if it was new."""
+        if segment_id in self._segments:
+            return False
+        if self.directory and os.path.exists(self._path(("segments", segment_id))):
+            return False
+        self._write(("segments", segment_id), segment)
+        return True
+
+    def _path(self, key) -> str:
+        kind, name = key
+        if not re.fullmatch(r"[0-9a-f]+", name):
+            raise ValueError(f"Invalid chart store key: {name}")
+        return os.path.join(self.directory, kind, name)
+
+    def _write(self, key, data: str) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write chart store entry {key[1][:8]}: {e}")
+
+    def _read(self, key) -> Optional[str]:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+
+_store = ChartStore(CHART_STORE_DIR)
+
+
+def put_chart(html: Optional[str]) -> Optional[str]:
+    """Store chart HTML and return its chart_id (None for empty HTML)."""
+    if not html:
+        return None
+    return _store.put(html)
+
+
+def get_chart(chart_id: str) -> Optional[str]:
+    """Full chart HTML for ``chart_id``, or None if unknown."""
+    return _store.get(chart_id)
+
+
+def get_chart_store_stats() -> Dict[str, int]:
+    return _store.stats()
+
+
+def chart_embed_stub(html: str) -> str:
+    """
+    Compact stand-in for chart HTML inside a report.
+
+    The report renderer only needs the iframe src, so the stub is a minimal
+    document carrying the original iframe; HTML without an iframe is kept as is.
+    """
+    match = _IFRAME_SRC_RE.search(html)
+    if not match:
+        return html
+    return (
+        f'<!doctype html><html><body><iframe width="100%" height="600" src="{match.group(1)}" '
+        'scrolling="no" frameborder="0"></iframe></body></html>'
+    )
+
+
+register_stats("chart_store", get_chart_store_stats)
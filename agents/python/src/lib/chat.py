@@ -1,26 +1,53 @@
 """Chat Node"""
 
 import logging
+import os
 from typing import List, Literal, cast
 
-from copilotkit.langgraph import copilotkit_customize_config, copilotkit_emit_state
+from copilotkit.langgraph import copilotkit_customize_config
 from langchain.tools import tool
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+    message_chunk_to_message,
+)
 from langchain_core.runnables import RunnableConfig
+from langchain_core.utils.json import parse_partial_json
 from langgraph.types import Command
 
+from src.lib.chart_placement import place_chart_markers
+from src.lib.context import (
+    CONTEXT_TOKENS_CHARTS,
+    CONTEXT_TOKENS_EXPLORE,
+    CONTEXT_TOKENS_RESOURCES,
+    build_prompt,
+    format_resources,
+    strip_embeds,
+)
 from src.lib.download import get_resource
-from src.lib.model import get_model
+from src.lib.emitter import emit_state, with_state_emitter
+from src.lib.entity_index import ensure_explored, index_context
+from src.lib.history import compact_history
+from src.lib.loop_monitor import run_cpu
+from src.lib.model import ainvoke_with_retries, get_model
+from src.lib.rate_limit import stream_with_retries
+from src.lib.report import ReportStreamer, inject_chart_iframes, sanitize_report
 from src.lib.state import AgentState, DataQuestion
-from src.lib.mcp_integration import (
-    get_visualization_iframe
-)
+from src.lib.tracing import span
 
 logger = logging.getLogger(__name__)
 
 
 # Feature toggles
 ENABLE_DEEP_QUERIES = False
+# "local" places charts with the deterministic placement engine;
+# "llm" uses the slower report-editor LLM pass
+CHART_PLACEMENT = os.getenv("CHART_PLACEMENT", "local").lower()
+# Stream WriteReport output to the UI paragraph by paragraph (always uses
+# local chart placement)
+STREAM_REPORT = os.getenv("STREAM_REPORT", "false").lower() == "true"
 
 
 @tool
@@ -85,6 +112,120 @@ def GenerateDataQuestions(questions: List[DataQuestion]):  # pylint: disable=inv
     """
 
 
+async def _insert_chart_markers_llm(
+    model, report: str, chart_titles: List[str], config: RunnableConfig
+) -> str:
+    """
+    Ask the model to insert [CHART:title] markers into the report.
+
+    Opt-in fallback for the local placement engine (CHART_PLACEMENT=llm).
+    The model echoes the whole report back, so this roughly doubles output tokens.
+    """
+    chart_list = "\n".join([f"- {title}" for title in chart_titles])
+
+    inject_response = await ainvoke_with_retries(
+        model,
+        [
+            SystemMessage(content=f"""You are a report editor. Your task is to insert chart markers into the report at appropriate positions.
+
+AVAILABLE CHARTS:
+{chart_list}
+
+RULES:
+1. Insert [CHART:exact_title] markers where each chart would best support the text
+2. Place markers AFTER the relevant paragraph (not in the middle of text)
+3. Each chart should be used exactly once
+4. Only use charts from the AVAILABLE CHARTS list above
+5. Return the COMPLETE report with markers inserted
+6. Do not modify the text content, only add markers
+7. Add a blank line before and after each marker
+
+CRITICAL PLACEMENT RULES:
+8. NEVER place more than two charts consecutively - there MUST be at least one paragraph of text between any two charts
+9. NEVER append multiple charts at the end of the report - distribute them throughout the text
+10. Each chart should be placed IMMEDIATELY after the paragraph that discusses its specific data/topic
+11. If the report doesn't have enough text to properly intersperse all charts, place charts where they're most relevant and leave remaining charts unplaced rather than clustering them
+
+Example of GOOD placement:
+The economy grew significantly in 2023...
+
+[CHART:GDP Growth 2023]
+
+This growth was driven by consumer spending. Meanwhile, unemployment continued its downward trend...
+
+[CHART:Unemployment Rate 2023]
+
+The labor market strength contributed to...
+
+Example of BAD placement (DO NOT DO THIS):
+The economy grew significantly in 2023...
+This growth was driven by consumer spending...
+The labor market showed improvement...
+
+[CHART:GDP Growth 2023]
+
+[CHART:Unemployment Rate 2023]
+
+[CHART:Inflation Data 2023]
+"""),
+            HumanMessage(content=f"Insert chart markers into this report:\n\n{report}")
+        ],
+        config
+    )
+
+    return inject_response.content if hasattr(inject_response, 'content') else str(inject_response)
+
+
+async def _stream_chat_response(
+    chat_model, messages: list, config: RunnableConfig, state: AgentState, tako_charts_map: dict
+):
+    """
+    Stream the chat model's response. When it turns out to be a WriteReport
+    call, the report is emitted paragraph by paragraph (with charts spliced
+    in) while it is still being generated.
+
+    Returns the complete response message and the ReportStreamer, or None if
+    the response was not a report.
+    """
+    gathered = None
+    report_streamer = None
+    # Length of the WriteReport arguments already checked for a newline
+    scanned = 0
+    # Once chunks have been emitted to the UI, a failure ends the turn
+    async for chunk in stream_with_retries("llm", lambda: chat_model.astream(messages, config)):
+        gathered = chunk if gathered is None else gathered + chunk
+        tool_call_chunks = gathered.tool_call_chunks
+        if not tool_call_chunks or tool_call_chunks[0].get("name") != "WriteReport":
+            continue
+
+        if report_streamer is None:
+            report_streamer = ReportStreamer(tako_charts_map)
+            state["logs"][-1]["done"] = True
+            state["logs"].append({"message": "Writing research report...", "done": False})
+            emit_state(config, state)
+
+        # Paragraphs only finish on a newline (escaped in the JSON arguments),
+        # so skip parsing otherwise; look one character back in case the
+        # escape was split across chunks
+        args = tool_call_chunks[0].get("args") or ""
+        new_newline = "\\n" in args[max(scanned - 1, 0):]
+        scanned = len(args)
+        if not new_newline:
+            continue
+        partial_args = parse_partial_json(args)
+        if not isinstance(partial_args, dict) or not partial_args.get("report"):
+            continue
+        partial_report = await report_streamer.update(partial_args["report"])
+        if partial_report is not None:
+            state["report"] = partial_report
+            emit_state(config, state)
+
+    if gathered is None:
+        return AIMessage(content=""), report_streamer
+    return message_chunk_to_message(gathered), report_streamer
+
+
+@with_state_emitter
 async def chat_node(
     state: AgentState, config: RunnableConfig
 ) -> Command[Literal["search_node", "chat_node", "delete_node", "__end__"]]:
@@ -114,6 +255,8 @@ async def chat_node(
     state["resources"] = state.get("resources", [])
     research_question = state.get("research_question", "")
     report = state.get("report", "")
+    if research_question:
+        ensure_explored(research_question)
 
     resources = []
     tako_charts_map = {}
@@ -136,14 +279,19 @@ async def chat_node(
             # Build Tako charts map for post-processing (generate iframe on demand)
             if title and (card_id or embed_url):
                 # Store card_id/embed_url for later iframe generation
-                tako_charts_map[title] = {"card_id": card_id, "embed_url": embed_url}
+                tako_charts_map[title] = {
+                    "chart_id": resource.get("chart_id"),
+                    "card_id": card_id,
+                    "embed_url": embed_url,
+                    "description": description,
+                }
                 available_tako_charts.append(f"  - **{title}**\n    Description: {description}")
         else:
             # Web resources: use pre-stored Tavily summary (no download needed)
             content = resource.get("content", "")
             if not content:
                 # Fallback: download if content is missing (shouldn't happen normally)
-                content = get_resource(resource["url"])
+                content = await get_resource(resource["url"])
                 if content == "ERROR":
                     continue
             resources.append({**resource, "content": content})
@@ -166,7 +314,7 @@ async def chat_node(
                - 2-3 BASIC questions (fast search) for straightforward data: "Country X GDP 2020-2024"
                - 1-2 COMPLEX questions (deep search) for analytical insights
                - 0-1 PREDICTION MARKET question (deep search) if relevant: "What are prediction market odds for X in 2025?"
-               - Use the entities, metrics, cohorts, and time periods listed in the knowledge base context above when available
+               - Use the entities, metrics, cohorts, and time periods listed in the knowledge base context below when available
                - Prefer exact entity/metric names from the knowledge base context for better search results"""
     else:
         data_questions_instructions = """2. THEN: Use GenerateDataQuestions to create 3-6 data-focused questions:
@@ -181,15 +329,15 @@ async def chat_node(
                  * "Compare US GDP and inflation" -> split into two queries
                  * "San Francisco population vs rent" -> split into two queries
                - 0-1 PREDICTION MARKET question (deep search) if relevant: "What are prediction market odds for X in 2025?"
-               - Use the entities, metrics, cohorts, and time periods listed in the knowledge base context above when available
+               - Use the entities, metrics, cohorts, and time periods listed in the knowledge base context below when available
                - Prefer exact entity/metric names from the knowledge base context for better search results"""
 
     # Add status update for query analysis
     state["logs"] = state.get("logs", [])
     state["logs"].append({"message": "Analyzing your research query...", "done": False})
-    await copilotkit_emit_state(config, state)
+    emit_state(config, state)
 
-    response = await model.bind_tools(
+    chat_model = model.bind_tools(
         [
             Search,
             WriteReport,
@@ -197,15 +345,13 @@ async def chat_node(
             GenerateDataQuestions,
         ],
         **ainvoke_kwargs,  # Pass the kwargs conditionally
-    ).ainvoke(
-        [
-            SystemMessage(
-                content=f"""
+    )
+    # Static instructions come first and are identical on every turn so
+    # provider prompt caching can reuse them; per-turn context follows.
+    static_prefix = f"""
             You are a research assistant. You help the user with writing a research report.
             Do not recite the resources, instead use them to answer the user's question.
 
-            {state.get("explore_context", "")}
-
             RESEARCH WORKFLOW:
             1. FIRST: When you receive a user's query, use WriteResearchQuestion to extract/formulate the core research question
             {data_questions_instructions}
@@ -219,12 +365,9 @@ async def chat_node(
             - This creates a clear, focused question from their natural language query
             - If a research question is already provided, YOU MUST NOT ASK FOR IT AGAIN
 
-            AVAILABLE DATA VISUALIZATIONS ({len(tako_charts_map)} charts):
-{available_tako_charts_str}
-
             WRITING GUIDELINES:
             - Write a COMPREHENSIVE report with substantial analysis and narrative text
-            - Use the chart descriptions above AND web resources to write detailed, insightful paragraphs
+            - Use the chart descriptions listed under AVAILABLE DATA VISUALIZATIONS AND web resources to write detailed, insightful paragraphs
             - For EACH chart, write at least 1-2 paragraphs discussing its key insights, trends, and implications
             - Structure the report so that text naturally leads into and follows from each data point
             - DO NOT include any chart markers, image syntax, or embed codes - charts will be inserted automatically
@@ -238,162 +381,120 @@ async def chat_node(
             Use the content and descriptions from both Tako charts and web resources to inform your report.
             To write the report, you should use the WriteReport tool. Never EVER respond with the report content, only use the tool.
             After writing the report, send a brief (1-2 sentence) follow-up asking if the user wants any changes or has questions. Do NOT summarize or repeat the report content in the chat.
+            """
 
-            This is the research question:
-            {research_question}
-
-            This is the research report:
-            {report}
+    history_messages, history_summary, history_updates = await compact_history(
+        state, get_model(state, "editing"), config
+    )
 
-            Here are the resources that you have available:
-            {resources}
-            """
+    static_prompt, dynamic_prompt, token_counts = build_prompt(
+        static_prefix,
+        [
+            ("history", "Summary of the earlier conversation:", history_summary, None),
+            (
+                "explore",
+                "",
+                state.get("explore_context") or index_context(research_question),
+                CONTEXT_TOKENS_EXPLORE,
+            ),
+            (
+                "charts",
+                f"AVAILABLE DATA VISUALIZATIONS ({len(tako_charts_map)} charts):",
+                available_tako_charts_str,
+                CONTEXT_TOKENS_CHARTS,
+            ),
+            ("research_question", "This is the research question:", research_question, None),
+            ("report", "This is the research report:", strip_embeds(report), None),
+            (
+                "resources",
+                "Here are the resources that you have available:",
+                format_resources(resources, CONTEXT_TOKENS_RESOURCES),
+                None,
             ),
-            *state["messages"],
         ],
-        config,
     )
+    logger.info(f"Chat context tokens: {token_counts}")
+
+    if model.__class__.__name__ in ["ChatAnthropic"]:
+        # Anthropic only caches up to an explicit breakpoint
+        system_content = [
+            {"type": "text", "text": static_prompt, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": dynamic_prompt},
+        ]
+    else:
+        system_content = f"{static_prompt}\n{dynamic_prompt}"
+
+    chat_messages = [
+        SystemMessage(content=system_content),
+        *history_messages,
+    ]
+
+    report_streamer = None
+    if STREAM_REPORT:
+        response, report_streamer = await _stream_chat_response(
+            chat_model, chat_messages, config, state, tako_charts_map
+        )
+    else:
+        response = await ainvoke_with_retries(chat_model, chat_messages, config)
 
     # Mark query analysis as complete
     state["logs"][-1]["done"] = True
-    await copilotkit_emit_state(config, state)
+    emit_state(config, state)
 
     ai_message = cast(AIMessage, response)
     if ai_message.tool_calls:
         if ai_message.tool_calls[0]["name"] == "WriteReport":
-            # Add progress indicator for report generation
-            state["logs"].append({"message": "Writing research report...", "done": False})
-            await copilotkit_emit_state(config, state)
-
             report = ai_message.tool_calls[0]["args"].get("report", "")
 
-            # Mark report writing as done
-            state["logs"][-1]["done"] = True
-            await copilotkit_emit_state(config, state)
-
-            # Clean up: Remove any markdown image links that the LLM incorrectly added
-            import re
-            external_domains = r'(tradingeconomics|worldbank|imf|fred|ourworldindata|statista)'
-            report = re.sub(rf'!\[([^\]]+)\]\(https?://[^)]*{external_domains}[^)]*\)',
-                          r'', report, flags=re.IGNORECASE)
-
-            # Remove any markdown images
-            report = re.sub(r'!\[[^\]]*\]\([^)]+\)', '', report)
-
-            # Remove any leftover chart markers (in case model still added them)
-            report = re.sub(r'\[TAKO_CHART:[^\]]+\]', '', report)
-
-            # Second pass: Inject charts at appropriate positions
-            processed_report = report
-            if tako_charts_map:
-                state["logs"].append({"message": "Inserting data visualizations...", "done": False})
-                await copilotkit_emit_state(config, state)
-                # Build chart list for injection prompt
-                chart_list = "\n".join([f"- {title}" for title in tako_charts_map.keys()])
-
-                # Ask model to insert chart markers at appropriate positions
-                inject_response = await model.ainvoke(
-                    [
-                        SystemMessage(content=f"""You are a report editor. Your task is to insert chart markers into the report at appropriate positions.
-
-AVAILABLE CHARTS:
-{chart_list}
+            if report_streamer:
+                # Paragraphs and charts were already streamed; place the rest
+                with span("report.finish"):
+                    processed_report = await report_streamer.finish(report)
+            else:
+                # Add progress indicator for report generation
+                state["logs"].append({"message": "Writing research report...", "done": False})
+                emit_state(config, state)
 
-RULES:
-1. Insert [CHART:exact_title] markers where each chart would best support the text
-2. Place markers AFTER the relevant paragraph (not in the middle of text)
-3. Each chart should be used exactly once
-4. Only use charts from the AVAILABLE CHARTS list above
-5. Return the COMPLETE report with markers inserted
-6. Do not modify the text content, only add markers
-7. Add a blank line before and after each marker
-
-CRITICAL PLACEMENT RULES:
-8. NEVER place more than two charts consecutively - there MUST be at least one paragraph of text between any two charts
-9. NEVER append multiple charts at the end of the report - distribute them throughout the text
-10. Each chart should be placed IMMEDIATELY after the paragraph that discusses its specific data/topic
-11. If the report doesn't have enough text to properly intersperse all charts, place charts where they're most relevant and leave remaining charts unplaced rather than clustering them
-
-Example of GOOD placement:
-The economy grew significantly in 2023...
-
-[CHART:GDP Growth 2023]
-
-This growth was driven by consumer spending. Meanwhile, unemployment continued its downward trend...
-
-[CHART:Unemployment Rate 2023]
-
-The labor market strength contributed to...
-
-Example of BAD placement (DO NOT DO THIS):
-The economy grew significantly in 2023...
-This growth was driven by consumer spending...
-The labor market showed improvement...
-
-[CHART:GDP Growth 2023]
-
-[CHART:Unemployment Rate 2023]
-
-[CHART:Inflation Data 2023]
-"""),
-                        HumanMessage(content=f"Insert chart markers into this report:\n\n{report}")
-                    ],
-                    config
-                )
-
-                report_with_markers = inject_response.content if hasattr(inject_response, 'content') else str(inject_response)
-
-                # Replace chart markers with actual iframe HTML
-                async def replace_marker(match):
-                    chart_title = match.group(1).strip()
-                    chart_info = tako_charts_map.get(chart_title)
-
-                    # Try case-insensitive match if exact match fails
-                    if not chart_info:
-                        for title, info in tako_charts_map.items():
-                            if title.lower() == chart_title.lower():
-                                chart_info = info
-                                break
-
-                    if not chart_info:
-                        logger.warning(f"Chart not found: {chart_title}")
-                        return ""
-
-                    iframe_html = await get_visualization_iframe(
-                        item_id=chart_info.get("card_id"),
-                        embed_url=chart_info.get("embed_url")
-                    )
-
-                    if iframe_html:
-                        iframe_only = re.sub(r'<script.*?</script>', '', iframe_html, flags=re.DOTALL)
-                        return "\n" + iframe_only.strip() + "\n"
-                    return ""
-
-                # Find and replace all markers
-                markers = list(re.finditer(r'\[CHART:([^\]]+)\]', report_with_markers))
-                replacements = []
-                for match in markers:
-                    replacement = await replace_marker(match)
-                    replacements.append((match.start(), match.end(), replacement))
-
-                # Apply replacements in reverse order
-                processed_report = report_with_markers
-                for start, end, replacement in reversed(replacements):
-                    processed_report = processed_report[:start] + replacement + processed_report[end:]
-
-                logger.info(f"Injected {len([r for r in replacements if r[2]])} charts into report")
-
-                # Mark chart injection as done
+                # Mark report writing as done
                 state["logs"][-1]["done"] = True
-                await copilotkit_emit_state(config, state)
+                emit_state(config, state)
+
+                report = await run_cpu(sanitize_report, report, size=len(report))
+
+                # Second pass: Inject charts at appropriate positions
+                processed_report = report
+                if tako_charts_map:
+                    state["logs"].append({"message": "Inserting data visualizations...", "done": False})
+                    emit_state(config, state)
+                    with span("report.chart_placement", strategy=CHART_PLACEMENT, charts=len(tako_charts_map)):
+                        if CHART_PLACEMENT == "llm":
+                            report_with_markers = await _insert_chart_markers_llm(
+                                get_model(state, "editing"), report, list(tako_charts_map.keys()), config
+                            )
+                        else:
+                            report_with_markers = await run_cpu(
+                                place_chart_markers,
+                                report,
+                                {title: info.get("description") for title, info in tako_charts_map.items()},
+                                size=len(report),
+                            )
+
+                    # Replace chart markers with actual iframe HTML
+                    with span("report.inject_charts"):
+                        processed_report = await inject_chart_iframes(report_with_markers, tako_charts_map)
+
+                    # Mark chart injection as done
+                    state["logs"][-1]["done"] = True
+                    emit_state(config, state)
 
             # Clear logs before showing final report
             state["logs"] = []
-            await copilotkit_emit_state(config, state)
+            emit_state(config, state)
 
             return Command(
                 goto="chat_node",
                 update={
+                    **history_updates,
                     "report": processed_report,
                     "resources": state.get("resources", []),  # Preserve resources
                     "messages": [
@@ -407,9 +508,12 @@ The labor market showed improvement...
             )
         if ai_message.tool_calls[0]["name"] == "WriteResearchQuestion":
             research_question = ai_message.tool_calls[0]["args"]["research_question"]
+            # Learn the question's entities while the model plans its data questions
+            ensure_explored(research_question)
             return Command(
                 goto="chat_node",
                 update={
+                    **history_updates,
                     "research_question": research_question,
                     "resources": state.get("resources", []),  # Preserve resources
                     "messages": [
@@ -439,12 +543,13 @@ The labor market showed improvement...
                     "message": f"Generated {len(data_questions)} search questions",
                     "done": True
                 })
-                await copilotkit_emit_state(config, state)
+                emit_state(config, state)
 
             logger.info(f"GenerateDataQuestions: Routing to search_node with {len(data_questions)} questions")
             return Command(
                 goto="search_node",
                 update={
+                    **history_updates,
                     "data_questions": data_questions,
                     "resources": state.get("resources", []),  # Preserve resources
                     "messages": [
@@ -458,4 +563,7 @@ The labor market showed improvement...
             )
 
     logger.info(f"=== CHAT_NODE: Routing to {goto} ===")
-    return Command(goto=goto, update={"messages": response, "resources": state.get("resources", [])})
+    return Command(
+        goto=goto,
+        update={**history_updates, "messages": response, "resources": state.get("resources", [])},
+    )
@@ -0,0 +1,506 @@
+"""
+Checkpointer
+
+Checkpoint backends for the FastAPI deployment, selected with CHECKPOINTER:
+
+- "memory" (default): in-process MemorySaver, lost on restart
+- "sqlite": durable SQLite database at CHECKPOINT_DB_PATH
+
+Both backends keep only the last CHECKPOINT_KEEP_PER_THREAD checkpoints of a
+thread and drop threads idle for longer than CHECKPOINT_THREAD_TTL_SECONDS,
+so storage stays bounded on long-running deployments. The SQLite backend runs
+in WAL mode and groups the commits of a super-step's writes into one.
+
+Checkpoints are written with the delta serializer (see serde.py) unless
+CHECKPOINT_SERDE=default; its shared blobs are garbage collected together
+with thread expiry.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Set, Tuple
+
+import aiosqlite
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from src.lib.serde import DeltaSerializer, MemoryBlobStore, SqliteBlobStore
+from src.lib.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTER = os.getenv("CHECKPOINTER", "memory").lower()
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", ".data/checkpoints.db")
+# Checkpoints kept per thread; older ones (and their pending writes) are pruned
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "10"))
+# Threads without a new checkpoint for this long are deleted (0 disables expiry)
+CHECKPOINT_THREAD_TTL_SECONDS = float(os.getenv("CHECKPOINT_THREAD_TTL_SECONDS", str(7 * 24 * 3600)))
+CHECKPOINT_SWEEP_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_SWEEP_INTERVAL_SECONDS", "600"))
+# Writes within this window share a single commit (0: writes issued together)
+CHECKPOINT_COMMIT_INTERVAL_MS = float(os.getenv("CHECKPOINT_COMMIT_INTERVAL_MS", "50"))
+# "delta" (shared compressed blobs for messages, resources and the report) or "default"
+CHECKPOINT_SERDE = os.getenv("CHECKPOINT_SERDE", "delta").lower()
+
+_stats = {
+    "checkpoints": 0,
+    "commits": 0,
+    "pruned_checkpoints": 0,
+    "expired_threads": 0,
+    "collected_blobs": 0,
+}
+
+
+class _ThreadExpiry:
+    """
+    Periodically deletes idle threads.
+
+    ``expire(cutoff)`` deletes the threads idle since before ``cutoff`` and
+    ``collect()`` garbage collects serializer blobs; both return how many
+    they removed.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        interval_seconds: float,
+        expire: Callable[[float], Awaitable[int]],
+        collect: Callable[[], Awaitable[int]],
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.interval_seconds = interval_seconds
+        self._expire = expire
+        self._collect = collect
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background sweep on the running loop (idempotent)."""
+        if self.ttl_seconds <= 0 or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                expired = await self._expire(time.time() - self.ttl_seconds)
+                if expired:
+                    _stats["expired_threads"] += expired
+                    logger.info(f"Expired {expired} idle checkpoint threads")
+                collected = await self._collect()
+                if collected:
+                    _stats["collected_blobs"] += collected
+                    logger.info(f"Removed {collected} unreferenced checkpoint blobs")
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"Checkpoint thread expiry failed: {e}")
+
+
+class BoundedMemorySaver(MemorySaver):
+    """MemorySaver that prunes old checkpoints and expires idle threads."""
+
+    def __init__(
+        self,
+        keep_per_thread: int = CHECKPOINT_KEEP_PER_THREAD,
+        ttl_seconds: float = CHECKPOINT_THREAD_TTL_SECONDS,
+        sweep_interval_seconds: float = CHECKPOINT_SWEEP_INTERVAL_SECONDS,
+        serde: Optional[DeltaSerializer] = None,
+    ):
+        super().__init__(serde=serde)
+        self.keep_per_thread = keep_per_thread
+        self._delta = serde
+        self._last_active: Dict[str, float] = {}
+        # (thread_id, checkpoint_ns) -> checkpoint id -> the (channel, version)
+        # pairs it refers to, and how many kept checkpoints refer to each pair;
+        # pruning drops blobs without deserializing the kept checkpoints
+        self._versions: Dict[Tuple[str, str], Dict[str, Tuple[Tuple[str, Any], ...]]] = defaultdict(dict)
+        self._refs: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self._expiry = _ThreadExpiry(ttl_seconds, sweep_interval_seconds, self._expire, self._collect)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = saved["configurable"]["thread_id"]
+        checkpoint_ns = saved["configurable"]["checkpoint_ns"]
+        self._last_active[thread_id] = time.time()
+        _stats["checkpoints"] += 1
+        self._track(thread_id, checkpoint_ns, checkpoint["id"], tuple(checkpoint["channel_versions"].items()))
+        self._prune(thread_id, checkpoint_ns)
+        return saved
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        self._expiry.start()
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    def _track(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, versions: Tuple) -> None:
+        self._untrack(thread_id, checkpoint_ns, checkpoint_id)
+        self._versions[(thread_id, checkpoint_ns)][checkpoint_id] = versions
+        self._refs[(thread_id, checkpoint_ns)].update(versions)
+
+    def _untrack(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> None:
+        """Forget a checkpoint, dropping the channel values no kept checkpoint refers to."""
+        versions = self._versions[(thread_id, checkpoint_ns)].pop(checkpoint_id, ())
+        refs = self._refs[(thread_id, checkpoint_ns)]
+        for channel_version in versions:
+            refs[channel_version] -= 1
+            if refs[channel_version] <= 0:
+                del refs[channel_version]
+                self.blobs.pop((thread_id, checkpoint_ns, *channel_version), None)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_per_thread:
+            return
+        # Checkpoint ids are time-ordered, so sorting keeps the most recent
+        stale = sorted(checkpoints)[: -self.keep_per_thread]
+        for checkpoint_id in stale:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._untrack(thread_id, checkpoint_ns, checkpoint_id)
+        _stats["pruned_checkpoints"] += len(stale)
+
+    async def _expire(self, cutoff: float) -> int:
+        idle = [t for t, active in self._last_active.items() if active < cutoff]
+        for thread_id in idle:
+            self.delete_thread(thread_id)
+        return len(idle)
+
+    async def _collect(self) -> int:
+        if self._delta is None:
+            return 0
+        payloads = [p for stored in self.storage.values() for ns in stored.values() for p, _, _ in ns.values()]
+        payloads += list(self.blobs.values())
+        payloads += [w[2] for writes in self.writes.values() for w in writes.values()]
+        return self._delta.store.sweep(self._delta.live_keys(payloads))
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        self._last_active.pop(thread_id, None)
+        for key in [k for k in self._versions if k[0] == thread_id]:
+            del self._versions[key]
+            self._refs.pop(key, None)
+
+    async def aclose(self) -> None:
+        await self._expiry.stop()
+
+
+class DurableSqliteSaver(AsyncSqliteSaver):
+    """
+    AsyncSqliteSaver tuned for a long-running server.
+
+    The connection is opened lazily on the serving event loop, so the graph
+    can be compiled at import time. Checkpoints and writes are committed in
+    batches (at most CHECKPOINT_COMMIT_INTERVAL_MS apart); reads share the
+    same connection, so they always see uncommitted writes.
+    """
+
+    # Until setup() opens the connection
+    conn: Optional[aiosqlite.Connection] = None
+    is_setup = False
+
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB_PATH,
+        keep_per_thread: int = CHECKPOINT_KEEP_PER_THREAD,
+        ttl_seconds: float = CHECKPOINT_THREAD_TTL_SECONDS,
+        sweep_interval_seconds: float = CHECKPOINT_SWEEP_INTERVAL_SECONDS,
+        commit_interval_seconds: float = CHECKPOINT_COMMIT_INTERVAL_MS / 1000,
+        serde: Optional[DeltaSerializer] = None,
+    ):
+        # AsyncSqliteSaver.__init__ needs a running loop and an open
+        # connection, so it runs in setup()
+        self._delta = serde
+        self.path = path
+        self._setup_lock = asyncio.Lock()
+        self.keep_per_thread = keep_per_thread
+        self.commit_interval_seconds = commit_interval_seconds
+        self._dirty_threads: Set[Tuple[str, str]] = set()
+        self._commit_task: Optional[asyncio.Task] = None
+        self._expiry = _ThreadExpiry(ttl_seconds, sweep_interval_seconds, self._expire, self._collect)
+
+    async def setup(self) -> None:
+        if self.is_setup:
+            return
+        async with self._setup_lock:
+            if self.is_setup:
+                return
+            await self._open()
+        self._expiry.start()
+        logger.info(f"SQLite checkpointer ready at {self.path}")
+
+    async def _open(self) -> None:
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = await aiosqlite.connect(self.path)
+            # WAL is set by the base setup; NORMAL sync is durable in WAL mode
+            # except for the last transactions before a power loss
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            await conn.execute("PRAGMA busy_timeout=5000")
+            super().__init__(conn, serde=self._delta)
+        await super().setup()
+        async with self.lock:
+            await self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS thread_activity (
+                    thread_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            await self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+                    key TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            await self.conn.commit()
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        await self.setup()
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        serialized_metadata = json.dumps(
+            get_checkpoint_metadata(config, metadata), ensure_ascii=False
+        ).encode("utf-8", "ignore")
+        async with self.lock:
+            await self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, "
+                "parent_checkpoint_id, type, checkpoint, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    type_,
+                    serialized_checkpoint,
+                    serialized_metadata,
+                ),
+            )
+            await self.conn.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+        _stats["checkpoints"] += 1
+        self._dirty_threads.add((thread_id, checkpoint_ns))
+        self._schedule_commit()
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        verb = "REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "IGNORE"
+        query = (
+            f"INSERT OR {verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, "
+            "task_path, idx, channel, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        await self.setup()
+        async with self.lock:
+            await self.conn.executemany(
+                query,
+                [
+                    (
+                        str(config["configurable"]["thread_id"]),
+                        str(config["configurable"]["checkpoint_ns"]),
+                        str(config["configurable"]["checkpoint_id"]),
+                        task_id,
+                        task_path,
+                        WRITES_IDX_MAP.get(channel, idx),
+                        channel,
+                        *self.serde.dumps_typed(value),
+                    )
+                    for idx, (channel, value) in enumerate(writes)
+                ],
+            )
+        self._schedule_commit()
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.setup()
+        await super().adelete_thread(thread_id)
+        async with self.lock:
+            await self.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+    def _schedule_commit(self) -> None:
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.ensure_future(self._commit_after_window())
+
+    async def _commit_after_window(self) -> None:
+        await asyncio.sleep(self.commit_interval_seconds)
+        try:
+            await self.flush()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"Checkpoint commit failed: {e}")
+
+    async def flush(self) -> None:
+        """Prune the threads written since the last commit, then commit."""
+        if self.conn is None:
+            return
+        dirty, self._dirty_threads = self._dirty_threads, set()
+        blobs = self._delta.store.pending() if self._blob_store_is_sqlite() else {}
+        async with self.lock:
+            if blobs:
+                now = time.time()
+                await self.conn.executemany(
+                    "INSERT OR IGNORE INTO checkpoint_blobs (key, data, created_at) VALUES (?, ?, ?)",
+                    [(key, data, now) for key, data in blobs.items()],
+                )
+            for thread_id, checkpoint_ns in dirty:
+                await self._prune(thread_id, checkpoint_ns)
+            await self.conn.commit()
+        if blobs:
+            self._delta.store.mark_stored(blobs)
+        _stats["commits"] += 1
+
+    def _blob_store_is_sqlite(self) -> bool:
+        return self._delta is not None and isinstance(self._delta.store, SqliteBlobStore)
+
+    async def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        async with self.conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.keep_per_thread),
+        ) as cursor:
+            stale = [row[0] for row in await cursor.fetchall()]
+        if not stale:
+            return
+        for table in ("checkpoints", "writes"):
+            await self.conn.executemany(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id in stale],
+            )
+        _stats["pruned_checkpoints"] += len(stale)
+
+    async def _expire(self, cutoff: float) -> int:
+        async with self.lock:
+            async with self.conn.execute(
+                "SELECT thread_id FROM thread_activity WHERE updated_at < ?", (cutoff,)
+            ) as cursor:
+                idle = [row[0] for row in await cursor.fetchall()]
+        for thread_id in idle:
+            await self.adelete_thread(thread_id)
+        return len(idle)
+
+    async def _collect(self) -> int:
+        if not self._blob_store_is_sqlite():
+            return 0
+        await self.flush()
+        async with self.lock:
+            # One write transaction from gathering references to deleting, so
+            # other worker processes cannot commit new references in between
+            await self.conn.commit()
+            await self.conn.execute("BEGIN IMMEDIATE")
+            payloads = []
+            for query in (
+                "SELECT type, checkpoint FROM checkpoints",
+                "SELECT type, value FROM writes",
+            ):
+                async with self.conn.execute(query) as cursor:
+                    payloads += await cursor.fetchall()
+            live = self._delta.live_keys(payloads)
+            pending = self._delta.store.pending()
+            async with self.conn.execute("SELECT key FROM checkpoint_blobs") as cursor:
+                dead = [(row[0],) for row in await cursor.fetchall() if row[0] not in live and row[0] not in pending]
+            await self.conn.executemany("DELETE FROM checkpoint_blobs WHERE key = ?", dead)
+            await self.conn.commit()
+        return len(dead)
+
+    async def aclose(self) -> None:
+        """Commit pending writes, stop the expiry sweep and close the database."""
+        await self._expiry.stop()
+        if self.conn is not None:
+            await self.flush()
+            await self.conn.close()
+            self.conn = None
+            self.is_setup = False
+        if self._blob_store_is_sqlite():
+            self._delta.store.close()
+
+
+_checkpointer: Optional[BaseCheckpointSaver] = None
+
+
+def get_checkpointer() -> BaseCheckpointSaver:
+    """The process-wide checkpointer for the configured backend."""
+    global _checkpointer
+    if _checkpointer is None:
+        if CHECKPOINT_SERDE not in ("delta", "default"):
+            raise ValueError(f"Invalid CHECKPOINT_SERDE: {CHECKPOINT_SERDE}")
+        delta = CHECKPOINT_SERDE == "delta"
+        if CHECKPOINTER == "sqlite":
+            serde = DeltaSerializer(SqliteBlobStore(CHECKPOINT_DB_PATH)) if delta else None
+            _checkpointer = DurableSqliteSaver(serde=serde)
+        elif CHECKPOINTER == "memory":
+            serde = DeltaSerializer(MemoryBlobStore()) if delta else None
+            _checkpointer = BoundedMemorySaver(serde=serde)
+        else:
+            raise ValueError(f"Invalid CHECKPOINTER: {CHECKPOINTER}")
+        logger.info(f"Using {CHECKPOINTER} checkpointer")
+    return _checkpointer
+
+
+async def close_checkpointer() -> None:
+    """Flush and close the checkpointer on shutdown."""
+    if _checkpointer is not None and hasattr(_checkpointer, "aclose"):
+        await _checkpointer.aclose()
+
+
+def get_checkpoint_stats() -> Dict[str, Any]:
+    """Checkpoints written, commits, and checkpoints/threads removed by pruning and expiry."""
+    stats: Dict[str, Any] = dict(_stats)
+    stats["backend"] = CHECKPOINTER
+    delta = getattr(_checkpointer, "_delta", None)
+    if delta is not None:
+        stats["serde"] = delta.stats()
+    return stats
+
+
+register_stats("checkpoint", get_checkpoint_stats)
@@ -0,0 +1,144 @@
+"""
+Context Builder
+
+Assembles the chat system prompt from a static instruction prefix followed by
+dynamic sections (charts, research question, report, resources), the
+bounded ones fitted to their own token budget. Keeping the static part first and byte-identical
+across turns lets provider-side prompt caching reuse it.
+"""
+
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-section token budgets for the dynamic part of the prompt. The report
+# has none: the model edits it through WriteReport, so it must see all of it
+CONTEXT_TOKENS_EXPLORE = int(os.getenv("CONTEXT_TOKENS_EXPLORE", "500"))
+CONTEXT_TOKENS_CHARTS = int(os.getenv("CONTEXT_TOKENS_CHARTS", "1500"))
+CONTEXT_TOKENS_RESOURCES = int(os.getenv("CONTEXT_TOKENS_RESOURCES", "6000"))
+# Cap on a single resource's content before the section budget is applied
+CONTEXT_TOKENS_PER_RESOURCE = int(os.getenv("CONTEXT_TOKENS_PER_RESOURCE", "600"))
+
+_TRUNCATION_MARKER = "[... truncated ...]"
+_EMBED_RE = re.compile(r"<!doctype html>.*?</html>|<iframe.*?</iframe>", re.IGNORECASE | re.DOTALL)
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """tiktoken encoding if available (it ships with langchain-openai)."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # pylint: disable=broad-except
+            logger.info("tiktoken unavailable, estimating tokens from characters")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of ``text`` (approximate for non-OpenAI providers)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Shorten ``text`` to roughly its first ``max_tokens``."""
+    if max_tokens <= 0:
+        return ""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+
+    # Scale by characters; token density is close enough to uniform
+    keep_chars = int(len(text) * max_tokens / tokens)
+    return f"{text[:keep_chars].rstrip()} {_TRUNCATION_MARKER}"
+
+
+def strip_embeds(report: str) -> str:
+    """Replace inlined chart HTML in a report with a short placeholder."""
+    return _EMBED_RE.sub("[chart]", report)
+
+
+def format_resources(resources: List[Dict[str, Any]], max_tokens: int) -> str:
+    """
+    Render resources as compact text blocks within ``max_tokens``.
+
+    Each resource's content is first capped at CONTEXT_TOKENS_PER_RESOURCE;
+    if the section is still over budget, every resource's content is cut
+    down by the same factor so all resources stay visible.
+    """
+    if not resources:
+        return "(No resources yet)"
+
+    entries = []
+    for resource in resources:
+        header = (
+            f"- {resource.get('title', '')} ({resource.get('resource_type', 'web')})\n"
+            f"  URL: {resource.get('url', '')}"
+        )
+        content = truncate_to_tokens(
+            resource.get("content") or resource.get("description") or "",
+            CONTEXT_TOKENS_PER_RESOURCE,
+        )
+        entries.append((header, content))
+
+    def render(scale: float) -> str:
+        blocks = []
+        for header, content in entries:
+            if scale < 1.0:
+                content = truncate_to_tokens(content, int(count_tokens(content) * scale))
+            blocks.append(f"{header}\n  Content: {content}" if content else header)
+        return "\n".join(blocks)
+
+    rendered = render(1.0)
+    tokens = count_tokens(rendered)
+    if tokens > max_tokens:
+        headers_tokens = sum(count_tokens(header) for header, _ in entries)
+        content_budget = max(max_tokens - headers_tokens, 0)
+        content_tokens = max(tokens - headers_tokens, 1)
+        rendered = render(content_budget / content_tokens)
+    return rendered
+
+
+def build_prompt(
+    static_prefix: str, sections: List[Tuple[str, str, str, Optional[int]]]
+) -> Tuple[str, str, Dict[str, int]]:
+    """
+    Fit dynamic sections to their budgets and append them after the static prefix.
+
+    Args:
+        static_prefix: Instructions that are identical on every turn
+        sections: (name, heading, text, token budget or None for unbounded)
+                  tuples; empty sections are skipped. Only give a budget to
+                  sections that can lose their end (lists, context), never
+                  to text the model edits, such as the report
+
+    Returns:
+        (static prefix, dynamic suffix, per-section token counts)
+    """
+    token_counts = {"static": count_tokens(static_prefix)}
+    parts = []
+    for name, heading, text, budget in sections:
+        if not text:
+            continue
+        if budget is not None:
+            # Budgeted sections are lists ordered by relevance; keep the head
+            text = truncate_to_tokens(text, budget)
+        parts.append(f"{heading}\n{text}" if heading else text)
+        token_counts[name] = count_tokens(text)
+
+    dynamic = "\n\n".join(parts)
+    token_counts["total"] = sum(token_counts.values())
+    return static_prefix, dynamic, token_counts
@@ -2,54 +2,98 @@
 This module contains the implementation of the download_node function.
 """
 
+import hashlib
+import os
+from typing import Any, Dict
+
 import aiohttp
 import html2text
-from copilotkit.langgraph import copilotkit_emit_state
 from langchain_core.runnables import RunnableConfig
 
+from src.lib.cache import TTLCache
+from src.lib.cassette import through_cassette
+from src.lib.emitter import emit_state, with_state_emitter
+from src.lib.loop_monitor import run_cpu
+from src.lib.metrics import register_stats, track
 from src.lib.state import AgentState
 
-_RESOURCE_CACHE = {}
+# Downloaded resource content. Set RESOURCE_CACHE_DIR to share it between
+# worker processes, so any worker can serve the next turn of a thread.
+RESOURCE_CACHE_TTL_SECONDS = float(os.getenv("RESOURCE_CACHE_TTL_SECONDS", str(24 * 3600)))
+RESOURCE_CACHE_MAX_ENTRIES = int(os.getenv("RESOURCE_CACHE_MAX_ENTRIES", "1024"))
+RESOURCE_CACHE_DIR = os.getenv("RESOURCE_CACHE_DIR") or None
+
+_RESOURCE_CACHE = TTLCache(
+    "resources",
+    ttl_seconds=RESOURCE_CACHE_TTL_SECONDS,
+    max_entries=RESOURCE_CACHE_MAX_ENTRIES,
+    disk_dir=RESOURCE_CACHE_DIR,
+)
+
+
+def _resource_key(url: str) -> str:
+    # URLs are case-sensitive, so TTLCache.make_key's normalization is not used
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
 
 
-def get_resource(url: str):
+async def get_resource(url: str):
     """
     Get a resource from the cache.
     """
-    return _RESOURCE_CACHE.get(url, "")
+    return await _RESOURCE_CACHE.get(_resource_key(url)) or ""
+
+
+def get_resource_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and size of the downloaded resource cache."""
+    return _RESOURCE_CACHE.stats()
+
+
+register_stats("resource_cache", get_resource_cache_stats)
 
 
 _USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"  # pylint: disable=line-too-long
 
 
+async def _fetch_html(url: str) -> str:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            url,
+            headers={"User-Agent": _USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=10),
+        ) as response:
+            response.raise_for_status()
+            return await response.text()
+
+
+def _to_markdown(html_content: str) -> str:
+    markdown_content = html2text.html2text(html_content)
+
+    # Truncate to first 3000 chars to reduce context bloat
+    # Full web articles can be 50KB+, we only need key info
+    MAX_CONTENT_LENGTH = 3000
+    if len(markdown_content) > MAX_CONTENT_LENGTH:
+        markdown_content = markdown_content[:MAX_CONTENT_LENGTH] + "\n\n[... content truncated for brevity ...]"
+    return markdown_content
+
+
 async def _download_resource(url: str):
     """
     Download a resource from the internet asynchronously.
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                headers={"User-Agent": _USER_AGENT},
-                timeout=aiohttp.ClientTimeout(total=10),
-            ) as response:
-                response.raise_for_status()
-                html_content = await response.text()
-                markdown_content = html2text.html2text(html_content)
-
-                # Truncate to first 3000 chars to reduce context bloat
-                # Full web articles can be 50KB+, we only need key info
-                MAX_CONTENT_LENGTH = 3000
-                if len(markdown_content) > MAX_CONTENT_LENGTH:
-                    markdown_content = markdown_content[:MAX_CONTENT_LENGTH] + "\n\n[... content truncated for brevity ...]"
-
-                _RESOURCE_CACHE[url] = markdown_content
-                return markdown_content
+        with track("download", "page"):
+            html_content = await through_cassette("download", "page", {"url": url}, lambda: _fetch_html(url))
+        # html2text takes tens of milliseconds on a typical article
+        markdown_content = await run_cpu(_to_markdown, html_content, size=len(html_content))
+
+        await _RESOURCE_CACHE.set(_resource_key(url), markdown_content)
+        return markdown_content
     except Exception as e:  # pylint: disable=broad-except
-        _RESOURCE_CACHE[url] = "ERROR"
+        await _RESOURCE_CACHE.set(_resource_key(url), "ERROR")
         return f"Error downloading resource: {e}"
 
 
+@with_state_emitter
 async def download_node(state: AgentState, config: RunnableConfig):
     """
     Download resources from the internet.
@@ -62,14 +106,14 @@ async def download_node(state: AgentState, config: RunnableConfig):
 
     # Find resources that are not downloaded
     for resource in state["resources"]:
-        if not get_resource(resource["url"]):
+        if not await get_resource(resource["url"]):
             resources_to_download.append(resource)
             state["logs"].append(
                 {"message": f"Downloading {resource['url']}", "done": False}
             )
 
     # Emit the state to let the UI update
-    await copilotkit_emit_state(config, state)
+    emit_state(config, state)
 
     # Download the resources
     for i, resource in enumerate(resources_to_download):
@@ -77,6 +121,6 @@ async def download_node(state: AgentState, config: RunnableConfig):
         state["logs"][logs_offset + i]["done"] = True
 
         # update UI
-        await copilotkit_emit_state(config, state)
+        emit_state(config, state)
 
     return state
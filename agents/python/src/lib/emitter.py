@@ -0,0 +1,140 @@
+"""
+State Emitter
+
+Coalescing replacement for awaiting copilotkit_emit_state after every log
+update. Nodes call emit_state(config, state), which returns immediately; the
+latest state is sent in the background at most once per coalescing window,
+and whatever is pending is always flushed before the node returns.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from copilotkit.langgraph import copilotkit_emit_state
+from langchain_core.runnables import RunnableConfig
+
+from src.lib.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+# Updates arriving within this window are merged into one emission
+EMIT_COALESCE_MS = float(os.getenv("EMIT_COALESCE_MS", "75"))
+# Serialized size is measured on one emission in this many (serializing the
+# whole state on every emission costs more than the emission saves)
+EMIT_SIZE_SAMPLE_EVERY = max(1, int(os.getenv("EMIT_SIZE_SAMPLE_EVERY", "20")))
+
+_emit_stats = {"requested": 0, "sent": 0, "errors": 0, "size_samples": 0, "sampled_bytes": 0}
+_current_emitter: contextvars.ContextVar[Optional["StateEmitter"]] = contextvars.ContextVar(
+    "state_emitter", default=None
+)
+
+
+def _state_size(state: Dict[str, Any]) -> int:
+    try:
+        return len(json.dumps(state, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class StateEmitter:
+    """
+    Sends the most recent state for one node run, coalescing bursts of updates.
+
+    The state dict is held by reference, so an emission always carries the
+    latest values even if the node mutated it after calling ``emit``.
+    """
+
+    def __init__(self, config: RunnableConfig, window_seconds: float = EMIT_COALESCE_MS / 1000):
+        self.config = config
+        self.window_seconds = window_seconds
+        self._pending: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_now = asyncio.Event()
+
+    def emit(self, config: RunnableConfig, state: Dict[str, Any]) -> None:
+        """Schedule ``state`` to be emitted; returns without waiting."""
+        _emit_stats["requested"] += 1
+        self.config = config
+        self._pending = state
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._emit_after_window())
+
+    async def _emit_after_window(self) -> None:
+        # Updates made while a send is in flight start the next window, so
+        # they go out without waiting for another emit or the node's flush
+        while self._pending is not None:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.window_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self._send()
+
+    async def _send(self) -> None:
+        state, self._pending = self._pending, None
+        if state is None:
+            return
+        try:
+            await copilotkit_emit_state(self.config, state)
+            _emit_stats["sent"] += 1
+            if (_emit_stats["sent"] - 1) % EMIT_SIZE_SAMPLE_EVERY == 0:
+                _emit_stats["size_samples"] += 1
+                _emit_stats["sampled_bytes"] += _state_size(state)
+        except Exception as e:  # pylint: disable=broad-except
+            _emit_stats["errors"] += 1
+            logger.warning(f"State emission failed: {e}")
+
+    async def flush(self) -> None:
+        """Emit any pending state now and wait until it has been sent."""
+        if self._task is not None and not self._task.done():
+            self._flush_now.set()
+            await self._task
+            self._flush_now.clear()
+        await self._send()
+
+
+def emit_state(config: RunnableConfig, state: Dict[str, Any]) -> None:
+    """
+    Emit intermediate state to the UI without blocking the node.
+
+    Uses the emitter of the node currently running (see with_state_emitter);
+    outside a node the state is emitted in a background task.
+    """
+    emitter = _current_emitter.get()
+    if emitter is None:
+        emitter = StateEmitter(config, window_seconds=0)
+    emitter.emit(config, state)
+
+
+def with_state_emitter(node: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Give a graph node its own coalescing emitter, flushed when the node exits."""
+
+    @functools.wraps(node)
+    async def wrapper(state, config: RunnableConfig):
+        emitter = StateEmitter(config)
+        token = _current_emitter.set(emitter)
+        try:
+            return await node(state, config)
+        finally:
+            _current_emitter.reset(token)
+            await emitter.flush()
+
+    return wrapper
+
+
+def get_emit_stats() -> Dict[str, Any]:
+    """Emission requests vs. emissions actually sent, and bytes sent (estimated from samples)."""
+    stats: Dict[str, Any] = dict(_emit_stats)
+    stats["coalesced"] = stats["requested"] - stats["sent"] - stats["errors"]
+    samples = stats.pop("size_samples")
+    sampled_bytes = stats.pop("sampled_bytes")
+    stats["avg_bytes"] = sampled_bytes // samples if samples else 0
+    stats["bytes"] = stats["avg_bytes"] * stats["sent"]
+    return stats
+
+
+register_stats("emit", get_emit_stats)
@@ -0,0 +1,349 @@
+"""
+Entity Index
+
+Local index of the entity, metric, cohort and time-period names Tako's
+knowledge graph knows about, grown from explore_knowledge_graph results. It
+answers two questions without a graph-explore round trip:
+
+- which known names a research question mentions, and what was discovered
+  alongside them: the KNOWLEDGE BASE CONTEXT block of the chat prompt
+  (``explore_context``, see index_context())
+- how a data question should spell them: canonicalize() rewrites mentions to
+  the knowledge graph's own names ("china gdp" -> "China GDP"), so searches
+  use exact names and paraphrases converge
+
+Names are kept in a token trie; a question is matched by walking it from each
+token (longest match wins), which takes microseconds. For the context block,
+misspelled tokens ("chna") are corrected against the index vocabulary through
+a trigram index before the walk. canonicalize() only rewrites exact
+(case-insensitive) matches: a real name the index has not learned yet
+("Austria") must not become a known one that is spelled alike ("Australia").
+
+The first time a research question is seen, ensure_explored() runs
+explore_knowledge_graph in the background at prefetch priority and learns the
+result, so it never delays the turn; by the next chat pass (or turn) the
+names are in the index. Set ENTITY_INDEX_PATH to persist the index across
+restarts.
+"""
+
+import asyncio
+import difflib
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.lib.admission import Priority, priority
+from src.lib.mcp_integration import TAKO_API_TOKEN, explore_knowledge_graph, format_knowledge_graph_results
+from src.lib.metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+ENTITY_INDEX_EXPLORE = os.getenv("ENTITY_INDEX_EXPLORE", "true").lower() == "true"
+ENTITY_INDEX_PATH = os.getenv("ENTITY_INDEX_PATH") or None
+ENTITY_INDEX_MAX_NAMES = int(os.getenv("ENTITY_INDEX_MAX_NAMES", "20000"))
+# Minimum difflib ratio for correcting a misspelled token to a known one
+ENTITY_FUZZY_MIN_RATIO = float(os.getenv("ENTITY_FUZZY_MIN_RATIO", "0.85"))
+
+# explore_knowledge_graph result keys and the kind each holds
+KINDS = {"entities": "entity", "metrics": "metric", "cohorts": "cohort", "time_periods": "time_period"}
+# Names remembered as discovered alongside each name
+_MAX_RELATED = 24
+_MAX_PHRASE_TOKENS = 8
+_END = ""  # trie key marking the end of a name (never a token)
+
+_TOKEN_RE = re.compile(r"[\w$%.'-]+")
+
+
+def _normalize(name: str) -> Tuple[str, ...]:
+    return tuple(token.strip(".'-").lower() for token in _TOKEN_RE.findall(name) if token.strip(".'-"))
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class EntityIndex:
+    """Token trie of knowledge-graph names with fuzzy token correction."""
+
+    def __init__(self, max_names: int = ENTITY_INDEX_MAX_NAMES, path: Optional[str] = None):
+        self.max_names = max_names
+        self.path = path
+        # normalized name -> {"name", "kind", "related": [normalized names]};
+        # ordered by last use for eviction
+        self._names: "OrderedDict[Tuple[str, ...], Dict[str, Any]]" = OrderedDict()
+        self._trie: Dict[str, Any] = {}
+        self._vocabulary: Set[str] = set()
+        self._trigram_index: Dict[str, Set[str]] = {}
+        self._corrections: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matches": 0, "corrections": 0, "learned": 0, "evictions": 0}
+        if path:
+            self._load()
+
+    # Building
+
+    def learn(self, data: Dict[str, Any]) -> int:
+        """Add the names of an explore_knowledge_graph result; returns how many were new."""
+        found: List[Tuple[Tuple[str, ...], str, str]] = []
+        for key, kind in KINDS.items():
+            for item in data.get(key) or []:
+                name = item.get("name", "") if isinstance(item, dict) else str(item)
+                normalized = _normalize(name)
+                if normalized and len(normalized) <= _MAX_PHRASE_TOKENS:
+                    found.append((normalized, name.strip(), kind))
+        if not found:
+            return 0
+
+        group = [normalized for normalized, _, _ in found]
+        added = 0
+        with self._lock:
+            for normalized, name, kind in found:
+                entry = self._names.get(normalized)
+                if entry is None:
+                    entry = self._names[normalized] = {"name": name, "kind": kind, "related": []}
+                    self._insert(normalized)
+                    added += 1
+                self._names.move_to_end(normalized)
+                related = [n for n in group if n != normalized and n not in entry["related"]]
+                entry["related"] = (related + entry["related"])[:_MAX_RELATED]
+            self._stats["learned"] += added
+            if len(self._names) > self.max_names:
+                self._evict()
+        if added and self.path:
+            self._save()
+        return added
+
+    def _insert(self, normalized: Tuple[str, ...]) -> None:
+        node = self._trie
+        for token in normalized:
+            node = node.setdefault(token, {})
+            if token not in self._vocabulary:
+                self._vocabulary.add(token)
+                for trigram in _trigrams(token):
+                    self._trigram_index.setdefault(trigram, set()).add(token)
+        node[_END] = normalized
+        self._corrections.clear()
+
+    def _evict(self) -> None:
+        # Drop the least recently used tenth and rebuild the lookup structures
+        for _ in range(len(self._names) - int(self.max_names * 0.9)):
+            self._names.popitem(last=False)
+            self._stats["evictions"] += 1
+        self._trie, self._vocabulary, self._trigram_index = {}, set(), {}
+        for normalized in self._names:
+            self._insert(normalized)
+
+    # Lookup
+
+    def _correct(self, token: str) -> Optional[str]:
+        """The known token a misspelled one most likely stands for, if any."""
+        if token in self._corrections:
+            return self._corrections[token]
+        best = None
+        if len(token) >= 4 and not token.isdigit():
+            shared = Counter(
+                candidate
+                for trigram in _trigrams(token)
+                for candidate in self._trigram_index.get(trigram, ())
+                if abs(len(candidate) - len(token)) <= 2
+            )
+            best_ratio = ENTITY_FUZZY_MIN_RATIO
+            for candidate, _ in shared.most_common(5):
+                # Inflections ("rate" / "rates") are different words, not typos
+                if candidate.startswith(token) or token.startswith(candidate):
+                    continue
+                ratio = difflib.SequenceMatcher(None, token, candidate).ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = candidate, ratio
+        if len(self._corrections) > 10000:
+            self._corrections.clear()
+        self._corrections[token] = best
+        return best
+
+    def match(self, text: str, fuzzy: bool = True) -> List[Tuple[int, int, Dict[str, Any]]]:
+        """
+        Known names mentioned in ``text``: (start, end) character spans and their entries.
+
+        With ``fuzzy``, unknown tokens are first corrected to the known token
+        they most likely misspell; without it, only exact matches count.
+        """
+        spans = []
+        for m in _TOKEN_RE.finditer(text):
+            # The span of the token without surrounding punctuation, so a
+            # replacement keeps the sentence's own ("china gdp." -> "China GDP.")
+            raw = m.group()
+            token = raw.strip(".'-")
+            if token:
+                start = m.start() + len(raw) - len(raw.lstrip(".'-"))
+                spans.append((start, start + len(token), token.lower()))
+        with self._lock:
+            self._stats["lookups"] += 1
+            tokens = []
+            for _, _, token in spans:
+                if fuzzy and token not in self._vocabulary:
+                    corrected = self._correct(token)
+                    if corrected is not None:
+                        self._stats["corrections"] += 1
+                        token = corrected
+                tokens.append(token)
+
+            matches = []
+            i = 0
+            while i < len(tokens):
+                node, j, best = self._trie, i, None
+                while j < len(tokens) and tokens[j] in node:
+                    node = node[tokens[j]]
+                    j += 1
+                    if _END in node:
+                        best = (j, node[_END])
+                if best is None:
+                    i += 1
+                    continue
+                end, normalized = best
+                matches.append((spans[i][0], spans[end - 1][1], self._names[normalized]))
+                self._names.move_to_end(normalized)
+                i = end
+            self._stats["matches"] += len(matches)
+        return matches
+
+    def canonicalize(self, text: str) -> str:
+        """``text`` with every known name spelled the way the knowledge graph spells it."""
+        # Exact matches only: this rewrites what is searched for
+        matches = self.match(text, fuzzy=False)
+        if not matches:
+            return text
+        parts = []
+        position = 0
+        for start, end, entry in matches:
+            parts.append(text[position:start])
+            # The span excludes surrounding punctuation; so does the name
+            parts.append(entry["name"].strip(".'-"))
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
+
+    def context_for(self, text: str, limit: int = 10) -> str:
+        """KNOWLEDGE BASE CONTEXT for ``text``: the names it mentions, then those found with them."""
+        matches = self.match(text)
+        if not matches:
+            return ""
+        data: Dict[str, List[Any]] = {key: [] for key in KINDS}
+        seen: Set[str] = set()
+        keys = {kind: key for key, kind in KINDS.items()}
+
+        def add(entry: Dict[str, Any]) -> None:
+            if entry["name"] in seen:
+                return
+            seen.add(entry["name"])
+            key = keys[entry["kind"]]
+            data[key].append(entry["name"] if key == "time_periods" else {"name": entry["name"]})
+
+        with self._lock:
+            for _, _, entry in matches:
+                add(entry)
+            for _, _, entry in matches:
+                for normalized in entry["related"]:
+                    if len(seen) >= limit:
+                        break
+                    related = self._names.get(normalized)
+                    if related is not None:
+                        add(related)
+        return format_knowledge_graph_results(data)
+
+    # Persistence
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Entity index: could not read {self.path}: {e}")
+            return
+        with self._lock:
+            for item in saved:
+                normalized = tuple(item["normalized"])
+                self._names[normalized] = {
+                    "name": item["name"],
+                    "kind": item["kind"],
+                    "related": [tuple(r) for r in item["related"]],
+                }
+                self._insert(normalized)
+
+    def _save(self) -> None:
+        with self._lock:
+            saved = [
+                {"normalized": list(normalized), "name": entry["name"], "kind": entry["kind"],
+                 "related": [list(r) for r in entry["related"]]}
+                for normalized, entry in self._names.items()
+            ]
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Entity index: could not write {self.path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "names": len(self._names), "tokens": len(self._vocabulary)}
+
+
+_index = EntityIndex(path=ENTITY_INDEX_PATH)
+
+# Research questions already explored (or being explored), and the running tasks
+_explored: "OrderedDict[Tuple[str, ...], None]" = OrderedDict()
+_explore_tasks: Set[asyncio.Task] = set()
+_explore_stats = {"explores": 0, "explore_errors": 0}
+
+
+def canonicalize(text: str) -> str:
+    """Spell the known entity/metric names in ``text`` the way the knowledge graph does."""
+    return _index.canonicalize(text)
+
+
+def index_context(text: str) -> str:
+    """Knowledge-base context block for ``text`` from the local index ("" if nothing is known)."""
+    return _index.context_for(text)
+
+
+async def _explore(query: str) -> None:
+    try:
+        data = await explore_knowledge_graph(query)
+        added = await asyncio.get_running_loop().run_in_executor(None, _index.learn, data)
+        logger.info(f"Entity index learned {added} names exploring '{query}'")
+    except Exception as e:  # pylint: disable=broad-except
+        _explore_stats["explore_errors"] += 1
+        logger.warning(f"Knowledge graph explore failed for '{query}': {e}")
+
+
+def ensure_explored(query: str) -> None:
+    """Explore ``query`` in the background once, to grow the index for later lookups."""
+    normalized = _normalize(query)
+    if not ENTITY_INDEX_EXPLORE or not TAKO_API_TOKEN or not normalized or normalized in _explored:
+        return
+    _explored[normalized] = None
+    if len(_explored) > 5000:
+        _explored.popitem(last=False)
+    _explore_stats["explores"] += 1
+    # Speculative work: shed first when MCP is busy
+    with priority(Priority.PREFETCH):
+        task = asyncio.ensure_future(_explore(query))
+    _explore_tasks.add(task)
+    task.add_done_callback(_explore_tasks.discard)
+
+
+def get_entity_index_stats() -> Dict[str, Any]:
+    """Names and tokens indexed, lookups, matches, fuzzy corrections and background explores."""
+    return {**_index.stats(), **_explore_stats}
+
+
+register_stats("entity_index", get_entity_index_stats)
@@ -0,0 +1,179 @@
+"""
+Conversation History Compaction
+
+Keeps the message history sent to the model bounded on long research threads.
+The last few turns are sent verbatim; older turns are folded into a rolling
+summary that is stored in the agent state and only recomputed once enough new
+turns have aged out. Large tool-call payloads in older turns (for example the
+full report passed to WriteReport) are replaced by short references.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Tuple
+
+from copilotkit.langgraph import copilotkit_customize_config
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langchain_core.runnables import RunnableConfig
+
+from src.lib.admission import admit
+from src.lib.rate_limit import call_with_retries
+from src.lib.state import AgentState
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent turns (a user message and everything after it) kept verbatim
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+# Re-summarize only once this many turns have aged out since the last summary
+HISTORY_SUMMARY_BATCH_TURNS = int(os.getenv("HISTORY_SUMMARY_BATCH_TURNS", "3"))
+# Tool-call arguments / tool results longer than this are replaced by a reference
+HISTORY_MAX_PAYLOAD_CHARS = int(os.getenv("HISTORY_MAX_PAYLOAD_CHARS", "400"))
+
+
+def split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+    """
+    Group messages into turns, each starting at a HumanMessage.
+
+    Tool calls and their ToolMessages always stay in the same turn, so
+    dropping whole turns never leaves an unanswered tool call behind.
+    """
+    turns: List[List[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _payload_reference(name: str, key: str, value: Any) -> Any:
+    if isinstance(value, str) and len(value) > HISTORY_MAX_PAYLOAD_CHARS:
+        return f"[{name} {key}: {len(value)} chars omitted]"
+    if isinstance(value, (list, dict)):
+        serialized = json.dumps(value, default=str)
+        if len(serialized) > HISTORY_MAX_PAYLOAD_CHARS:
+            return f"[{name} {key}: {len(value)} items omitted]"
+    return value
+
+
+def shrink_payloads(message: BaseMessage) -> BaseMessage:
+    """Copy of ``message`` with large tool-call arguments and results replaced by references."""
+    if isinstance(message, AIMessage) and message.tool_calls:
+        tool_calls = [
+            {
+                **call,
+                "args": {
+                    key: _payload_reference(call["name"], key, value)
+                    for key, value in call["args"].items()
+                },
+            }
+            for call in message.tool_calls
+        ]
+        # Drop the raw provider payload so the shrunk tool_calls are what gets sent
+        additional_kwargs = {
+            k: v
+            for k, v in message.additional_kwargs.items()
+            if k not in ("tool_calls", "function_call")
+        }
+        return message.model_copy(
+            update={"tool_calls": tool_calls, "additional_kwargs": additional_kwargs}
+        )
+    if (
+        isinstance(message, ToolMessage)
+        and isinstance(message.content, str)
+        and len(message.content) > HISTORY_MAX_PAYLOAD_CHARS
+    ):
+        content = message.content[:HISTORY_MAX_PAYLOAD_CHARS]
+        return message.model_copy(
+            update={"content": f"{content} [... {len(message.content)} chars total]"}
+        )
+    return message
+
+
+def _render_for_summary(messages: List[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        message = shrink_payloads(message)
+        if isinstance(message, AIMessage) and message.tool_calls:
+            for call in message.tool_calls:
+                lines.append(f"assistant called {call['name']}({json.dumps(call['args'], default=str)})")
+            if message.content:
+                lines.append(f"assistant: {message.content}")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"tool result: {message.content}")
+        else:
+            lines.append(f"{message.type}: {message.content}")
+    return "\n".join(lines)
+
+
+async def _summarize(
+    model: BaseChatModel, summary: str, messages: List[BaseMessage], config: RunnableConfig
+) -> str:
+    prompt = [
+        SystemMessage(content="""You maintain a running summary of a research conversation.
+Update the existing summary with the new messages. Keep the user's goals, requests,
+decisions, the research questions explored and which searches/tools were used.
+Do not include report text. Be concise: at most 200 words."""),
+        HumanMessage(
+            content=f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{_render_for_summary(messages)}"
+        ),
+    ]
+    # Keep the summary call out of the UI's message stream
+    summary_config = copilotkit_customize_config(config, emit_messages=False, emit_tool_calls=False)
+
+    async def summarize():
+        async with admit("llm"):
+            return await model.ainvoke(prompt, summary_config)
+
+    response = await call_with_retries("llm", summarize)
+    return response.content if isinstance(response.content, str) else str(response.content)
+
+
+async def compact_history(
+    state: AgentState, model: BaseChatModel, config: RunnableConfig
+) -> Tuple[List[BaseMessage], str, Dict[str, Any]]:
+    """
+    Compact ``state["messages"]`` for an LLM call.
+
+    Returns:
+        (messages to send, summary of earlier turns to add to the system
+        prompt, state updates to persist the refreshed summary)
+    """
+    messages = state.get("messages", [])
+    turns = split_turns(messages)
+    if len(turns) <= HISTORY_KEEP_TURNS:
+        return list(messages), "", {}
+
+    old_turns = turns[:-HISTORY_KEEP_TURNS]
+    recent_turns = turns[-HISTORY_KEEP_TURNS:]
+    summary = state.get("history_summary", "")
+    summarized = min(state.get("history_summary_turns", 0), len(old_turns))
+    updates: Dict[str, Any] = {}
+
+    pending = old_turns[summarized:]
+    if len(pending) >= HISTORY_SUMMARY_BATCH_TURNS:
+        pending_messages = [m for turn in pending for m in turn]
+        try:
+            summary = await _summarize(model, summary, pending_messages, config)
+            summarized = len(old_turns)
+            updates = {"history_summary": summary, "history_summary_turns": summarized}
+            logger.info(f"Summarized {len(pending)} older turns ({len(pending_messages)} messages)")
+        except Exception as e:  # pylint: disable=broad-except
+            # Fall back to sending the unsummarized turns with shrunk payloads
+            logger.warning(f"History summarization failed: {e}")
+
+    # Turns that aged out since the last summary are sent with shrunk payloads
+    compacted = [shrink_payloads(m) for turn in old_turns[summarized:] for m in turn]
+    compacted += [m for turn in recent_turns for m in turn]
+    logger.info(
+        f"History compacted: {len(messages)} -> {len(compacted)} messages "
+        f"({summarized} turns summarized)"
+    )
+    return compacted, summary, updates
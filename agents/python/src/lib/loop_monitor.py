@@ -0,0 +1,222 @@
+"""
+Loop Monitor
+
+All sessions on a worker share one event loop, so a CPU-heavy step in one
+turn (converting a downloaded page, sanitizing a long report, parsing a large
+MCP payload) delays every other session's streaming for as long as it runs.
+
+The watchdog measures that delay continuously: a heartbeat task records how
+late the loop wakes it (``agent_event_loop_lag_seconds``), and a daemon
+thread checks the heartbeat. When the loop has been blocked longer than
+LOOP_STALL_THRESHOLD_MS, the thread samples the loop thread's stack and the
+running task, so the stall is logged and counted
+(``agent_event_loop_stalls_total``) against the code that caused it rather
+than the sessions that suffered it.
+
+run_cpu() moves the known heavy steps to a shared thread pool. Pure Python
+still holds the GIL there, but the interpreter switches threads every few
+milliseconds (sys.getswitchinterval), so the loop keeps serving other
+sessions while the work runs instead of stalling for its whole duration.
+Inputs smaller than CPU_OFFLOAD_MIN_CHARS run inline, where a thread hop
+would cost more than it saves.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from src.lib.metrics import counter, histogram, register_stats
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+# Heartbeat period, and the blocked time after which the loop counts as stalled
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "50"))
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "100"))
+CPU_EXECUTOR_WORKERS = int(os.getenv("CPU_EXECUTOR_WORKERS", str(min(4, os.cpu_count() or 1))))
+CPU_OFFLOAD_MIN_CHARS = int(os.getenv("CPU_OFFLOAD_MIN_CHARS", "20000"))
+
+LOOP_LAG = histogram(
+    "agent_event_loop_lag_seconds",
+    "How late the event loop ran a heartbeat scheduled every LOOP_MONITOR_INTERVAL_MS.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = counter(
+    "agent_event_loop_stalls_total",
+    "Event loop blocks longer than LOOP_STALL_THRESHOLD_MS, by the code running at the time.",
+    ("location",),
+)
+
+_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+T = TypeVar("T")
+
+
+def _describe_stack(frame) -> tuple:
+    """
+    The innermost frame in this repository's code (where the blocking call
+    was made) and a short stack excerpt for the log.
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    location = None
+    for f in frames:
+        if f.f_code.co_filename.startswith(_SRC_DIR):
+            location = f"{os.path.relpath(f.f_code.co_filename, os.path.dirname(_SRC_DIR))}:{f.f_code.co_qualname}"
+            break
+    if location is None and frames:
+        location = f"{os.path.basename(frames[0].f_code.co_filename)}:{frames[0].f_code.co_qualname}"
+    excerpt = " <- ".join(
+        f"{f.f_code.co_qualname} ({os.path.basename(f.f_code.co_filename)}:{f.f_lineno})" for f in frames[:6]
+    )
+    return location or "unknown", excerpt
+
+
+class LoopMonitor:
+    """Heartbeat task on the loop plus a watchdog thread that attributes stalls."""
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._beat = time.monotonic()
+        # Written by the watchdog thread while the loop is blocked, read by
+        # the heartbeat once it runs again
+        self._culprit: Optional[Dict[str, str]] = None
+        self._stats = {"stalls": 0, "max_lag_ms": 0.0, "last_stall_ms": 0.0}
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat(), name="loop-monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(now - expected, 0.0)
+            LOOP_LAG.observe(lag)
+            self._stats["max_lag_ms"] = max(self._stats["max_lag_ms"], lag * 1000)
+            culprit, self._culprit = self._culprit, None
+            if culprit is not None:
+                self._report(lag, culprit)
+
+    def _report(self, lag: float, culprit: Dict[str, str]) -> None:
+        self._stats["stalls"] += 1
+        self._stats["last_stall_ms"] = lag * 1000
+        LOOP_STALLS.inc(location=culprit["location"])
+        logger.warning(
+            "Event loop blocked for %.0f ms by %s in task %s (%s): %s",
+            lag * 1000, culprit["location"], culprit["task"], culprit["coroutine"], culprit["stack"],
+        )
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            # The next heartbeat is due one interval after the last one
+            if beat == reported_beat or time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            # First sample of this stall: what is the loop thread running?
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            location, stack = _describe_stack(frame)
+            task = asyncio.current_task(self._loop)
+            self._culprit = {
+                "location": location,
+                "stack": stack,
+                "task": task.get_name() if task else "-",
+                "coroutine": getattr(task.get_coro(), "__qualname__", "-") if task else "-",
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, running=int(self._task is not None))
+
+
+_monitor = LoopMonitor(LOOP_MONITOR_INTERVAL_MS / 1000, LOOP_STALL_THRESHOLD_MS / 1000)
+
+
+def start_loop_monitor() -> None:
+    """Start watching the running event loop (called from the server lifespan)."""
+    if LOOP_MONITOR_ENABLED:
+        _monitor.start()
+
+
+def stop_loop_monitor() -> None:
+    _monitor.stop()
+
+
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_cpu_stats = {"offloaded": 0, "inline": 0, "offloaded_seconds": 0.0}
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=CPU_EXECUTOR_WORKERS, thread_name_prefix="cpu-work"
+                )
+    return _executor
+
+
+def _timed(func: Callable[..., T], *args: Any) -> T:
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        _cpu_stats["offloaded_seconds"] += time.perf_counter() - started
+
+
+async def run_cpu(func: Callable[..., T], *args: Any, size: Optional[int] = None) -> T:
+    """
+    Run CPU-heavy ``func(*args)`` in the shared CPU executor.
+
+    ``size`` is the size of the input (e.g. characters of text); when given
+    and below CPU_OFFLOAD_MIN_CHARS, the call runs inline instead.
+    """
+    if size is not None and size < CPU_OFFLOAD_MIN_CHARS:
+        _cpu_stats["inline"] += 1
+        return func(*args)
+    _cpu_stats["offloaded"] += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(_timed, func, *args))
+
+
+def get_loop_monitor_stats() -> Dict[str, Any]:
+    """Stalls seen, worst heartbeat lag, and calls run in / kept out of the CPU executor."""
+    return {**_monitor.stats(), "cpu": dict(_cpu_stats)}
+
+
+register_stats("loop_monitor", get_loop_monitor_stats)
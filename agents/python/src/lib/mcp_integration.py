@@ -14,6 +14,12 @@ from typing import Any, Dict, List, Optional
 
 import httpx
 
+from src.lib.admission import admit
+from src.lib.cassette import through_cassette
+from src.lib.loop_monitor import run_cpu
+from src.lib.metrics import counter, track
+from src.lib.rate_limit import call_with_retries
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,11 @@ logger = logging.getLogger(__name__)
 DATA_SOURCE_URL = os.getenv("TAKO_URL", "https://tako.com").rstrip("/")
 MCP_SERVER_URL = os.getenv("TAKO_MCP_URL", "https://mcp.tako.com").rstrip("/")
 TAKO_API_TOKEN = os.getenv("TAKO_API_TOKEN", "")
+# Time allowed for the SSE stream to deliver a session id
+MCP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MCP_CONNECT_TIMEOUT_SECONDS", "5"))
+
+
+MCP_RECONNECTS = counter("agent_mcp_reconnects_total", "MCP session reconnects after expiry.")
 
 
 class SessionExpiredException(Exception):
@@ -28,6 +39,15 @@ class SessionExpiredException(Exception):
     pass
 
 
+class MCPHTTPError(RuntimeError):
+    """Error status from the MCP server; keeps the status and headers (e.g. Retry-After)."""
+
+    def __init__(self, message: str, status_code: int, headers: Any = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers
+
+
 class SimpleMCPClient:
     """
     Minimal MCP client following the Model Context Protocol specification.
@@ -43,19 +63,24 @@ class SimpleMCPClient:
         self._responses = {}
         self._client = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0))
         self._sse_task = None
+        self._session_ready = asyncio.Event()
 
-    async def connect(self):
+    async def connect(self, timeout: float = MCP_CONNECT_TIMEOUT_SECONDS):
         """Connect to MCP server and get session ID via SSE."""
         logger.info(f"Connecting to MCP server: {self.base_url}/sse")
+        self._session_ready.clear()
         self._sse_task = asyncio.create_task(self._sse_reader())
 
-        # Wait for session_id to be established
-        for _ in range(50):
-            if self.session_id:
-                await asyncio.sleep(0.2)
-                logger.info(f"Connected to MCP server (session: {self.session_id[:8]}...)")
-                return True
-            await asyncio.sleep(0.1)
+        # Wait until the endpoint event delivers a session id, or the stream ends
+        ready = asyncio.create_task(self._session_ready.wait())
+        try:
+            await asyncio.wait({ready, self._sse_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            ready.cancel()
+
+        if self.session_id:
+            logger.info(f"Connected to MCP server (session: {self.session_id[:8]}...)")
+            return True
 
         logger.error("Failed to connect to MCP server (timeout)")
         return False
@@ -80,9 +105,10 @@ class SimpleMCPClient:
                         data = line[5:].strip()
                         if event_type == "endpoint" and "session_id=" in data:
                             self.session_id = data.split("session_id=")[1].split("&")[0]
+                            self._session_ready.set()
                         elif event_type == "message":
                             try:
-                                msg = json.loads(data)
+                                msg = await run_cpu(json.loads, data, size=len(data))
                                 msg_id = msg.get("id")
                                 if msg_id in self._responses:
                                     self._responses[msg_id].set_result(msg)
@@ -108,6 +134,7 @@ class SimpleMCPClient:
     async def reconnect(self):
         """Reconnect to MCP server with new session."""
         logger.info("Reconnecting to MCP server...")
+        MCP_RECONNECTS.inc()
 
         # Close existing connection
         if self._sse_task and not self._sse_task.done():
@@ -176,8 +203,8 @@ class SimpleMCPClient:
                             "Session expired or not found. Reconnection failed."
                         )
 
-                raise RuntimeError(
-                    f"HTTP {resp.status_code} from server: {error_msg}"
+                raise MCPHTTPError(
+                    f"HTTP {resp.status_code} from server: {error_msg}", resp.status_code, resp.headers
                 )
         except httpx.HTTPStatusError as e:
             self._responses.pop(msg_id, None)
@@ -188,7 +215,9 @@ class SimpleMCPClient:
                 return await self._send(method, params, _retry=False)
             elif is_session_error:
                 raise SessionExpiredException("Session expired. Reconnection failed.")
-            raise RuntimeError(f"HTTP error {e.response.status_code}: {e.response.text}")
+            raise MCPHTTPError(
+                f"HTTP error {e.response.status_code}: {e.response.text}", e.response.status_code, e.response.headers
+            )
 
         try:
             return await asyncio.wait_for(future, timeout=120.0)
@@ -213,19 +242,50 @@ class SimpleMCPClient:
 
 # Global MCP client instance (reused across calls)
 _mcp_client: Optional[SimpleMCPClient] = None
+_mcp_client_lock: Optional[asyncio.Lock] = None
 
 
 async def _get_mcp_client() -> SimpleMCPClient:
     """Get or create MCP client with proper session."""
+    global _mcp_client, _mcp_client_lock
+
+    if _mcp_client is not None and _mcp_client.session_id is not None:
+        return _mcp_client
+
+    if _mcp_client_lock is None:
+        _mcp_client_lock = asyncio.Lock()
+    # Concurrent first calls (e.g. parallel searches) share one connection
+    async with _mcp_client_lock:
+        if _mcp_client is None or _mcp_client.session_id is None:
+            if _mcp_client is not None:
+                await _mcp_client.close()
+            client = SimpleMCPClient(MCP_SERVER_URL)
+            with track("mcp", "connect"):
+                if not await client.connect():
+                    await client.close()
+                    raise RuntimeError(f"Failed to connect to MCP server {MCP_SERVER_URL}")
+                await client.initialize()
+            _mcp_client = client
+
+    return _mcp_client
+
+
+async def warm_up_mcp_client() -> None:
+    """Connect and initialize the shared MCP session ahead of the first tool call."""
+    await _get_mcp_client()
+
+
+async def close_mcp_client() -> None:
+    """Close the shared MCP session."""
     global _mcp_client
+    if _mcp_client is not None:
+        await _mcp_client.close()
+        _mcp_client = None
 
-    if _mcp_client is None or _mcp_client.session_id is None:
-        _mcp_client = SimpleMCPClient(MCP_SERVER_URL)
-        if not await _mcp_client.connect():
-            raise RuntimeError(f"Failed to connect to MCP server {MCP_SERVER_URL}")
-        await _mcp_client.initialize()
 
-    return _mcp_client
+async def _send_tool_call(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    client = await _get_mcp_client()
+    return await client.call_tool(tool_name, arguments)
 
 
 async def _call_mcp_tool(tool_name: str, arguments: Dict[str, Any]) -> Any:
@@ -244,8 +304,16 @@ async def _call_mcp_tool(tool_name: str, arguments: Dict[str, Any]) -> Any:
     logger.info(f"Calling MCP tool: {tool_name}")
 
     try:
-        client = await _get_mcp_client()
-        result = await client.call_tool(tool_name, arguments)
+        async def attempt():
+            async with admit("mcp"):
+                with track("mcp", tool_name):
+                    return await through_cassette(
+                        "mcp", tool_name, arguments, lambda: _send_tool_call(tool_name, arguments)
+                    )
+
+        # Throttling and transient failures are retried; anything else, or a
+        # call that runs out of retries, still degrades to None below
+        result = await call_with_retries("mcp", attempt)
 
         logger.info(f"MCP tool call succeeded: {tool_name}")
 
@@ -258,7 +326,7 @@ async def _call_mcp_tool(tool_name: str, arguments: Dict[str, Any]) -> Any:
                     text = first_content["text"]
                     if text and text.strip():
                         try:
-                            return json.loads(text)
+                            return await run_cpu(json.loads, text, size=len(text))
                         except json.JSONDecodeError:
                             return text
                 return first_content
@@ -0,0 +1,333 @@
+"""
+Metrics
+
+Minimal in-process metrics (counters, gauges, histograms) rendered in the
+Prometheus text exposition format by the /metrics endpoint, without a client
+library or external service. Recording is a dict lookup and an addition under
+a lock (about a microsecond), negligible next to the calls being measured.
+
+Graph nodes are timed through instrument_node (see agent.py), outbound calls
+through track(); both also record a trace span (see tracing.py), and node
+timings are added to the run being profiled, if any (see profiling.py). The
+``get_*_stats()`` snapshots of the other modules are exported as gauges via
+register_stats(). In multi-worker mode each worker serves its own metrics.
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.lib.profiling import get_profiling_stats, note_node
+from src.lib.tracing import get_tracing_stats, span, thread_id_from_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Exposition lines of every labelled series."""
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, set directly or read from a callback at scrape time."""
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"Gauge {self.name} callback failed: {e}")
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Holds metrics and stats callbacks and renders them for /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._stats: List[Tuple[str, Callable[[], Dict[str, Any]], Optional[str]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def register_stats(self, prefix: str, function: Callable[[], Dict[str, Any]], label: Optional[str] = None) -> None:
+        with self._lock:
+            self._stats.append((prefix, function, label))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            stats = list(self._stats)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, function, label in stats:
+            lines.extend(_render_stats(prefix, function, label))
+        return "\n".join(lines) + "\n"
+
+
+def _numeric(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _flatten(prefix: str, values: Dict[str, Any]) -> Iterator[Tuple[str, float]]:
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif _numeric(value):
+            yield name, value
+
+
+def _render_stats(prefix: str, function: Callable[[], Dict[str, Any]], label: Optional[str]) -> List[str]:
+    try:
+        stats = function()
+    except Exception as e:  # pylint: disable=broad-except
+        logger.warning(f"Stats callback for {prefix} failed: {e}")
+        return []
+
+    samples: Dict[str, List[str]] = {}
+    if label:
+        # {label value: {stat: value}}
+        for label_value, values in stats.items():
+            labels = _format_labels((label,), (label_value,))
+            for name, value in _flatten(f"agent_{prefix}", values):
+                samples.setdefault(name, []).append(f"{name}{labels} {_format_value(value)}")
+    else:
+        for name, value in _flatten(f"agent_{prefix}", stats):
+            samples.setdefault(name, []).append(f"{name} {_format_value(value)}")
+
+    lines = []
+    for name, metric_samples in samples.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(metric_samples)
+    return lines
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    function: Optional[Callable[[], float]] = None,
+) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, function))
+
+
+def histogram(
+    name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def register_stats(prefix: str, function: Callable[[], Dict[str, Any]], label: Optional[str] = None) -> None:
+    """
+    Export a ``get_*_stats()`` snapshot as ``agent_<prefix>_<key>`` gauges.
+
+    Nested dicts are flattened into the name; with ``label``, the top-level
+    keys become values of that label instead (e.g. per model profile).
+    """
+    REGISTRY.register_stats(prefix, function, label)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+NODE_DURATION = histogram("agent_node_duration_seconds", "Graph node run time.", ("node",))
+NODE_ERRORS = counter("agent_node_errors_total", "Graph node runs that raised.", ("node",))
+DEPENDENCY_DURATION = histogram(
+    "agent_dependency_duration_seconds",
+    "Latency of calls to external dependencies.",
+    ("dependency", "operation"),
+)
+DEPENDENCY_ERRORS = counter(
+    "agent_dependency_errors_total", "Failed calls to external dependencies.", ("dependency", "operation")
+)
+register_stats("tracing", get_tracing_stats)
+register_stats("profiling", get_profiling_stats)
+
+
+@contextmanager
+def track(dependency: str, operation: str = "") -> Iterator[None]:
+    """Time an outbound call and count it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        with span(f"{dependency}.{operation}" if operation else dependency, kind="client"):
+            yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        DEPENDENCY_DURATION.observe(time.perf_counter() - started, dependency=dependency, operation=operation)
+
+
+def instrument_node(name: str, node: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Wrap a graph node to record its duration and failures."""
+
+    @functools.wraps(node)
+    async def wrapper(state, config):
+        started = time.perf_counter()
+        thread_id = thread_id_from_config(config)
+        try:
+            with span(name, kind="node", thread_id=thread_id):
+                return await node(state, config)
+        except Exception as e:
+            # Interrupts and other control-flow signals are not failures
+            if not type(e).__module__.startswith("langgraph."):
+                NODE_ERRORS.inc(node=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            NODE_DURATION.observe(elapsed, node=name)
+            note_node(name, thread_id, started, elapsed)
+
+    return wrapper
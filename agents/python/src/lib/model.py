@@ -1,49 +1,314 @@
 """
 This module provides a function to get a model based on the configuration.
+
+Each LLM step runs under a model profile ("reasoning" for the main chat,
+"selection" for resource extraction, "editing" for report editing and history
+summaries), and each profile can be routed to its own provider and model.
+Chat model clients are kept in a process-wide registry keyed by profile,
+provider and model, so every LLM call reuses the same client and its pooled,
+keep-alive connections. Provider SDKs are imported when their first client is
+built, so a deployment only pays the import cost of the providers it uses.
 """
 
+import logging
 import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
 
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_google_genai import ChatGoogleGenerativeAI
-
+from langchain_core.messages import AIMessage, BaseMessage, message_chunk_to_message
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import Runnable, RunnableConfig
 
+from src.lib.cassette import RECORDING, REPLAYING, cassette_chat_model
+from src.lib.metrics import DEPENDENCY_DURATION, DEPENDENCY_ERRORS, counter, register_stats
+from src.lib.rate_limit import stream_with_retries
+from src.lib.tracing import Span, start_span
 from src.lib.state import AgentState
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-def get_model(state: AgentState) -> BaseChatModel:
-    """
-    Get a model based on the environment variable.
-    """
+# Connection pool settings for model clients that accept a custom HTTP client
+MODEL_HTTP_MAX_CONNECTIONS = int(os.getenv("MODEL_HTTP_MAX_CONNECTIONS", "100"))
+MODEL_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("MODEL_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+MODEL_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("MODEL_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-sonnet-20240620",
+    "google_genai": "gemini-1.5-pro",
+}
+
+# Model profiles. Each can be routed with MODEL_PROFILE_<NAME>="provider:model",
+# e.g. MODEL_PROFILE_SELECTION="openai:gpt-4o-mini"; unset profiles use the
+# provider selected by MODEL / the state with its default model.
+MODEL_PROFILES = ("reasoning", "selection", "editing")
+
+_registry: Dict[Tuple[Any, ...], BaseChatModel] = {}
+_registry_lock = threading.Lock()
+_registry_stats = {"hits": 0, "misses": 0, "http_requests": 0}
+_http_clients: Dict[str, Any] = {}
+
+
+def _count_request(request: httpx.Request) -> None:
+    _registry_stats["http_requests"] += 1
+
+
+async def _acount_request(request: httpx.Request) -> None:
+    _registry_stats["http_requests"] += 1
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MODEL_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=MODEL_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=MODEL_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Shared pooled HTTP clients for providers that accept them (OpenAI)."""
+    if not _http_clients:
+        _http_clients["sync"] = httpx.Client(
+            limits=_http_limits(), event_hooks={"request": [_count_request]}
+        )
+        _http_clients["async"] = httpx.AsyncClient(
+            limits=_http_limits(), event_hooks={"request": [_acount_request]}
+        )
+    return _http_clients["sync"], _http_clients["async"]
+
+
+_step_stats: Dict[str, Dict[str, float]] = {}
+_step_stats_lock = threading.Lock()
+
+LLM_TOKENS = counter("agent_llm_tokens_total", "LLM tokens used per model profile.", ("profile", "direction"))
+
+
+class StepMetricsHandler(BaseCallbackHandler):
+    """Records latency, token usage and a trace span of every LLM call made under a profile."""
+
+    # Run on the caller's task so the span nests under the current node
+    run_inline = True
+
+    def __init__(self, profile: str):
+        self.profile = profile
+        self._started: Dict[UUID, float] = {}
+        self._spans: Dict[UUID, Span] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+        span = start_span("llm", kind="client", profile=self.profile)
+        if span is not None:
+            self._spans[run_id] = span
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        self._record(started, input_tokens=input_tokens, output_tokens=output_tokens)
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.attributes.update(input_tokens=input_tokens, output_tokens=output_tokens)
+            span.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._record(self._started.pop(run_id, None), errors=1)
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.error = f"{type(error).__name__}: {error}"
+            span.end()
+
+    def _record(self, started: Optional[float], **counts: float) -> None:
+        latency = time.perf_counter() - started if started is not None else 0.0
+        DEPENDENCY_DURATION.observe(latency, dependency="llm", operation=self.profile)
+        if counts.get("errors"):
+            DEPENDENCY_ERRORS.inc(dependency="llm", operation=self.profile)
+        for direction in ("input", "output"):
+            if counts.get(f"{direction}_tokens"):
+                LLM_TOKENS.inc(counts[f"{direction}_tokens"], profile=self.profile, direction=direction)
+        with _step_stats_lock:
+            stats = _step_stats.setdefault(
+                self.profile,
+                {"calls": 0, "errors": 0, "latency_seconds": 0.0, "input_tokens": 0, "output_tokens": 0},
+            )
+            stats["calls"] += 1
+            stats["latency_seconds"] += latency
+            for key, value in counts.items():
+                stats[key] += value
+
+
+def _resolve_profile(state: AgentState, profile: str) -> Tuple[str, str]:
+    """Provider and model name for a profile."""
+    if profile not in MODEL_PROFILES:
+        raise ValueError(f"Invalid model profile: {profile}")
+
+    routed = os.getenv(f"MODEL_PROFILE_{profile.upper()}")
+    if routed:
+        provider, _, model_name = routed.partition(":")
+    else:
+        state_model = state.get("model", "openai")
+        provider, model_name = os.getenv("MODEL", state_model), ""
+
+    if provider not in DEFAULT_MODELS:
+        raise ValueError("Invalid model specified")
+    return provider, model_name or DEFAULT_MODELS[provider]
+
+
+# Model class per provider; cassette models are named after it
+_PROVIDER_CLASSES = {
+    "openai": "ChatOpenAI",
+    "anthropic": "ChatAnthropic",
+    "google_genai": "ChatGoogleGenerativeAI",
+}
 
-    state_model = state.get("model", "openai")
-    model = os.getenv("MODEL", state_model)
 
-    if model == "openai":
+def _build_model(provider: str, model_name: str, profile: str) -> BaseChatModel:
+    callbacks = [StepMetricsHandler(profile)]
+    if REPLAYING:
+        # Served from the cassette: no provider SDK, API key or connection needed
+        return cassette_chat_model(_PROVIDER_CLASSES[provider], profile, None, callbacks)
+    model = _build_provider_model(provider, model_name, callbacks)
+    if RECORDING:
+        return cassette_chat_model(type(model).__name__, profile, model, callbacks)
+    return model
+
+
+def _build_provider_model(provider: str, model_name: str, callbacks: list) -> BaseChatModel:
+    # SDK retries are off: rate_limit.call_with_retries retries LLM calls
+    # against the shared token bucket instead
+    if provider == "openai":
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
-        return ChatOpenAI(temperature=0, model="gpt-4o-mini", api_key=OPENAI_API_KEY)
-    if model == "anthropic":
+        from langchain_openai import ChatOpenAI
+
+        http_client, http_async_client = _get_http_clients()
+        return ChatOpenAI(
+            temperature=0,
+            model=model_name,
+            api_key=OPENAI_API_KEY,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            max_retries=0,
+            callbacks=callbacks,
+        )
+    if provider == "anthropic":
         if not ANTHROPIC_API_KEY:
             raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
+        from langchain_anthropic import ChatAnthropic
+
         return ChatAnthropic(
             temperature=0,
-            model_name="claude-3-5-sonnet-20240620",
+            model_name=model_name,
             timeout=None,
             stop=None,
+            max_retries=0,
+            callbacks=callbacks,
         )
-    if model == "google_genai":
+    if provider == "google_genai":
         if not GOOGLE_API_KEY:
             raise ValueError("GOOGLE_API_KEY environment variable is not set")
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
         return ChatGoogleGenerativeAI(
             temperature=0,
-            model="gemini-1.5-pro",
+            model=model_name,
             api_key=GOOGLE_API_KEY,
+            max_retries=0,
+            callbacks=callbacks,
         )
 
     raise ValueError("Invalid model specified")
+
+
+def get_model(state: AgentState, profile: str = "reasoning") -> BaseChatModel:
+    """
+    Get the model for a step profile based on the environment variables.
+
+    Returns a shared client from the registry; clients are safe to use
+    concurrently, so callers must not mutate them (use bind/bind_tools).
+    """
+    provider, model_name = _resolve_profile(state, profile)
+
+    key = (profile, provider, model_name)
+    with _registry_lock:
+        instance = _registry.get(key)
+        if instance is not None:
+            _registry_stats["hits"] += 1
+            return instance
+
+        instance = _build_model(provider, model_name, profile)
+        _registry[key] = instance
+        _registry_stats["misses"] += 1
+        logger.info(f"Model profile '{profile}' -> {provider}:{model_name}")
+        return instance
+
+
+async def ainvoke_with_retries(model: Runnable, messages: List[BaseMessage], config: RunnableConfig) -> BaseMessage:
+    """
+    ``model.ainvoke(messages, config)`` under LLM admission and retries.
+
+    Inside a graph node the response streams to the UI as it is generated, so
+    it is read as a stream and only retried before its first token.
+    """
+    gathered = None
+    async for chunk in stream_with_retries("llm", lambda: model.astream(messages, config)):
+        gathered = chunk if gathered is None else gathered + chunk
+    return AIMessage(content="") if gathered is None else message_chunk_to_message(gathered)
+
+
+async def warm_up_connections(timeout: float = 5.0) -> None:
+    """
+    Open a keep-alive connection in the shared pool ahead of the first LLM call.
+
+    Only applies to providers using the pooled client (OpenAI); the response
+    status does not matter, only the established TCP/TLS connection.
+    """
+    if not _http_clients:
+        return
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+    try:
+        await _http_clients["async"].head(base_url, timeout=timeout)
+    except httpx.HTTPError as e:
+        logger.warning(f"Could not pre-open model connection to {base_url}: {e}")
+
+
+def get_step_stats() -> Dict[str, Dict[str, float]]:
+    """Per-profile LLM call counts, errors, cumulative latency and token usage."""
+    with _step_stats_lock:
+        return {profile: dict(stats) for profile, stats in _step_stats.items()}
+
+
+def _open_connections(client: Optional[httpx.AsyncClient]) -> int:
+    """Best-effort count of pooled connections held by an httpx client."""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return len(getattr(pool, "connections", []) or [])
+
+
+def get_model_registry_stats() -> Dict[str, Any]:
+    """
+    Client and connection reuse counters.
+
+    ``hits``/``misses`` count get_model calls served from the registry vs.
+    new clients built; ``http_requests`` and ``open_connections`` cover the
+    shared pooled HTTP client (requests per connection shows keep-alive reuse).
+    """
+    with _registry_lock:
+        stats: Dict[str, Any] = dict(_registry_stats)
+        stats["instances"] = len(_registry)
+    stats["open_connections"] = _open_connections(_http_clients.get("async"))
+    return stats
+
+
+register_stats("model_registry", get_model_registry_stats)
@@ -0,0 +1,238 @@
+"""
+Profiling
+
+On-demand sampling profiles of single agent runs, for research queries that
+are pathologically slow in production and do not reproduce offline. A run is
+profiled when
+
+- its request carries ``X-Profile: <PROFILE_TOKEN>`` (only when PROFILE_TOKEN
+  is set, so clients cannot profile at will), or
+- it is picked by PROFILE_SAMPLE_RATE (fraction of runs, 0 disables).
+
+Each profile is written to PROFILE_DIR as ``<time>-<thread id>-<id>`` with a
+``.json`` summary (thread id, trigger, duration, and the start and duration of
+every graph node the run executed) next to the profile itself:
+
+- ``.html``: pyinstrument's call tree when the ``pyinstrument`` package is
+  installed. Its async mode follows the run's own tasks across awaits, so the
+  profile shows where this run spent its time, awaits included, and not what
+  concurrent runs were doing.
+- ``.folded``: otherwise, collapsed stacks of the event-loop thread from a
+  built-in sampler (load in speedscope or flamegraph.pl). Coroutine frames
+  appear under the task that awaits them, but samples are process-wide.
+
+The profile id is returned in the ``X-Profile-Id`` response header. One run
+per process is profiled at a time. When neither trigger is configured the
+middleware passes requests straight through, and node timing is a single
+context-variable lookup per node.
+"""
+
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # optional dependency
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".profiles")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+_HEADER = b"x-profile"
+
+_current_run: contextvars.ContextVar[Optional["ProfileRun"]] = contextvars.ContextVar("profile_run", default=None)
+
+_stats = {"profiles": 0, "skipped_busy": 0, "errors": 0}
+_busy = False
+
+
+class ProfileRun:
+    """Metadata of one profiled request: trigger, thread id and node timings."""
+
+    def __init__(self, trigger: str, path: str):
+        self.id = secrets.token_hex(4)
+        self.trigger = trigger
+        self.path = path
+        self.thread_id: Optional[str] = None
+        self.started_wall = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.nodes: List[Dict[str, Any]] = []
+
+    def summary(self, profile_file: str) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "thread_id": self.thread_id,
+            "trigger": self.trigger,
+            "path": self.path,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.started_wall)),
+            "duration_ms": round(self.duration * 1000, 1),
+            "profiler": "pyinstrument" if Profiler is not None else "stack-sampler",
+            "profile": profile_file,
+            "nodes": self.nodes,
+        }
+
+    def file_stem(self) -> str:
+        thread = re.sub(r"[^\w.-]", "_", self.thread_id or "unknown")[:64]
+        return f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.started_wall))}-{thread}-{self.id}"
+
+
+def note_node(name: str, thread_id: Optional[str], started: float, duration: float) -> None:
+    """Record a node's timing on the run being profiled, if any (called by instrument_node)."""
+    run = _current_run.get()
+    if run is None:
+        return
+    if thread_id and not run.thread_id:
+        run.thread_id = thread_id
+    run.nodes.append({
+        "node": name,
+        "start_ms": round((started - run.started) * 1000, 1),
+        "duration_ms": round(duration * 1000, 1),
+    })
+
+
+class _StackSampler:
+    """Fallback sampler: collapsed stacks of one thread, taken from a daemon thread."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.target = threading.get_ident()
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def output(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+def _start_profiler() -> Any:
+    interval = PROFILE_INTERVAL_MS / 1000
+    if Profiler is not None:
+        profiler = Profiler(interval=interval, async_mode="enabled")
+    else:
+        profiler = _StackSampler(interval)
+    profiler.start()
+    return profiler
+
+
+def _save(run: ProfileRun, profiler: Any) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = run.file_stem()
+    if Profiler is not None:
+        profile_file, content = f"{stem}.html", profiler.output_html()
+    else:
+        profile_file, content = f"{stem}.folded", profiler.output()
+    with open(os.path.join(PROFILE_DIR, profile_file), "w", encoding="utf-8") as f:
+        f.write(content)
+    with open(os.path.join(PROFILE_DIR, f"{stem}.json"), "w", encoding="utf-8") as f:
+        json.dump(run.summary(profile_file), f, indent=2)
+    return os.path.join(PROFILE_DIR, profile_file)
+
+
+def _trigger(scope) -> Optional[str]:
+    if PROFILE_TOKEN:
+        for key, value in scope["headers"]:
+            if key == _HEADER:
+                if hmac.compare_digest(value, PROFILE_TOKEN.encode("utf-8")):
+                    return "header"
+                break
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the selected POST requests under one of
+    ``prefixes``, streamed body included (the graph runs while it streams).
+    """
+
+    def __init__(self, app, prefixes: Tuple[str, ...] = ("/",)):
+        self.app = app
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        global _busy
+        if (
+            not PROFILING_ENABLED
+            or scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].startswith(self.prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+        trigger = _trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+        if _busy:
+            _stats["skipped_busy"] += 1
+            await self.app(scope, receive, send)
+            return
+
+        run = ProfileRun(trigger, scope["path"])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", run.id.encode())]}
+            await send(message)
+
+        _busy = True
+        token = _current_run.set(run)
+        profiler = _start_profiler()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            run.duration = time.perf_counter() - run.started
+            _current_run.reset(token)
+            _busy = False
+            try:
+                # Rendering the call tree is CPU work; keep it off the event loop
+                path = await asyncio.to_thread(_save, run, profiler)
+                _stats["profiles"] += 1
+                logger.info("Profiled %s (thread %s, %.0f ms): %s", run.path, run.thread_id, run.duration * 1000, path)
+            except Exception as e:
+                _stats["errors"] += 1
+                logger.warning("Could not save profile %s: %s", run.id, e)
+
+
+def get_profiling_stats() -> Dict[str, int]:
+    """Profiles written, triggered runs skipped while another was profiled, and save errors."""
+    return dict(_stats)
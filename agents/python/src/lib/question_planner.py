@@ -0,0 +1,167 @@
+"""
+Question Planner
+
+Plans the Tako searches of a turn before they fan out. GenerateDataQuestions
+often asks the same thing several times: a question can be both ``fast`` and
+``prediction_market`` (and was searched once for each), and paraphrases
+("China GDP", "China GDP since 1960", "China's GDP") each cost an MCP call
+while returning the same charts.
+
+plan_questions() groups such questions and returns one search per group:
+
+- questions are normalized to their content words in order (lowercased,
+  punctuation, stop words and plural endings dropped), after entity
+  canonicalization; direction words ("to", "from") are kept
+- questions with the same words are one search; so are questions whose words
+  overlap by at least QUESTION_CLUSTER_MIN_SIMILARITY (Jaccard) with the
+  shared words in the same order and the same direction
+- a question without a period ("China GDP") is covered by one asking about a
+  period ("China GDP since 1960"), but questions about different periods or
+  years ("US inflation 2008" / "US inflation 2023") are never merged
+- each group searches its most specific question, and every originating
+  question is mapped back to the group's search (its log entry completes
+  when that search does)
+
+Searches saved are counted in ``agent_search_calls_saved_total``.
+"""
+
+import logging
+import os
+import re
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Sequence, Tuple
+
+from src.lib.metrics import counter, register_stats
+
+logger = logging.getLogger(__name__)
+
+QUESTION_CLUSTER_MIN_SIMILARITY = float(os.getenv("QUESTION_CLUSTER_MIN_SIMILARITY", "0.8"))
+
+SEARCH_CALLS_SAVED = counter(
+    "agent_search_calls_saved_total",
+    "Knowledge-base searches not made because a planned search covered the question.",
+    ("phase",),
+)
+
+_STOP_WORDS = frozenset(
+    "a an and are as at be by do does for has have how in is it its of on or per s the their there this "
+    "was what when where which who why will with".split()
+)
+# Kept: "exports to US" and "exports from US" are different questions
+_DIRECTION_WORDS = frozenset("to from into".split())
+# Words that narrow a question to a period
+_TIME_WORDS = frozenset(
+    "since until till through during over last past recent recently current currently today now "
+    "year years yearly annual annually month months monthly quarter quarters quarterly decade decades "
+    "century history historical historically trend trends time timeline series latest".split()
+)
+_WORD_RE = re.compile(r"[\w$%]+")
+_YEAR_RE = re.compile(r"^(1[89]|20)\d\d(s)?$")
+
+_stats = {"questions": 0, "searches": 0, "saved": 0}
+
+
+class _Key(NamedTuple):
+    """A question reduced to what decides whether two questions are one search."""
+
+    words: Tuple[str, ...]  # content words, in order, without the period
+    years: FrozenSet[str]  # explicit years ("2008", "1990s"), ranges included
+    period: FrozenSet[str]  # every word naming a period, years included
+
+
+def _key(question: str) -> _Key:
+    tokens = _WORD_RE.findall(question.lower())
+    words, years, period = [], set(), set()
+    for i, token in enumerate(tokens):
+        if _YEAR_RE.match(token):
+            years.add(token)
+            period.add(token)
+        elif token in _TIME_WORDS:
+            period.add(token)
+        elif token in _DIRECTION_WORDS and any(
+            _YEAR_RE.match(t) for t in tokens[max(i - 1, 0):i + 2:2]
+        ):
+            # "from 2000 to 2010" is part of the period, not a direction
+            period.add(token)
+        elif token not in _STOP_WORDS:
+            if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+                token = token[:-1]
+            words.append(token)
+    return _Key(tuple(words), frozenset(years), frozenset(period))
+
+
+def _same_search(a: _Key, b: _Key) -> bool:
+    # A question without a period is covered by one asking about a period;
+    # two different periods (2008 vs. 2023, two prediction markets) are not
+    if a.period and b.period and a.period != b.period:
+        return False
+    if a.years and b.years and a.years != b.years:
+        return False
+    if a.words == b.words:
+        return True
+    shared = set(a.words) & set(b.words)
+    if not shared:
+        return False
+    # Same direction, and shared words in the same order: "China exports to
+    # US" and "US exports to China" are different questions
+    if {w for w in a.words if w in _DIRECTION_WORDS} != {w for w in b.words if w in _DIRECTION_WORDS}:
+        return False
+    if [w for w in a.words if w in shared] != [w for w in b.words if w in shared]:
+        return False
+    return len(shared) / len(set(a.words) | set(b.words)) >= QUESTION_CLUSTER_MIN_SIMILARITY
+
+
+class PlannedSearch:
+    """One search standing in for one or more of the turn's data questions."""
+
+    __slots__ = ("question", "members", "_keys", "_key")
+
+    def __init__(self, question: str, member: int, key: _Key):
+        self.question = question
+        self.members: List[int] = [member]
+        self._keys = [key]
+        self._key = key
+
+    def __repr__(self) -> str:
+        return f"PlannedSearch({self.question!r}, members={self.members})"
+
+
+def plan_questions(questions: Sequence[Dict[str, Any]], phase: str = "search") -> List[PlannedSearch]:
+    """
+    Group ``questions`` (DataQuestion dicts) into the searches to make.
+
+    Each PlannedSearch lists, in ``members``, the indexes of the questions it
+    answers; every question belongs to exactly one search. Searches keep the
+    order of their first question.
+    """
+    planned: List[PlannedSearch] = []
+    for i, q in enumerate(questions):
+        question = q["question"].strip()
+        key = _key(question)
+        for search in planned:
+            # Every question of a group must be answerable by the same search
+            if all(_same_search(key, other) for other in search._keys):
+                search.members.append(i)
+                search._keys.append(key)
+                # Search with the most specific wording of the group
+                if len(key.words) + len(key.period) > len(search._key.words) + len(search._key.period):
+                    search.question, search._key = question, key
+                break
+        else:
+            planned.append(PlannedSearch(question, i, key))
+
+    saved = len(questions) - len(planned)
+    _stats["questions"] += len(questions)
+    _stats["searches"] += len(planned)
+    _stats["saved"] += saved
+    if saved:
+        SEARCH_CALLS_SAVED.inc(saved, phase=phase)
+        logger.info(f"Planned {len(planned)} {phase} searches for {len(questions)} data questions")
+    return planned
+
+
+def get_question_planner_stats() -> Dict[str, int]:
+    """Data questions planned, searches made for them, and searches saved."""
+    return dict(_stats)
+
+
+register_stats("question_planner", get_question_planner_stats)
@@ -0,0 +1,299 @@
+"""
+Rate Limiting
+
+One shared token bucket per upstream (LLM provider, Tako MCP, Tavily), and a
+single retry policy for all of them, so calls go out as fast as the
+provider's quota allows without a retry storm when it pushes back.
+
+- Each bucket refills at RATE_LIMIT_<UPSTREAM>_RPS requests per second (0
+  disables it) with bursts of up to RATE_LIMIT_BURST.
+- The rate adapts (AIMD): a 429 halves it (at most once per second, so a
+  burst of concurrent 429s counts as one signal) and pauses the bucket for
+  the response's Retry-After; every success raises it by a tenth of the
+  configured rate, back up to that rate.
+- Throttling (429), overload (5xx), timeouts and connection errors are
+  retried up to RETRY_MAX_ATTEMPTS times. The wait is the server's
+  Retry-After plus jitter, or else exponential backoff with full jitter.
+- A retry is only made if its wait fits in the remaining turn budget
+  (TURN_BUDGET_SECONDS from the start of the request, see turn_budget()).
+  A turn that cannot finish in time fails fast rather than piling up waits.
+
+Calls whose output streams to the UI as it is generated go through
+stream_with_retries(): only failures before the first chunk are retried, so
+a retry never repeats content the user has already seen.
+
+Provider SDK retries are turned off (see model.py), so this is the only
+retry layer. Other errors (bad requests, auth, shed by admission control)
+are raised at once.
+"""
+
+import asyncio
+import contextvars
+import email.utils
+import logging
+import os
+import random
+import time
+from contextlib import AsyncExitStack, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+import httpx
+
+from src.lib.admission import admit
+from src.lib.metrics import counter, register_stats
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS = {
+    "llm": float(os.getenv("RATE_LIMIT_LLM_RPS", "10")),
+    "mcp": float(os.getenv("RATE_LIMIT_MCP_RPS", "20")),
+    "tavily": float(os.getenv("RATE_LIMIT_TAVILY_RPS", "5")),
+}
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "20"))
+TURN_BUDGET_SECONDS = float(os.getenv("TURN_BUDGET_SECONDS", "240"))
+
+# Statuses worth retrying: throttling, timeouts and transient server errors
+# (529: Anthropic overloaded)
+_RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504, 529}
+# Rate-limit errors raised without an HTTP status (Tavily, Google)
+_RATE_LIMIT_ERRORS = {"UsageLimitExceededError", "TavilyKeylessLimitError", "RateLimitError", "ResourceExhausted"}
+
+UPSTREAM_RETRIES = counter(
+    "agent_upstream_retries_total", "Retried calls to upstream services.", ("upstream", "reason")
+)
+
+_turn_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("turn_deadline", default=None)
+
+T = TypeVar("T")
+
+
+@contextmanager
+def turn_budget(seconds: float = TURN_BUDGET_SECONDS) -> Iterator[None]:
+    """Give the enclosed turn, and the tasks it starts, ``seconds`` to finish."""
+    token = _turn_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _turn_deadline.reset(token)
+
+
+def remaining_budget() -> float:
+    """Seconds left in the current turn's budget (infinite outside a turn)."""
+    deadline = _turn_deadline.get()
+    return float("inf") if deadline is None else deadline - time.monotonic()
+
+
+class TurnBudgetMiddleware:
+    """ASGI middleware starting a turn budget for each HTTP request under one of ``prefixes``."""
+
+    def __init__(self, app, prefixes: Tuple[str, ...] = ("/",)):
+        self.app = app
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+        with turn_budget():
+            await self.app(scope, receive, send)
+
+
+class TokenBucket:
+    """Token bucket whose refill rate backs off on 429s and recovers on success (AIMD)."""
+
+    def __init__(self, upstream: str, rate: float, burst: float):
+        self.upstream = upstream
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._stats = {"calls": 0, "rate_limited": 0, "retries": 0, "gave_up": 0, "throttled_seconds": 0.0}
+
+    def _refill(self, now: float) -> None:
+        # Nothing accrues while paused for Retry-After, so the pause does not
+        # end in a full burst
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    async def acquire(self) -> None:
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if wait <= 0:
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+        self._stats["calls"] += 1
+        self._stats["throttled_seconds"] += time.monotonic() - started
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def on_retry(self) -> None:
+        self._stats["retries"] += 1
+
+    def on_give_up(self) -> None:
+        self._stats["gave_up"] += 1
+
+    def on_rate_limited(self, retry_after: Optional[float]) -> None:
+        self._stats["rate_limited"] += 1
+        now = time.monotonic()
+        self._refill(now)
+        if now - self._decreased_at >= 1.0:
+            self.rate = max(self.max_rate / 10, self.rate / 2)
+            self._decreased_at = now
+        self.tokens = 0.0
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+    def stats(self) -> Dict[str, float]:
+        return {**self._stats, "rate": round(self.rate, 3), "max_rate": self.max_rate}
+
+
+_buckets: Dict[str, TokenBucket] = {
+    upstream: TokenBucket(upstream, rate, RATE_LIMIT_BURST) for upstream, rate in RATE_LIMITS.items() if rate > 0
+}
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for source in (error, getattr(error, "response", None)):
+        status = getattr(source, "status_code", None)
+        if isinstance(status, int):
+            return status
+    if type(error).__name__ in _RATE_LIMIT_ERRORS:
+        return 429
+    return None
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the upstream asked us to wait, from the error or its response headers."""
+    seconds = getattr(error, "retry_after_seconds", None)
+    if isinstance(seconds, (int, float)):
+        return float(seconds)
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_reason(error: BaseException, status: Optional[int]) -> Optional[str]:
+    if status is not None:
+        if status == 429:
+            return "rate_limited"
+        return f"http_{status}" if status in _RETRYABLE_STATUS else None
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return "transport"
+    name = type(error).__name__
+    if "Timeout" in name or "Connection" in name:
+        return "transport"
+    return None
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1)))
+
+
+async def call_with_retries(upstream: str, call: Callable[[], Awaitable[T]]) -> T:
+    """
+    Make ``call()`` through the upstream's token bucket, retrying transient
+    failures with jittered, Retry-After-aware backoff within the turn budget.
+    """
+    bucket = _buckets.get(upstream)
+    attempt = 0
+    while True:
+        attempt += 1
+        if bucket is not None:
+            await bucket.acquire()
+        try:
+            result = await call()
+        except Exception as e:
+            status = _status_code(e)
+            reason = _retry_reason(e, status)
+            if reason is None:
+                raise
+            retry_after = _retry_after(e)
+            if status == 429 and bucket is not None:
+                bucket.on_rate_limited(retry_after)
+            if retry_after is not None:
+                # Jitter keeps the calls told to wait from all returning at once
+                delay = retry_after + random.uniform(0, RETRY_BASE_DELAY_SECONDS)
+            else:
+                delay = _backoff(attempt)
+            if attempt >= RETRY_MAX_ATTEMPTS or delay >= remaining_budget():
+                if bucket is not None:
+                    bucket.on_give_up()
+                logger.warning(f"Giving up on {upstream} call after {attempt} attempts ({reason}): {e}")
+                raise
+            if bucket is not None:
+                bucket.on_retry()
+            UPSTREAM_RETRIES.inc(upstream=upstream, reason=reason)
+            logger.info(f"Retrying {upstream} call in {delay:.2f}s ({reason}, attempt {attempt})")
+            await asyncio.sleep(delay)
+            continue
+        if bucket is not None:
+            bucket.on_success()
+        return result
+
+
+async def stream_with_retries(upstream: str, open_stream: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+    """
+    Iterate the stream ``open_stream()`` returns, retrying (as call_with_retries
+    does) only failures before its first chunk; later failures are raised.
+
+    Each attempt holds an admission slot for ``upstream`` and keeps it for the
+    rest of the stream once the first chunk arrives; none is held while a
+    retry waits.
+    """
+
+    async def first_chunk():
+        slot = AsyncExitStack()
+        await slot.enter_async_context(admit(upstream))
+        try:
+            stream = open_stream().__aiter__()
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                return None, stream, slot
+            return (first,), stream, slot
+        except BaseException:
+            await slot.aclose()
+            raise
+
+    first, stream, slot = await call_with_retries(upstream, first_chunk)
+    async with slot:
+        if first is None:
+            return
+        yield first[0]
+        async for chunk in stream:
+            yield chunk
+
+
+def get_rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    """Per upstream: current and configured rate, calls, 429s, retries, give-ups and time spent throttled."""
+    return {upstream: bucket.stats() for upstream, bucket in _buckets.items()}
+
+
+register_stats("rate_limit", get_rate_limit_stats, label="upstream")
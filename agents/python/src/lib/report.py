@@ -0,0 +1,219 @@
+"""
+Report Post-Processing
+
+Sanitizes reports written by the model and turns [CHART:title] markers into
+chart iframes. Also provides ReportStreamer, which does the same work
+incrementally while the WriteReport tool call is still being generated so
+the UI can show the report paragraph by paragraph.
+"""
+
+import asyncio
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from src.lib.admission import Priority, priority
+from src.lib.chart_store import chart_embed_stub, get_chart
+from src.lib.chart_placement import (
+    assign_charts,
+    is_text_paragraph,
+    score_paragraph,
+    split_paragraphs,
+)
+from src.lib.mcp_integration import get_visualization_iframe
+
+logger = logging.getLogger(__name__)
+
+# While streaming, a chart is spliced in right after a finished paragraph only
+# if it matches that paragraph this well; the rest are placed when the report
+# is complete.
+STREAM_PLACEMENT_SCORE = 0.3
+
+_EXTERNAL_DOMAINS = r'(tradingeconomics|worldbank|imf|fred|ourworldindata|statista)'
+_CHART_MARKER_RE = re.compile(r'\[CHART:([^\]]+)\]')
+
+
+def sanitize_report(report: str) -> str:
+    """Remove image links and chart markers the model was told not to write."""
+    # Remove any markdown image links that the LLM incorrectly added
+    report = re.sub(rf'!\[([^\]]+)\]\(https?://[^)]*{_EXTERNAL_DOMAINS}[^)]*\)',
+                    r'', report, flags=re.IGNORECASE)
+
+    # Remove any markdown images
+    report = re.sub(r'!\[[^\]]*\]\([^)]+\)', '', report)
+
+    # Remove any leftover chart markers (in case model still added them)
+    report = re.sub(r'\[TAKO_CHART:[^\]]+\]', '', report)
+    return report
+
+
+def _find_chart(charts_map: Dict[str, Dict[str, Any]], chart_title: str) -> Optional[Dict[str, Any]]:
+    chart_info = charts_map.get(chart_title)
+
+    # Try case-insensitive match if exact match fails
+    if not chart_info:
+        for title, info in charts_map.items():
+            if title.lower() == chart_title.lower():
+                return info
+    return chart_info
+
+
+async def render_chart(chart_info: Dict[str, Any]) -> str:
+    """
+    Compact iframe embed for inlining a chart in the report.
+
+    Uses the HTML already in the chart store when the resource has a chart_id,
+    and only falls back to fetching it from MCP otherwise.
+    """
+    chart_id = chart_info.get("chart_id")
+    iframe_html = get_chart(chart_id) if chart_id else None
+    if not iframe_html:
+        iframe_html = await get_visualization_iframe(
+            item_id=chart_info.get("card_id"),
+            embed_url=chart_info.get("embed_url")
+        )
+    if iframe_html:
+        iframe_only = re.sub(r'<script.*?</script>', '', iframe_html, flags=re.DOTALL).strip()
+        return chart_embed_stub(iframe_only)
+    return ""
+
+
+async def inject_chart_iframes(report_with_markers: str, charts_map: Dict[str, Dict[str, Any]]) -> str:
+    """Replace every [CHART:title] marker with the chart's iframe HTML."""
+    markers = list(_CHART_MARKER_RE.finditer(report_with_markers))
+
+    async def replace_marker(match):
+        chart_title = match.group(1).strip()
+        chart_info = _find_chart(charts_map, chart_title)
+        if not chart_info:
+            logger.warning(f"Chart not found: {chart_title}")
+            return ""
+        iframe_only = await render_chart(chart_info)
+        return "\n" + iframe_only + "\n" if iframe_only else ""
+
+    replacements = await asyncio.gather(*(replace_marker(m) for m in markers))
+
+    # Join the text between markers with their replacements in one pass
+    # (re-slicing the whole report per marker is quadratic in its length)
+    parts = []
+    position = 0
+    for match, replacement in zip(markers, replacements):
+        parts.append(report_with_markers[position:match.start()])
+        parts.append(replacement)
+        position = match.end()
+    parts.append(report_with_markers[position:])
+    processed_report = "".join(parts)
+
+    logger.info(f"Injected {len([r for r in replacements if r])} charts into report")
+    return processed_report
+
+
+class ReportStreamer:
+    """
+    Incrementally sanitizes a report as it streams and splices charts in at
+    paragraph boundaries.
+
+    Feed it the growing report text with ``update``; each call returns the
+    rendered report for all paragraphs finished so far (or None if nothing
+    new finished). ``finish`` places the remaining charts and returns the
+    final report. Chart iframes are fetched in the background as soon as
+    streaming starts, so splicing one in does not wait on MCP.
+    """
+
+    def __init__(self, charts_map: Dict[str, Dict[str, Any]]):
+        self.charts_map = charts_map
+        self._paragraphs: List[str] = []
+        self._consumed = 0
+        self._assignment: Dict[int, str] = {}
+        self._iframes: Dict[str, asyncio.Task] = {}
+
+    def _prefetch(self) -> None:
+        if self._iframes or not self.charts_map:
+            return
+        # Speculative: yields to every other MCP call when the server is busy
+        with priority(Priority.PREFETCH):
+            for title, info in self.charts_map.items():
+                self._iframes[title] = asyncio.ensure_future(render_chart(info))
+
+    def _add_paragraphs(self, blocks: List[str], place_charts: bool) -> None:
+        placed = set(self._assignment.values())
+        for block in blocks:
+            paragraph = sanitize_report(block).strip()
+            if not paragraph:
+                continue
+            self._paragraphs.append(paragraph)
+            i = len(self._paragraphs) - 1
+            if not place_charts or not is_text_paragraph(paragraph):
+                continue
+
+            best_title, best_score = None, STREAM_PLACEMENT_SCORE
+            for title, info in self.charts_map.items():
+                if title in placed:
+                    continue
+                score = score_paragraph(paragraph, title, info.get("description") or "")
+                if score >= best_score:
+                    best_title, best_score = title, score
+            if best_title:
+                self._assignment[i] = best_title
+                placed.add(best_title)
+
+    async def _render(self, wait: bool) -> str:
+        """
+        Join finished paragraphs and their charts. Unless ``wait`` is set,
+        charts whose iframe is still being fetched are left out for now.
+        """
+        blocks = []
+        for i, paragraph in enumerate(self._paragraphs):
+            blocks.append(paragraph)
+            task = self._iframes.get(self._assignment.get(i))
+            if task is None or (not wait and not task.done()):
+                continue
+            try:
+                iframe = await task
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"Failed to render chart {self._assignment[i]}: {e}")
+                continue
+            if iframe:
+                blocks.append(iframe)
+        return "\n\n".join(blocks)
+
+    async def update(self, partial_report: str) -> Optional[str]:
+        """Process newly finished paragraphs of a partially streamed report."""
+        self._prefetch()
+        boundary = partial_report.rfind("\n\n")
+        if boundary < 0:
+            return None
+
+        blocks = split_paragraphs(partial_report[:boundary])
+        new_blocks = blocks[self._consumed:]
+        if not new_blocks:
+            return None
+        self._consumed = len(blocks)
+        self._add_paragraphs(new_blocks, place_charts=True)
+        return await self._render(wait=False)
+
+    async def finish(self, report: str) -> str:
+        """Process the rest of the complete report and place any unplaced charts."""
+        self._prefetch()
+        blocks = split_paragraphs(report)
+        self._add_paragraphs(blocks[self._consumed:], place_charts=False)
+        self._consumed = len(blocks)
+
+        placed = set(self._assignment.values())
+        remaining = {
+            title: info.get("description") or ""
+            for title, info in self.charts_map.items()
+            if title not in placed
+        }
+        if remaining:
+            self._assignment.update(
+                assign_charts(self._paragraphs, remaining, taken=self._assignment.keys())
+            )
+
+        used = set(self._assignment.values())
+        for title, task in self._iframes.items():
+            if title not in used:
+                task.cancel()
+
+        logger.info(f"Streamed report with {len(used)} charts")
+        return await self._render(wait=True)
@@ -7,24 +7,53 @@ import logging
 import os
 from typing import Any, Dict, List, cast
 
-from copilotkit.langgraph import copilotkit_emit_state
 from langchain.tools import tool
 from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
 from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel, Field
-from tavily import TavilyClient
 
-from src.lib.model import get_model
+from src.lib.admission import Priority, admit, priority
+from src.lib.cache import TTLCache
+from src.lib.cassette import through_cassette
+from src.lib.chart_store import put_chart
+from src.lib.emitter import emit_state, with_state_emitter
+from src.lib.entity_index import canonicalize
+from src.lib.history import compact_history
+from src.lib.loop_monitor import run_cpu
+from src.lib.metrics import register_stats, track
+from src.lib.model import ainvoke_with_retries, get_model
+from src.lib.question_planner import plan_questions
+from src.lib.rate_limit import call_with_retries
 from src.lib.state import AgentState
+from src.lib.tracing import span
 from src.lib.mcp_integration import search_knowledge_base, get_visualization_iframe
 
 logger = logging.getLogger(__name__)
 
 
 # Configuration
-MAX_WEB_SEARCHES = 1
+MAX_WEB_SEARCHES = int(os.getenv("MAX_WEB_SEARCHES", "3"))  # Run in parallel
 MAX_TOTAL_RESOURCES = 10  # Maximum total resources to prevent context bloat
 
+# Tavily results are cached per normalized query + search parameters.
+# Set TAVILY_CACHE_TTL_SECONDS=0 to disable; set TAVILY_CACHE_DIR to add a disk tier.
+TAVILY_CACHE_TTL_SECONDS = float(os.getenv("TAVILY_CACHE_TTL_SECONDS", "3600"))
+TAVILY_CACHE_MAX_ENTRIES = int(os.getenv("TAVILY_CACHE_MAX_ENTRIES", "512"))
+TAVILY_CACHE_DIR = os.getenv("TAVILY_CACHE_DIR") or None
+
+# Web searches start at "basic" depth and escalate to "advanced" only when the
+# basic results are sparse or low-scoring.
+TAVILY_MAX_RESULTS = int(os.getenv("TAVILY_MAX_RESULTS", "5"))
+TAVILY_ESCALATION_MIN_RESULTS = int(os.getenv("TAVILY_ESCALATION_MIN_RESULTS", "3"))
+TAVILY_ESCALATION_MIN_SCORE = float(os.getenv("TAVILY_ESCALATION_MIN_SCORE", "0.5"))
+
+_tavily_cache = TTLCache(
+    "tavily",
+    ttl_seconds=TAVILY_CACHE_TTL_SECONDS,
+    max_entries=TAVILY_CACHE_MAX_ENTRIES,
+    disk_dir=TAVILY_CACHE_DIR,
+)
+
 class ResourceInput(BaseModel):
     """A resource with a short description"""
 
@@ -47,29 +76,111 @@ def get_tavily_client():
         tavily_api_key = os.getenv("TAVILY_API_KEY")
         if not tavily_api_key:
             raise ValueError("TAVILY_API_KEY environment variable is not set")
-        _tavily_client = TavilyClient(api_key=tavily_api_key)
+        from tavily import TavilyClient  # imported on first use to keep startup fast
+
+        # TAVILY_API_BASE_URL points the client at a proxy or a local stand-in
+        base_url = os.getenv("TAVILY_API_BASE_URL")
+        _tavily_client = TavilyClient(api_key=tavily_api_key, **({"api_base_url": base_url} if base_url else {}))
     return _tavily_client
 
 
 # Async version of Tavily search that runs the synchronous client in a thread pool
-async def async_tavily_search(query: str) -> Dict[str, Any]:
+async def async_tavily_search(query: str, search_depth: str = "basic") -> Dict[str, Any]:
     """Asynchronous wrapper for Tavily search API"""
+    search_params = {
+        "search_depth": search_depth,
+        "include_answer": True,
+        "max_results": TAVILY_MAX_RESULTS,
+    }
+    cache_key = TTLCache.make_key(query, **search_params)
+    cached = await _tavily_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Tavily cache hit for '{query}'")
+        return cached
+
     loop = asyncio.get_event_loop()
-    try:
+
+    async def attempt():
         # Run the synchronous tavily_client.search in a thread pool
-        return await loop.run_in_executor(
-            None,
-            lambda: get_tavily_client().search(
-                query=query,
-                search_depth="advanced",
-                include_answer=True,
-                max_results=5,
-            ),
-        )
+        async with admit("tavily"):
+            with track("tavily", search_depth):
+                return await through_cassette(
+                    "tavily",
+                    search_depth,
+                    {"query": query, **search_params},
+                    lambda: loop.run_in_executor(
+                        None,
+                        lambda: get_tavily_client().search(query=query, **search_params),
+                    ),
+                )
+
+    try:
+        result = await call_with_retries("tavily", attempt)
     except Exception as e:
         raise Exception(f"Tavily search failed: {str(e)}")
 
+    await _tavily_cache.set(cache_key, result)
+    return result
+
+
+_web_search_stats = {"searches": 0, "escalations": 0}
+
+
+def _needs_escalation(result: Dict[str, Any]) -> bool:
+    """Whether basic-depth results are too sparse or weak to use as-is."""
+    results = result.get("results") or []
+    if len(results) < TAVILY_ESCALATION_MIN_RESULTS:
+        return True
+    top_score = max((r.get("score") or 0.0) for r in results)
+    return top_score < TAVILY_ESCALATION_MIN_SCORE
+
+
+async def adaptive_tavily_search(query: str) -> Dict[str, Any]:
+    """
+    Run a basic-depth Tavily search and escalate to advanced depth only when
+    the basic results are sparse or low-scoring.
+    """
+    _web_search_stats["searches"] += 1
+    result = await async_tavily_search(query, search_depth="basic")
+    if not _needs_escalation(result):
+        return result
+
+    _web_search_stats["escalations"] += 1
+    logger.info(f"Escalating web search to advanced depth for '{query}'")
+    try:
+        return await async_tavily_search(query, search_depth="advanced")
+    except Exception as e:
+        # Basic results are still usable if the escalated search fails
+        logger.warning(f"Advanced web search failed, keeping basic results: {e}")
+        return result
+
+
+def get_web_search_stats() -> Dict[str, Any]:
+    """Number of adaptive web searches and how often they escalated."""
+    stats: Dict[str, Any] = dict(_web_search_stats)
+    stats["escalation_rate"] = (
+        stats["escalations"] / stats["searches"] if stats["searches"] else 0.0
+    )
+    return stats
+
+
+def get_tavily_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and hit rate of the Tavily result cache."""
+    return _tavily_cache.stats()
+
+
+register_stats("web_search", get_web_search_stats)
+register_stats("tavily_cache", get_tavily_cache_stats)
+
 
+def _format_search_message(search_results: List[Any], tako_results: List[Any]) -> str:
+    search_message = f"Web search results: {search_results}"
+    if tako_results:
+        search_message += f"\n\nTako chart results (data visualizations): {tako_results}"
+    return search_message
+
+
+@with_state_emitter
 async def search_node(state: AgentState, config: RunnableConfig):
     """
     The search node is responsible for searching the internet for resources.
@@ -104,37 +215,43 @@ async def search_node(state: AgentState, config: RunnableConfig):
             queries = [research_question] if research_question else []
             queries = queries[:MAX_WEB_SEARCHES]
 
-        data_questions = state.get("data_questions", [])
+        # Spell known entities and metrics the way the knowledge graph does
+        data_questions = [
+            {**q, "question": canonicalize(q["question"])} if isinstance(q, dict) and q.get("question") else q
+            for q in state.get("data_questions", [])
+        ]
 
         # Separate fast and prediction market questions
         fast_questions = [q for q in data_questions if isinstance(q, dict) and q.get("search_effort") == "fast"]
         prediction_market_questions = [q for q in data_questions if isinstance(q, dict) and q.get("query_type") == "prediction_market"]
 
-        # All Tako questions run as fast in Phase 1
-        all_tako_questions = fast_questions + prediction_market_questions
+        # All Tako questions run as fast in Phase 1 (a question can be both)
+        all_tako_questions = fast_questions + [q for q in prediction_market_questions if q not in fast_questions]
 
         search_results = []
         tako_results = []
 
         # PHASE 1: Run all Tako searches (as fast) and Tavily web searches in parallel
         # Add logs for all searches
+        web_log_offset = len(state["logs"])
         for query in queries:
             state["logs"].append({"message": f"Web search: {query}", "done": False})
         for q_obj in all_tako_questions:
             state["logs"].append({"message": f"Tako search: {q_obj['question']}", "done": False})
         if queries or all_tako_questions:
-            await copilotkit_emit_state(config, state)
+            emit_state(config, state)
 
-        # Build all tasks - all Tako searches run as "fast" in Phase 1
-        tavily_tasks = [async_tavily_search(query) for query in queries]
-        tako_tasks = [
-            search_knowledge_base(q["question"], search_effort="fast")
-            for q in all_tako_questions
-        ]
+        # Build all tasks - all Tako searches run as "fast" in Phase 1, one
+        # per group of near-identical questions
+        tavily_tasks = [adaptive_tavily_search(query) for query in queries]
+        tako_plan = plan_questions(all_tako_questions, phase="fast")
+        tako_tasks = [search_knowledge_base(search.question, search_effort="fast") for search in tako_plan]
 
         all_tasks = tavily_tasks + tako_tasks
         if all_tasks:
-            all_results = await asyncio.gather(*all_tasks, return_exceptions=True)
+            with span("search.phase1", web_queries=len(tavily_tasks), tako_questions=len(tako_tasks)), \
+                    priority(Priority.SEARCH):
+                all_results = await asyncio.gather(*all_tasks, return_exceptions=True)
 
             # Split results back into tavily and tako
             num_tavily = len(tavily_tasks)
@@ -147,55 +264,57 @@ async def search_node(state: AgentState, config: RunnableConfig):
                     search_results.append({"error": str(result)})
                 else:
                     search_results.append(result)
-                state["logs"][i]["done"] = True
-                await copilotkit_emit_state(config, state)
+                state["logs"][web_log_offset + i]["done"] = True
+                emit_state(config, state)
 
             # Process Tako results
-            tako_log_offset = num_tavily
-            for i, result in enumerate(tako_fast_results):
+            tako_log_offset = web_log_offset + num_tavily
+            for search, result in zip(tako_plan, tako_fast_results):
                 if isinstance(result, Exception):
                     tako_results.append({"error": str(result)})
                 elif result:
                     tako_results.extend(result)
-                state["logs"][tako_log_offset + i]["done"] = True
-                await copilotkit_emit_state(config, state)
+                for i in search.members:
+                    state["logs"][tako_log_offset + i]["done"] = True
+                emit_state(config, state)
 
             logger.info(f"Phase 1 completed: {len(search_results)} web results, {len(tako_results)} Tako results")
 
         # PHASE 2: If Tako returned no results, run fallbacks
         if not tako_results:
             fallback_tasks = []
+            # Log indexes of the questions each fallback search answers
             fallback_logs = []
 
             # Fallback Tako web searches for fast questions
             if fast_questions:
                 logger.info("No Tako results found, falling back to Tako web index for questions")
-                for q_obj in fast_questions[:2]:
-                    fallback_logs.append(("tako_web", q_obj["question"]))
-                    state["logs"].append({"message": f"Tako web search: {q_obj['question']}", "done": False})
-                fallback_tasks.extend([
-                    search_knowledge_base(q["question"], search_effort="fast", source_indexes=["web"])
-                    for q in fast_questions[:2]
-                ])
+                for search in plan_questions(fast_questions, phase="tako_web")[:2]:
+                    fallback_logs.append([len(state["logs"]) + i for i in range(len(search.members))])
+                    for i in search.members:
+                        state["logs"].append({"message": f"Tako web search: {fast_questions[i]['question']}", "done": False})
+                    fallback_tasks.append(
+                        search_knowledge_base(search.question, search_effort="fast", source_indexes=["web"])
+                    )
 
             # Deep search for prediction market questions
             if prediction_market_questions:
                 logger.info("Re-running prediction market queries with deep search")
-                for q_obj in prediction_market_questions:
-                    fallback_logs.append(("deep", q_obj["question"]))
-                    state["logs"].append({"message": f"Tako deep search: {q_obj['question']}", "done": False})
-                fallback_tasks.extend([
-                    search_knowledge_base(q["question"], search_effort="deep")
-                    for q in prediction_market_questions
-                ])
+                for search in plan_questions(prediction_market_questions, phase="deep"):
+                    fallback_logs.append([len(state["logs"]) + i for i in range(len(search.members))])
+                    for i in search.members:
+                        state["logs"].append({
+                            "message": f"Tako deep search: {prediction_market_questions[i]['question']}",
+                            "done": False,
+                        })
+                    fallback_tasks.append(search_knowledge_base(search.question, search_effort="deep"))
 
             if fallback_tasks:
-                await copilotkit_emit_state(config, state)
-                fallback_results = await asyncio.gather(*fallback_tasks, return_exceptions=True)
+                emit_state(config, state)
+                with span("search.phase2", fallbacks=len(fallback_tasks)), priority(Priority.FALLBACK):
+                    fallback_results = await asyncio.gather(*fallback_tasks, return_exceptions=True)
 
-                log_offset = len(state["logs"]) - len(fallback_tasks)
-                for i, result in enumerate(fallback_results):
-                    task_type, _ = fallback_logs[i]
+                for log_indexes, result in zip(fallback_logs, fallback_results):
                     if isinstance(result, Exception):
                         tako_results.append({"error": str(result)})
                     elif result:  # Tako result (web or deep)
@@ -218,13 +337,14 @@ async def search_node(state: AgentState, config: RunnableConfig):
                                     "source": "Tako",
                                     "card_id": chart.get("id"),
                                     "embed_url": chart.get("embed_url"),
-                                    "iframe_html": iframe_html,
+                                    "chart_id": put_chart(iframe_html),
                                 })
                                 existing_urls.add(chart["url"])
                                 existing_titles.add(chart_title_lower)
                         tako_results.extend(result)
-                    state["logs"][log_offset + i]["done"] = True
-                    await copilotkit_emit_state(config, state)
+                    for log_index in log_indexes:
+                        state["logs"][log_index]["done"] = True
+                    emit_state(config, state)
 
                 logger.info("Phase 2 fallback completed")
 
@@ -251,28 +371,32 @@ async def search_node(state: AgentState, config: RunnableConfig):
         # Using emit_intermediate_state would replace accumulated resources with
         # just the newly selected ones, causing flicker.
 
-        model = get_model(state)
+        model = get_model(state, "selection")
         ainvoke_kwargs = {}
         if model.__class__.__name__ in ["ChatOpenAI"]:
             ainvoke_kwargs["parallel_tool_calls"] = False
 
-        # Prepare search results message including Tako charts
-        search_message = f"Web search results: {search_results}"
-        if tako_results:
-            search_message += f"\n\nTako chart results (data visualizations): {tako_results}"
+        # Prepare search results message including Tako charts; the repr of
+        # dozens of results with full page content is slow to build
+        search_message = await run_cpu(_format_search_message, search_results, tako_results)
 
         # Prepare messages for ExtractResources call
         # If coming from Search tool, add search results as ToolMessage
         # Otherwise (from GenerateDataQuestions), add as SystemMessage
-        extract_messages = [
-            SystemMessage(
-                content="""
+        history_messages, history_summary, history_updates = await compact_history(
+            state, get_model(state, "editing"), config
+        )
+        state.update(history_updates)
+        extract_instructions = """
             You need to extract the 3-5 most relevant resources from the following search results.
             This includes both web resources and Tako chart visualizations.
             Tako charts are valuable data visualizations that should be prioritized when relevant.
             """
-            ),
-            *state["messages"],
+        if history_summary:
+            extract_instructions += f"\nSummary of the earlier conversation:\n{history_summary}\n"
+        extract_messages = [
+            SystemMessage(content=extract_instructions),
+            *history_messages,
         ]
 
         if ai_message.tool_calls and ai_message.tool_calls[0]["name"] == "Search":
@@ -291,18 +415,18 @@ async def search_node(state: AgentState, config: RunnableConfig):
 
         # Add status update for resource extraction
         state["logs"].append({"message": "Selecting most relevant resources...", "done": False})
-        await copilotkit_emit_state(config, state)
+        emit_state(config, state)
 
         # figure out which resources to use
-        response = await model.bind_tools(
-            [ExtractResources], tool_choice="ExtractResources", **ainvoke_kwargs
-        ).ainvoke(extract_messages, config)
+        extract_model = model.bind_tools([ExtractResources], tool_choice="ExtractResources", **ainvoke_kwargs)
+
+        response = await ainvoke_with_retries(extract_model, extract_messages, config)
 
         # Mark resource extraction as complete (cleared immediately after)
         state["logs"][-1]["done"] = True
 
         state["logs"] = []
-        await copilotkit_emit_state(config, state)
+        emit_state(config, state)
 
         ai_message_response = cast(AIMessage, response)
         resources = ai_message_response.tool_calls[0]["args"]["resources"]
@@ -337,9 +461,10 @@ async def search_node(state: AgentState, config: RunnableConfig):
                                 resource["content"] = tavily_item.get("content", "")
                                 break
 
-        # Generate iframe HTML for Tako charts that don't have it yet
+        # Store iframe HTML for Tako charts that don't have it yet
+        # (the HTML lives in the chart store; state only keeps its chart_id)
         for resource in resources:
-            if resource.get("resource_type") == "tako_chart" and not resource.get("iframe_html"):
+            if resource.get("resource_type") == "tako_chart" and not resource.get("chart_id"):
                 card_id = resource.get("card_id")
                 embed_url = resource.get("embed_url")
                 if card_id or embed_url:
@@ -348,7 +473,7 @@ async def search_node(state: AgentState, config: RunnableConfig):
                         embed_url=embed_url
                     )
                     if iframe_html:
-                        resource["iframe_html"] = iframe_html
+                        resource["chart_id"] = put_chart(iframe_html)
 
         # Enforce resource limit to prevent context bloat
         current_count = len(state["resources"])
@@ -406,7 +531,7 @@ async def search_node(state: AgentState, config: RunnableConfig):
             "message": f"Search encountered an error: {str(e)}",
             "done": True
         })
-        await copilotkit_emit_state(config, state)
+        emit_state(config, state)
 
         # Clear data_questions to prevent retry loops
         state["data_questions"] = []
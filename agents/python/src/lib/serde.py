@@ -0,0 +1,313 @@
+"""
+Checkpoint Serializer
+
+Delta-encoding serializer for checkpoints. Most of AgentState does not change
+between steps, but LangGraph re-serializes whole channel values (the complete
+message list, all resources, the report) at every checkpoint. This serializer
+moves large items (messages, resources, long strings such as the report) into
+content-addressed blobs, so each one is stored once and shared by every
+checkpoint that contains it; the checkpoint itself only keeps a small skeleton
+with blob references.
+
+Blobs and skeletons are compressed with zstd when the ``zstandard`` package is
+installed, otherwise with zlib. Payloads written by the default serializer
+still load, so existing checkpoint databases keep working.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DELTA_TYPE = "delta"
+# Items whose serialized size is at least this many bytes become blobs
+BLOB_MIN_BYTES = 256
+
+_MAGIC = b"D1"
+_REF_KEY = "__blob__"
+_CODEC_RAW, _CODEC_ZLIB, _CODEC_ZSTD = b"r", b"l", b"z"
+# Compressing tiny payloads costs more than it saves
+_COMPRESS_MIN_BYTES = 64
+# Recently blobbed message objects, so unchanged messages are not re-encoded
+_IDENTITY_CACHE_SIZE = 4096
+
+
+class _Codec:
+    """zstd if available, else zlib; decompression handles either."""
+
+    def __init__(self):
+        if zstandard is not None:
+            self._compressor = zstandard.ZstdCompressor(level=3)
+            self._decompressor = zstandard.ZstdDecompressor()
+        self.name = "zstd" if zstandard is not None else "zlib"
+
+    def compress(self, data: bytes) -> bytes:
+        if len(data) < _COMPRESS_MIN_BYTES:
+            return _CODEC_RAW + data
+        if zstandard is not None:
+            return _CODEC_ZSTD + self._compressor.compress(data)
+        return _CODEC_ZLIB + zlib.compress(data, 1)
+
+    def decompress(self, data: bytes) -> bytes:
+        codec, body = data[:1], data[1:]
+        if codec == _CODEC_RAW:
+            return body
+        if codec == _CODEC_ZLIB:
+            return zlib.decompress(body)
+        if codec == _CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("zstd-compressed checkpoint found but zstandard is not installed")
+            return self._decompressor.decompress(body)
+        raise ValueError(f"Unknown checkpoint codec: {codec!r}")
+
+
+class MemoryBlobStore:
+    """Blob store kept in process memory."""
+
+    def __init__(self):
+        self._blobs: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._blobs.get(key)
+
+    def put(self, key: str, data: bytes) -> bool:
+        """Store a blob unless present; returns True if it was new."""
+        with self._lock:
+            if key in self._blobs:
+                return False
+            self._blobs[key] = data
+            return True
+
+    def sweep(self, live: Set[str]) -> int:
+        """Delete blobs not in ``live``."""
+        with self._lock:
+            dead = [k for k in self._blobs if k not in live]
+            for key in dead:
+                del self._blobs[key]
+        return len(dead)
+
+    def size(self) -> int:
+        return len(self._blobs)
+
+
+class SqliteBlobStore:
+    """
+    Blob store in the ``checkpoint_blobs`` table of the checkpoint database.
+
+    Writes go through the SQLite checkpointer's connection: new blobs are
+    held in memory until the checkpointer stores them in the same transaction
+    as the checkpoints that refer to them. Reads use a separate read-only
+    connection, which WAL mode never blocks.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return self._conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._pending.get(key)
+            if data is not None:
+                return data
+            row = self._connection().execute(
+                "SELECT data FROM checkpoint_blobs WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, data: bytes) -> bool:
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending[key] = data
+        return True
+
+    def pending(self) -> Dict[str, bytes]:
+        """Blobs not yet written to the database."""
+        with self._lock:
+            return dict(self._pending)
+
+    def mark_stored(self, keys: Iterable[str]) -> None:
+        """Forget pending blobs once their transaction has committed."""
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+
+    def size(self) -> int:
+        with self._lock:
+            try:
+                stored = self._connection().execute("SELECT COUNT(*) FROM checkpoint_blobs").fetchone()[0]
+            except sqlite3.Error:
+                stored = 0
+            return stored + len(self._pending)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class DeltaSerializer:
+    """
+    Serializer that stores large checkpoint items as shared, compressed blobs.
+
+    Payload layout: magic, number of blob references, the references (raw
+    sha256 digests), the skeleton's serializer type, then the compressed
+    skeleton. References are readable without decompressing, which is what
+    blob garbage collection relies on.
+    """
+
+    def __init__(self, store=None, min_blob_bytes: int = BLOB_MIN_BYTES):
+        self.inner = JsonPlusSerializer()
+        self.store = store if store is not None else MemoryBlobStore()
+        self.min_blob_bytes = min_blob_bytes
+        self.codec = _Codec()
+        # Blobs referenced since the last collection; protected from it
+        self._recent: Set[str] = set()
+        # id(message) -> (message, blob key); holding the message keeps its id unique
+        self._identity: "OrderedDict[int, Tuple[BaseMessage, str]]" = OrderedDict()
+        self._stats = {"blobs_written": 0, "blob_bytes_written": 0, "blob_refs": 0, "skeleton_bytes": 0}
+
+    # SerializerProtocol
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        refs: List[str] = []
+        skeleton = self._extract(obj, refs, top=True)
+        inner_type, packed = self.inner.dumps_typed(skeleton)
+        body = bytes([len(inner_type)]) + inner_type.encode() + self.codec.compress(packed)
+        header = _MAGIC + struct.pack(">I", len(refs)) + b"".join(bytes.fromhex(r) for r in refs)
+        self._stats["blob_refs"] += len(refs)
+        self._stats["skeleton_bytes"] += len(body)
+        return DELTA_TYPE, header + body
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_ != DELTA_TYPE:
+            return self.inner.loads_typed(data)
+        (count,) = struct.unpack(">I", payload[2:6])
+        offset = 6 + 32 * count
+        type_length = payload[offset]
+        inner_type = payload[offset + 1 : offset + 1 + type_length].decode()
+        body = self.codec.decompress(payload[offset + 1 + type_length :])
+        skeleton = self.inner.loads_typed((inner_type, body))
+        return self._restore(skeleton)
+
+    # Blob extraction
+
+    def _extract(self, value: Any, refs: List[str], top: bool = False) -> Any:
+        if isinstance(value, dict):
+            return {k: self._extract(v, refs) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            items = [self._extract_item(v, refs) for v in value]
+            return items if isinstance(value, list) else tuple(items)
+        if isinstance(value, BaseMessage) and top:
+            return self._extract_item(value, refs)
+        if isinstance(value, str) and len(value) >= self.min_blob_bytes:
+            return self._to_blob(value, refs)
+        return value
+
+    def _extract_item(self, value: Any, refs: List[str]) -> Any:
+        """List items that are messages or large dicts (resources) become blobs."""
+        if isinstance(value, (BaseMessage, dict)):
+            return self._to_blob(value, refs)
+        return self._extract(value, refs)
+
+    def _to_blob(self, value: Any, refs: List[str]) -> Any:
+        # Messages are never modified once in the state, so a message object
+        # seen before maps to the same blob. Dicts may be mutated in place.
+        if isinstance(value, BaseMessage):
+            cached = self._identity.get(id(value))
+            if cached is not None and cached[0] is value:
+                self._identity.move_to_end(id(value))
+                refs.append(cached[1])
+                self._recent.add(cached[1])
+                return {_REF_KEY: cached[1]}
+        inner_type, packed = self.inner.dumps_typed(value)
+        if inner_type != "msgpack" or len(packed) < self.min_blob_bytes:
+            return value
+        key = hashlib.sha256(packed).hexdigest()
+        if self.store.put(key, self.codec.compress(packed)):
+            self._stats["blobs_written"] += 1
+            self._stats["blob_bytes_written"] += len(packed)
+        refs.append(key)
+        self._recent.add(key)
+        if isinstance(value, BaseMessage):
+            self._identity[id(value)] = (value, key)
+            if len(self._identity) > _IDENTITY_CACHE_SIZE:
+                self._identity.popitem(last=False)
+        return {_REF_KEY: key}
+
+    def _restore(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            if len(value) == 1 and _REF_KEY in value:
+                return self._load_blob(value[_REF_KEY])
+            return {k: self._restore(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._restore(v) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self._restore(v) for v in value)
+        return value
+
+    def _load_blob(self, key: str) -> Any:
+        data = self.store.get(key)
+        if data is None:
+            raise KeyError(f"Checkpoint blob {key[:12]} is missing")
+        return self.inner.loads_typed(("msgpack", self.codec.decompress(data)))
+
+    # Garbage collection
+
+    @staticmethod
+    def refs(payload: bytes) -> List[str]:
+        """Blob keys referenced by a delta payload."""
+        if payload[:2] != _MAGIC:
+            return []
+        (count,) = struct.unpack(">I", payload[2:6])
+        return [payload[6 + 32 * i : 6 + 32 * (i + 1)].hex() for i in range(count)]
+
+    def live_keys(self, payloads: Iterable[Tuple[str, bytes]]) -> Set[str]:
+        """
+        Blob keys still in use, given every stored checkpoint payload.
+
+        Blobs referenced by anything serialized since the previous call are
+        included too, which covers checkpoints serialized but not yet stored
+        while the payloads were being gathered.
+        """
+        live: Set[str] = set()
+        for type_, payload in payloads:
+            if type_ == DELTA_TYPE and payload:
+                live.update(self.refs(payload))
+        live |= self._recent
+        self._recent = set()
+        # Blobs outside the live set are about to be deleted
+        for object_id, (_, key) in list(self._identity.items()):
+            if key not in live:
+                del self._identity[object_id]
+        return live
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["codec"] = self.codec.name
+        stats["blobs"] = self.store.size()
+        return stats
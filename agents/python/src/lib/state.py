@@ -16,7 +16,8 @@ class Resource(TypedDict):
     description: str
     resource_type: NotRequired[Literal["web", "tako_chart"]]
     card_id: NotRequired[str]  # Tako card identifier for visualizations
-    iframe_html: NotRequired[str]
+    chart_id: NotRequired[str]  # Chart store key; HTML is served at /charts/{chart_id}
+    iframe_html: NotRequired[str]  # Legacy: inline chart HTML from older threads
     source: NotRequired[str]
     embed_url: NotRequired[str]  # Tako embed URL for iframe src
 
@@ -47,3 +48,5 @@ class AgentState(MessagesState):
     logs: List[Log]
     data_questions: NotRequired[List[DataQuestion]]
     explore_context: NotRequired[str]
+    history_summary: NotRequired[str]  # Rolling summary of compacted older turns
+    history_summary_turns: NotRequired[int]  # Number of turns covered by history_summary
@@ -0,0 +1,273 @@
+"""
+Tracing
+
+Span-based tracing of graph nodes, LLM calls and outbound calls (MCP tools,
+Tavily searches, downloads), tied to the turn's thread id. Spans nest through
+a context variable, so the tasks a node starts (parallel searches, chart
+fetches) are recorded as its children.
+
+Enable with TRACE_EXPORTER:
+
+- "jsonl": one JSON span per line appended to TRACE_FILE
+- "otlp": OTLP/HTTP JSON batches posted to TRACE_OTLP_ENDPOINT (any
+  OpenTelemetry collector, or a stand-in that accepts /v1/traces)
+
+With no exporter, span() is a no-op. Spans are exported from a background
+thread in batches, never on the request path. benchmarks/trace_timeline.py
+renders a trace from the JSONL file as a timeline.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "research-agent")
+# Spans per export batch, and the longest a finished span waits to be exported
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "256"))
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "2"))
+
+TRACING_ENABLED = TRACE_EXPORTER in ("jsonl", "otlp")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """One timed operation; ``thread_id`` is inherited from the parent span."""
+
+    __slots__ = (
+        "name", "kind", "trace_id", "span_id", "parent_id", "thread_id",
+        "start_ns", "end_ns", "attributes", "error",
+    )
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.thread_id = parent.thread_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set_thread_id(self, thread_id: Optional[str]) -> None:
+        if thread_id and not self.thread_id:
+            self.thread_id = thread_id
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        _exporter.submit(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "thread_id": self.thread_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def start_span(name: str, kind: str = "internal", thread_id: Optional[str] = None, **attributes: Any) -> Optional[Span]:
+    """
+    Start a span under the current one without making it current.
+
+    For operations that begin and end in separate callbacks (LLM calls);
+    the caller must call ``end()``. Returns None when tracing is disabled.
+    """
+    if not TRACING_ENABLED:
+        return None
+    span_ = Span(name, kind, _current_span.get(), attributes)
+    span_.set_thread_id(thread_id)
+    return span_
+
+
+_DISABLED = nullcontext()
+
+
+def span(name: str, kind: str = "internal", thread_id: Optional[str] = None, **attributes: Any) -> ContextManager[Optional[Span]]:
+    """Record the enclosed block as a span, nested under the current span."""
+    if not TRACING_ENABLED:
+        return _DISABLED
+    return _span(name, kind, thread_id, attributes)
+
+
+@contextmanager
+def _span(name: str, kind: str, thread_id: Optional[str], attributes: Dict[str, Any]) -> Iterator[Span]:
+    parent = _current_span.get()
+    span_ = Span(name, kind, parent, attributes)
+    span_.set_thread_id(thread_id)
+    if parent is not None:
+        # A request span learns the thread id from the first node run under it
+        parent.set_thread_id(span_.thread_id)
+    token = _current_span.set(span_)
+    try:
+        yield span_
+    except Exception as e:
+        span_.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        span_.end()
+
+
+def thread_id_from_config(config: Optional[Dict[str, Any]]) -> Optional[str]:
+    configurable = (config or {}).get("configurable") or {}
+    thread_id = configurable.get("thread_id")
+    return str(thread_id) if thread_id is not None else None
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a root span per HTTP request, streamed body
+    included, for paths under one of ``prefixes`` (probes stay untraced).
+    """
+
+    def __init__(self, app, prefixes: Tuple[str, ...] = ("/",)):
+        self.app = app
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING_ENABLED or scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+        with span(f"{scope['method']} {scope['path']}", kind="server"):
+            await self.app(scope, receive, send)
+
+
+class _Exporter:
+    """Batches finished spans on a queue and writes them from a daemon thread."""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=10000)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {"exported": 0, "dropped": 0, "errors": 0}
+
+    def submit(self, span_: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span_)
+        except queue.Full:
+            self._stats["dropped"] += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Span] = []
+            deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                self._export(batch)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Export everything queued and stop the exporter (called at interpreter exit)."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _export(self, batch: List[Span]) -> None:
+        try:
+            if TRACE_EXPORTER == "otlp":
+                httpx.post(TRACE_OTLP_ENDPOINT, json=_to_otlp(batch), timeout=5.0).raise_for_status()
+            else:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(s.to_dict(), default=str) + "\n" for s in batch))
+            self._stats["exported"] += len(batch)
+        except Exception as e:  # pylint: disable=broad-except
+            self._stats["errors"] += 1
+            logger.warning(f"Trace export of {len(batch)} spans failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+_OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(batch: List[Span]) -> Dict[str, Any]:
+    spans = []
+    for s in batch:
+        attributes = {**s.attributes, "span.kind": s.kind}
+        if s.thread_id:
+            attributes["thread_id"] = s.thread_id
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": _OTLP_KINDS.get(s.kind, 1),
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        spans.append(otlp_span)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "src.lib.tracing"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+_exporter = _Exporter()
+
+
+def get_tracing_stats() -> Dict[str, int]:
+    """Spans exported, dropped (queue full) and failed export batches."""
+    return _exporter.stats()
@@ -0,0 +1,101 @@
+"""
+Warm-up
+
+Prepares a fresh worker before it takes traffic: connects and initializes the
+MCP session, builds the Tavily client and the model clients (importing their
+SDKs), and opens a pooled connection to the model provider. Runs in the
+background from the server lifespan; the /ready endpoint reports ready only
+once it has finished, so load balancers never route users to a cold worker.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from src.lib.cassette import REPLAYING
+from src.lib.mcp_integration import TAKO_API_TOKEN, warm_up_mcp_client
+from src.lib.model import MODEL_PROFILES, get_model, warm_up_connections
+from src.lib.search import get_tavily_client
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# Upper bound for the whole warm-up; steps still running are abandoned
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "20"))
+
+_status: Dict[str, Any] = {"ready": False, "steps": {}}
+
+
+async def _warm_models() -> None:
+    loop = asyncio.get_running_loop()
+    # Building a client imports its provider SDK, which is slow and blocking
+    for profile in MODEL_PROFILES:
+        await loop.run_in_executor(None, get_model, {}, profile)
+    await warm_up_connections()
+
+
+async def _warm_tavily() -> None:
+    if REPLAYING:
+        raise LookupError("replaying a cassette")
+    if not os.getenv("TAVILY_API_KEY"):
+        raise LookupError("TAVILY_API_KEY not set")
+    await asyncio.get_running_loop().run_in_executor(None, get_tavily_client)
+
+
+async def _warm_mcp() -> None:
+    if REPLAYING:
+        raise LookupError("replaying a cassette")
+    if not TAKO_API_TOKEN:
+        raise LookupError("TAKO_API_TOKEN not set")
+    await warm_up_mcp_client()
+
+
+_STEPS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "mcp": _warm_mcp,
+    "tavily": _warm_tavily,
+    "models": _warm_models,
+}
+
+
+async def _run_step(name: str, step: Callable[[], Awaitable[None]]) -> None:
+    started = time.perf_counter()
+    try:
+        await step()
+        status = "ok"
+    except LookupError as e:
+        status = f"skipped: {e}"
+    except Exception as e:  # pylint: disable=broad-except
+        status = f"failed: {e}"
+        logger.warning(f"Warm-up step '{name}' failed: {e}")
+    _status["steps"][name] = {"status": status, "seconds": round(time.perf_counter() - started, 3)}
+
+
+async def warm_up(timeout: float = WARMUP_TIMEOUT_SECONDS) -> None:
+    """
+    Run all warm-up steps concurrently, then mark the worker ready.
+
+    Failed or timed-out steps do not block readiness; the first request
+    simply pays for them as it would without warm-up.
+    """
+    started = time.perf_counter()
+    if WARMUP_ENABLED:
+        tasks = [asyncio.ensure_future(_run_step(name, step)) for name, step in _STEPS.items()]
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        for name in _STEPS:
+            _status["steps"].setdefault(name, {"status": "timed out", "seconds": timeout})
+    _status["ready"] = True
+    _status["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Warm-up finished in {_status['seconds']:.2f}s: {_status['steps']}")
+
+
+def is_ready() -> bool:
+    return _status["ready"]
+
+
+def get_warmup_status() -> Dict[str, Any]:
+    """Readiness flag plus status and duration of each warm-up step."""
+    return {"ready": _status["ready"], "seconds": _status.get("seconds"), "steps": dict(_status["steps"])}
@@ -0,0 +1,30 @@
+import asyncio
+
+from src.lib.cache import TTLCache
+
+
+def test_get_returns_a_copy():
+    cache = TTLCache("test", ttl_seconds=60)
+
+    async def run():
+        result = {"results": [{"url": "https://example.com"}]}
+        await cache.set("key", result)
+        result["results"].clear()
+        first = await cache.get("key")
+        first["results"].append({"url": "https://other.example.com"})
+        return await cache.get("key")
+
+    assert asyncio.run(run()) == {"results": [{"url": "https://example.com"}]}
+
+
+def test_disk_tier_round_trip(tmp_path):
+    async def run():
+        await TTLCache("test", ttl_seconds=60, disk_dir=str(tmp_path)).set("key", {"answer": 42})
+        # A new cache (another worker, or after a restart) reads the disk tier
+        cache = TTLCache("test", ttl_seconds=60, disk_dir=str(tmp_path))
+        return await cache.get("key"), await cache.get("missing"), cache.stats()
+
+    value, missing, stats = asyncio.run(run())
+    assert value == {"answer": 42}
+    assert missing is None
+    assert (stats["disk_hits"], stats["misses"]) == (1, 1)
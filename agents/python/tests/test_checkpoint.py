@@ -0,0 +1,38 @@
+from langgraph.checkpoint.base import create_checkpoint, empty_checkpoint
+
+from src.lib.checkpoint import BoundedMemorySaver
+
+
+def _put(saver, config, checkpoint, step, values):
+    versions = {channel: f"{step:032}.{channel}" for channel in values}
+    checkpoint = create_checkpoint(checkpoint, None, step)
+    checkpoint["channel_values"] = {**checkpoint["channel_values"], **values}
+    checkpoint["channel_versions"] = {**checkpoint["channel_versions"], **versions}
+    saved = saver.put(config, checkpoint, {"step": step}, versions)
+    return saved, checkpoint
+
+
+def test_prune_drops_unreferenced_blobs_without_loading_checkpoints(monkeypatch):
+    saver = BoundedMemorySaver(keep_per_thread=2, ttl_seconds=0)
+    config = {"configurable": {"thread_id": "t", "checkpoint_ns": ""}}
+    checkpoint = empty_checkpoint()
+    config, checkpoint = _put(saver, config, checkpoint, 1, {"report": "r1", "messages": ["m1"]})
+    config, checkpoint = _put(saver, config, checkpoint, 2, {"messages": ["m1", "m2"]})
+
+    def fail(*args):
+        raise AssertionError("kept checkpoints were deserialized")
+
+    monkeypatch.setattr(saver.serde, "loads_typed", fail)
+    config, checkpoint = _put(saver, config, checkpoint, 3, {"messages": ["m1", "m2", "m3"]})
+    config, checkpoint = _put(saver, config, checkpoint, 4, {"report": "r4"})
+
+    assert len(saver.storage["t"][""]) == 2
+    # Steps 3 and 4 are kept; step 3 still refers to the step 1 report
+    assert sorted(key[2:] for key in saver.blobs) == [
+        ("messages", f"{3:032}.messages"),
+        ("report", f"{1:032}.report"),
+        ("report", f"{4:032}.report"),
+    ]
+
+    saver.delete_thread("t")
+    assert not saver.blobs and not saver._versions and not saver._refs
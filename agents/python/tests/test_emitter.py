@@ -0,0 +1,44 @@
+import asyncio
+
+from src.lib import emitter
+from src.lib.emitter import StateEmitter, get_emit_stats
+
+
+def test_emit_during_send_goes_out_without_flush(monkeypatch):
+    sent = []
+
+    async def slow_emit_state(config, state):
+        sent.append(dict(state))
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(emitter, "copilotkit_emit_state", slow_emit_state)
+
+    async def run():
+        state_emitter = StateEmitter({}, window_seconds=0.01)
+        state_emitter.emit({}, {"step": 1})
+        await asyncio.sleep(0.02)  # first send in flight
+        state_emitter.emit({}, {"step": 2})
+        await asyncio.sleep(0.1)
+        return sent
+
+    assert asyncio.run(run()) == [{"step": 1}, {"step": 2}]
+
+
+def test_emit_stats_report_bytes(monkeypatch):
+    async def emit_state(config, state):
+        pass
+
+    monkeypatch.setattr(emitter, "copilotkit_emit_state", emit_state)
+    monkeypatch.setattr(emitter, "EMIT_SIZE_SAMPLE_EVERY", 1)
+    before = get_emit_stats()
+
+    async def run():
+        state_emitter = StateEmitter({}, window_seconds=0)
+        state_emitter.emit({}, {"logs": ["x" * 100]})
+        await state_emitter.flush()
+
+    asyncio.run(run())
+    stats = get_emit_stats()
+    assert stats["sent"] == before["sent"] + 1
+    assert stats["bytes"] > before["bytes"]
+    assert {"requested", "sent", "coalesced", "avg_bytes", "bytes"} <= stats.keys()
@@ -0,0 +1,28 @@
+from src.lib.entity_index import EntityIndex
+
+
+def _index(*names):
+    index = EntityIndex()
+    index.learn({"entities": [{"name": name} for name in names], "metrics": [{"name": "GDP"}]})
+    return index
+
+
+def test_canonicalize_rewrites_exact_matches():
+    index = _index("China", "United States")
+    assert index.canonicalize("china gdp since 1960") == "China GDP since 1960"
+    assert index.canonicalize("UNITED STATES gdp.") == "United States GDP."
+
+
+def test_canonicalize_keeps_unindexed_near_miss_names():
+    index = _index("Australia", "Nigeria", "Slovenia")
+    assert index.canonicalize("Austria GDP since 1990") == "Austria GDP since 1990"
+    assert index.canonicalize("austria vs australia gdp") == "austria vs Australia GDP"
+    assert index.canonicalize("niger gdp") == "niger GDP"
+    assert index.canonicalize("Slovakia vs slovenia gdp") == "Slovakia vs Slovenia GDP"
+
+
+def test_context_still_corrects_misspellings():
+    index = _index("Australia")
+    assert "Australia" in index.context_for("australai gdp")
+    assert [entry["name"] for _, _, entry in index.match("australai gdp")] == ["Australia", "GDP"]
+    assert [entry["name"] for _, _, entry in index.match("australai gdp", fuzzy=False)] == ["GDP"]
@@ -0,0 +1,25 @@
+import { NextRequest } from "next/server";
+
+// Chart HTML is kept out of agent state and served by the agent backend;
+// proxy it so the browser does not need to know the agent's URL.
+const agentBaseUrl = (
+  process.env.REMOTE_ACTION_URL || "http://localhost:2024/copilotkit"
+).replace(/\/copilotkit\/?$/, "");
+
+export const GET = async (
+  _req: NextRequest,
+  { params }: { params: Promise<{ chartId: string }> }
+) => {
+  const { chartId } = await params;
+  const response = await fetch(
+    `${agentBaseUrl}/charts/${encodeURIComponent(chartId)}`
+  );
+
+  return new Response(response.body, {
+    status: response.status,
+    headers: {
+      "Content-Type": response.headers.get("Content-Type") || "text/html",
+      "Cache-Control": response.headers.get("Cache-Control") || "no-store",
+    },
+  });
+};
@@ -298,13 +298,21 @@ export function ResearchCanvas() {
             <DialogHeader>
               <DialogTitle>{selectedChart?.title}</DialogTitle>
             </DialogHeader>
-            {selectedChart && selectedChart.iframe_html && (
+            {selectedChart && selectedChart.chart_id && (
+              <iframe
+                className="w-full min-h-[500px] border-0"
+                src={`/api/charts/${selectedChart.chart_id}`}
+                title={selectedChart.title}
+                sandbox="allow-scripts"
+              />
+            )}
+            {selectedChart && !selectedChart.chart_id && selectedChart.iframe_html && (
               <div
                 className="w-full min-h-[500px]"
                 dangerouslySetInnerHTML={{ __html: selectedChart.iframe_html }}
               />
             )}
-            {selectedChart && !selectedChart.iframe_html && (
+            {selectedChart && !selectedChart.chart_id && !selectedChart.iframe_html && (
               <div className="p-8 text-center text-gray-500">
                 Chart preview not available
               </div>
@@ -5,6 +5,7 @@ export type Resource = {
   content?: string;
   resource_type: 'web' | 'tako_chart';
   card_id?: string;
+  chart_id?: string;
   iframe_html?: string;
   source: string;
 };